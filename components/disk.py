@@ -19,14 +19,23 @@
 """
 Disk components
 - Threaded recursive disk browser for searching media files in folder tree.
+- Persistent scan index of already browsed directories.
+- Backpressure between disk browser and media parser.
+- Generation counter for cancellation of media adding.
 - Threaded dir/file remover (sends files to Trash)
+- Threaded checker of missing playlist files
+- Threaded live watcher of media library folders
 """
 
 import os
 import sys
+import time
 import logging
+import threading
+import concurrent.futures
 
 import send2trash
+import ujson
 from PyQt5.QtCore import *
 
 import tools
@@ -36,70 +45,446 @@ from components.translator import tr
 logger = logging.getLogger(__name__)
 
 
+def scanDir(path, names_filter):
+    """
+    Reads content of given directory using os.scandir().
+    Hidden directories (starting with dot) are skipped. Both dirs and files are sorted.
+    @type path: unicode
+    @param names_filter: media file extensions, i.e. ('.mp3', '.flac')
+    @type names_filter: tuple of str
+    @return: (dirs, symlinked dirs, media files) or None if directory cannot be read
+    @rtype: (list of unicode, list of unicode, list of unicode) or None
+    """
+    dirs, links, media = [], [], []
+    try:
+        for entry in os.scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if entry.name[0] != ".":
+                    dirs.append(entry.name)
+                    if entry.is_symlink():
+                        links.append(entry.name)
+            elif entry.name.lower().endswith(names_filter):
+                media.append(entry.name)
+    except OSError:
+        logger.warning("Unable to list directory '%s'", path)
+        return None
+
+    dirs.sort()
+    links.sort()
+    media.sort()
+    return dirs, links, media
+
+
+class Backpressure(object):
+    """
+    Limits number of media on their way from disk browser to media player.
+    Browser acquires one credit per media before sending it to parser, parser releases credits
+    when media leave it (are sent to player or thrown away). When limit is reached, browser waits,
+    so scanning of huge folder trees can't outpace parsing and memory stays flat.
+    Shared by browser and parser threads.
+    """
+
+    def __init__(self, limit):
+        """
+        @param limit: max number of media sent to parser and not released yet
+        @type limit: int
+        """
+        self.limit = max(1, limit)
+        self.waited = 0.0                   # total time (s) browser has been waiting for parser
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, count, stopped):
+        """
+        Called from browser thread. Blocks until there is room for given number of media.
+        Batch larger than limit is let through when nothing is pending.
+        @type count: int
+        @param stopped: callable, waiting is abandoned when it returns True
+        @return: False when waiting has been abandoned
+        @rtype: bool
+        """
+        with self._condition:
+            if self._pending and self._pending + count > self.limit:
+                start_time = time.time()
+                while self._pending and self._pending + count > self.limit:
+                    if stopped():
+                        return False
+                    self._condition.wait(0.1)
+                self.waited += time.time() - start_time
+            self._pending += count
+            return True
+
+    def release(self, count):
+        """
+        Called from parser thread.
+        @type count: int
+        """
+        with self._condition:
+            self._pending = max(0, self._pending - count)
+            self._condition.notify_all()
+
+    def pending(self):
+        return self._pending
+
+
+class Generation(object):
+    """
+    Generation counter of media adding, shared by main thread, disk browser and media parser.
+    Every new adding (or cancellation) starts new generation. Work is tagged by generation it belongs to
+    and work of older generations is abandoned as soon as it is noticed, so nobody has to wait for it.
+    """
+
+    def __init__(self):
+        self.current = 0
+
+    def next(self):
+        """
+        Called from main thread only. All work in progress becomes stale.
+        @return: new generation
+        @rtype: int
+        """
+        self.current += 1
+        return self.current
+
+    def isStale(self, generation):
+        return generation != self.current
+
+
+class ScanIndex(object):
+    """
+    Persistent on-disk index of browsed directories.
+    Each record is keyed by directory path and holds directory mtime, its sub-directories and found media files.
+    When directory mtime does not change, cached listing is replayed instead of reading the directory again.
+    listDir() may be called from multiple walker threads at once, records are guarded by mutex.
+    """
+
+    VERSION = 1
+    MTIME_GUARD = 2 * 10**9            # in ns, dirs changed within last 2 sec are not cached (coarse FS timestamps)
+
+    def __init__(self, index_file, names_filter):
+        """
+        @param index_file: where the index is stored (usually next to medialib.dat)
+        @type index_file: unicode
+        @param names_filter: file extensions the index is built for
+        @type names_filter: tuple of str
+        """
+        self.index_file = index_file
+        self.names_filter = names_filter
+        self.hits = 0
+        self.misses = 0
+
+        self._records = {}                  # path: [mtime_ns, dirs, symlinked_dirs, media_files]
+        self.loaded = False
+        self._dirty = False
+        self._mutex = QMutex()
+
+    def load(self):
+        """
+        Loads index records from disk. Invalid or outdated index file is ignored and index is rebuilt.
+        Called from scanner thread before any walker thread is started (or from folder watcher thread).
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.isfile(self.index_file):
+            logger.debug("No scan index file found, index will be created.")
+            return
+
+        try:
+            with open(self.index_file, 'r') as f:
+                data = ujson.load(f)
+        except (IOError, ValueError):
+            logger.exception("Unable to load scan index from '%s', index will be rebuilt.", self.index_file)
+            return
+
+        if data.get('version') != self.VERSION or tuple(data.get('filter', ())) != self.names_filter:
+            logger.debug("Scan index is outdated (version or filter changed), index will be rebuilt.")
+            self._dirty = True
+            return
+
+        self._records = data.get('dirs', {})
+        logger.debug("Scan index loaded, %s directories cached.", len(self._records))
+
+    def save(self):
+        """
+        Dumps index records to disk if anything changed. File is written atomically (write-temp-then-rename).
+        Called from scanner thread when all walker threads are finished (or from folder watcher thread).
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        if not self._dirty:
+            return
+
+        tmp_file = self.index_file + ".tmp"
+        data = {'version': self.VERSION, 'filter': self.names_filter, 'dirs': self._records}
+        try:
+            with open(tmp_file, 'w') as f:
+                ujson.dump(data, f)
+            os.replace(tmp_file, self.index_file)
+        except (IOError, OSError):
+            logger.exception("Unable to save scan index to '%s'", self.index_file)
+        else:
+            self._dirty = False
+            logger.debug("Scan index saved, %s directories cached.", len(self._records))
+
+    def resetCounters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def listDir(self, path):
+        """
+        Returns content of given directory - from cache if directory mtime has not changed, else from disk.
+        Hidden directories (starting with dot) are skipped. Both dirs and files are sorted.
+        @type path: unicode
+        @return: (dirs, symlinked dirs, media files) or None if directory cannot be read
+        @rtype: (list of unicode, list of unicode, list of unicode) or None
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mutexLocker = QMutexLocker(self._mutex)
+            self.forget(path)
+            return None
+
+        mutexLocker = QMutexLocker(self._mutex)
+        record = self._records.get(path)
+        if record is not None and record[0] == mtime:
+            self.hits += 1
+            return record[1], record[2], record[3]
+
+        self.misses += 1
+        mutexLocker.unlock()
+
+        listing = scanDir(path, self.names_filter)
+        if listing is None:
+            return None
+
+        mutexLocker.relock()
+        # removed sub-directories must not stay in the index
+        if record is not None:
+            for ddir in set(record[1]).difference(listing[0]):
+                self.forget(os.path.join(path, ddir))
+
+        if int(time.time() * 10**9) - mtime > self.MTIME_GUARD:
+            self._records[path] = [mtime, listing[0], listing[1], listing[2]]
+            self._dirty = True
+
+        return listing
+
+    def forget(self, path):
+        """
+        Removes given directory and all its cached sub-directories from the index.
+        Caller must hold the index mutex.
+        @type path: unicode
+        """
+        stack = [path]
+        while stack:
+            ddir_path = stack.pop()
+            record = self._records.pop(ddir_path, None)
+            if record is not None:
+                self._dirty = True
+                stack.extend(os.path.join(ddir_path, ddir) for ddir in record[1])
+
+
 class RecursiveBrowser(QObject):
     """
     Recursive disk browser for searching media files in folder tree.
     Data are transferred via Signal/Slot mechanism.
     Runs in separated thread!
-    Worker method: RecursiveBrowser.scanFiles(unicode_path)
+    Worker method: RecursiveBrowser.scanFiles(unicode_path, generation)
     """
 
-    parseDataSignal = pyqtSignal(list)
+    parseDataSignal = pyqtSignal(list, int)         # (paths, generation), empty list is end flag
     errorSignal = pyqtSignal(int, str, str)
 
-    def __init__(self, names_filter):
+    SCAN_THREADS = 8                # default number of walker threads for parallel scan
+    BATCH_SIZE = 256                # media from small folders are sent to parser in batches of this size ...
+    BATCH_LATENCY = 100             # ... or when the oldest media in batch waits for this long (ms)
+    MAX_PENDING = 10000             # default max number of media sent to parser and not parsed yet
+
+    def __init__(self, names_filter, index_file=None, generation=None):
         """
         @param names_filter: Which files or file extensions we looking for.
         @type names_filter: tuple of str
+        @param index_file: path to persistent scan index, index is not used when None
+        @type index_file: unicode
+        @param generation: generation counter of media adding shared with parser
+        @type generation: Generation
         """
         super(RecursiveBrowser, self).__init__()
-        self._stop = False
+        self.generation = generation or Generation()
 
         self.names_filter = tuple([ext.replace('*', '') for ext in names_filter])           # i.e. remove * from *.mp3
+        self.index = ScanIndex(index_file, self.names_filter) if index_file else None
+        max_pending = QSettings().value("components/disk/RecursiveBrowser/max_pending", self.MAX_PENDING, int)
+        self.backpressure = Backpressure(max_pending)           # released by media parser
 
         logger.debug("Recursive disk browser initialized.")
 
-    @pyqtSlot(str)
-    def scanFiles(self, target_dir):
+    @pyqtSlot(str, int)
+    def scanFiles(self, target_dir, generation):
         """
         Thread worker! Called from main thread via signal/slot.
         The final data are sent to media parser in another thread.
+        Scanning is abandoned as soon as given generation becomes stale.
         @type target_dir: unicode
+        @param generation: generation of media adding, see Generation
+        @type generation: int
         """
-        self._stop = False
+        if self.generation.isStale(generation):
+            logger.debug("Scan request of cancelled media adding thrown away.")
+            return
+
         target_dir = os.path.abspath(target_dir)
         if not os.path.exists(target_dir):
             logger.error("Path given to RecursiveDiskBrowser doesn't exist!")
             self.errorSignal.emit(tools.ErrorMessages.ERROR, tr['SCANNER_DIR_NOT_FOUND_ERROR'], target_dir)
-            self.parseDataSignal.emit([])             # end flag for media parser
+            self.parseDataSignal.emit([], generation)             # end flag for media parser
             return
 
         # if target dir is already a file
         if target_dir.lower().endswith(self.names_filter) and os.path.isfile(target_dir):
             logger.debug("Scanned target dir is a file. Sending path and finish_parser flag.")
-            self.parseDataSignal.emit([target_dir, ])
+            self._sendBatch([target_dir, ], generation)
         else:
             logger.debug("Starting recursive file-search and parsing.")
-            follow_sym = QSettings().value("components/disk/RecursiveBrowser/follow_symlinks", False, bool)
-            for root, dirs, files in os.walk(target_dir, followlinks=follow_sym):
-                if self._stop:
+            settings = QSettings()
+            follow_sym = settings.value("components/disk/RecursiveBrowser/follow_symlinks", False, bool)
+            parallel = settings.value("components/disk/RecursiveBrowser/parallel_scan", False, bool)
+
+            if self.index and not self.index.loaded:
+                self.index.load()
+
+            if parallel:
+                n_threads = settings.value("components/disk/RecursiveBrowser/scan_threads", self.SCAN_THREADS, int)
+                walker = self._parallelWalk(target_dir, follow_sym, max(1, n_threads))
+            elif self.index:
+                walker = self._indexedWalk(target_dir, follow_sym)
+            else:
+                walker = self._walk(target_dir, follow_sym)
+
+            # media from small folders are coalesced, first batch is sent immediately, so playback starts soon
+            batch = []
+            batch_time = 0
+            n_batches = 0
+            self.backpressure.waited = 0.0
+            for root, files in walker:
+                if self.generation.isStale(generation):
                     logger.debug("Recursive search stopped!")
+                    walker.close()
                     break
 
-                # remove dirs starting with dot and sort the result
-                for i, ddir in reversed(list(enumerate(dirs))):
-                    if ddir[0] == ".":
-                        del dirs[i]
-                dirs.sort()
-
                 # find all music files in current rootdir
-                music = [os.path.join(root, ffile) for ffile in files if ffile.lower().endswith(self.names_filter)]
-                if music:
-                    music.sort()
-                    self.parseDataSignal.emit(music)
+                if files:
+                    if not batch:
+                        batch_time = time.time()
+                    batch.extend([os.path.join(root, ffile) for ffile in files])
+                    if not n_batches or len(batch) >= self.BATCH_SIZE or \
+                            (time.time() - batch_time) * 1000 >= self.BATCH_LATENCY:
+                        self._sendBatch(batch, generation)
+                        batch = []
+                        n_batches += 1
+
+            if batch:
+                self._sendBatch(batch, generation)
+                n_batches += 1
+            logger.debug("Found media sent in %s batches, waited %.2fs for parser.",
+                         n_batches, self.backpressure.waited)
+
+            if self.index:
+                logger.debug("Scan index: %s hits, %s misses.", self.index.hits, self.index.misses)
+                self.index.resetCounters()
+                self.index.save()
+
+        if not self.generation.isStale(generation):
+            logger.debug("Recursive search finished, sending finish_parser flag.")
+            self.parseDataSignal.emit([], generation)
+
+    def _sendBatch(self, paths, generation):
+        """
+        Sends media files to parser, waits when too many media are already waiting for parsing.
+        Nothing is sent when generation becomes stale.
+        @type paths: list of unicode
+        @type generation: int
+        """
+        if self.backpressure.acquire(len(paths), lambda: self.generation.isStale(generation)):
+            if self.generation.isStale(generation):
+                self.backpressure.release(len(paths))
+            else:
+                self.parseDataSignal.emit(paths, generation)
+
+    def _walk(self, target_dir, follow_sym):
+        """
+        Walks whole folder tree with os.walk() and yields found media files in each directory.
+        @return: generator of (root, sorted media file names)
+        """
+        for root, dirs, files in os.walk(target_dir, followlinks=follow_sym):
+            # remove dirs starting with dot and sort the result
+            for i, ddir in reversed(list(enumerate(dirs))):
+                if ddir[0] == ".":
+                    del dirs[i]
+            dirs.sort()
+
+            yield root, sorted([ffile for ffile in files if ffile.lower().endswith(self.names_filter)])
+
+    def _indexedWalk(self, target_dir, follow_sym):
+        """
+        Walks folder tree in the same (top-down, sorted) order as _walk(),
+        but directory listings are taken from scan index when directory has not changed.
+        @return: generator of (root, sorted media file names)
+        """
+        stack = [target_dir]
+        while stack:
+            root = stack.pop()
+            listing = self.index.listDir(root)
+            if listing is None:
+                continue
 
-        logger.debug("Recursive search finished, sending finish_parser flag.")
-        self.parseDataSignal.emit([])
+            dirs, links, files = listing
+            yield root, files
+
+            for ddir in reversed(dirs):
+                if follow_sym or ddir not in links:
+                    stack.append(os.path.join(root, ddir))
+
+    def _parallelWalk(self, target_dir, follow_sym, n_threads):
+        """
+        Walks folder tree in the same (top-down, sorted) order as _walk(), but directories are listed
+        by os.scandir() in a bounded thread pool. Whenever directory is listed, all its sub-directories are
+        submitted to the pool at once, so sibling directories are read concurrently.
+        Useful for high-latency (network) file systems, where walking is latency-bound, not CPU-bound.
+        @param n_threads: max number of concurrent directory listings
+        @return: generator of (root, sorted media file names)
+        """
+        def list_dir(path):
+            return self.index.listDir(path) if self.index else scanDir(path, self.names_filter)
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_threads)
+        stack = [(target_dir, pool.submit(list_dir, target_dir))]
+        try:
+            while stack:
+                root, future = stack.pop()
+                listing = future.result()
+                if listing is None:
+                    continue
+
+                dirs, links, files = listing
+                yield root, files
+
+                # submit in sorted order (pool is FIFO), but push reversed, so first sub-dir is popped first
+                children = [os.path.join(root, ddir) for ddir in dirs if follow_sym or ddir not in links]
+                futures = [(path, pool.submit(list_dir, path)) for path in children]
+                stack.extend(reversed(futures))
+        finally:
+            # walking stopped or finished, do not wait for pending listings
+            for root, future in stack:
+                future.cancel()
+            pool.shutdown(wait=True)
 
     @pyqtSlot()
     def finish(self):
@@ -110,11 +495,11 @@ class RecursiveBrowser(QObject):
         pass
 
     def stop(self):
+        """
+        Called directly from main thread. Current scanning (media adding) is abandoned.
+        """
         logger.debug("Stopping disk scanning...")
-        self._stop = True
-
-    def init(self):
-        self._stop = False
+        self.generation.next()
 
 
 class MoveToTrash(QObject):
@@ -159,4 +544,381 @@ class MoveToTrash(QObject):
         Called directly from another thread to immediately stop worker.
         Convention method. May be reimplemented in future.
         """
-        pass
\ No newline at end of file
+        pass
+
+
+class ExistenceChecker(QObject):
+    """
+    Finds playlist files, which no longer exist on disk.
+    Files are checked per directory in thread pool, whole directory is listed by os.scandir() at once
+    instead of calling stat on every file, so even slow (sleeping network) drives are checked quickly.
+    Missing files are announced incrementally, each check has its own generation, results of stale check
+    are abandoned.
+    Lives in own thread!
+    Worker method: ExistenceChecker.check(groups, generation)
+    """
+
+    missingSignal = pyqtSignal(list, int)           # (track ids of missing files, generation)
+
+    CHECK_THREADS = 8               # max number of concurrently checked directories
+    SCANDIR_MIN = 3                 # directory is listed only if there are at least that many files to check
+    BATCH_LATENCY = 100             # in ms, missing files are announced at most this often
+
+    def __init__(self):
+        super(ExistenceChecker, self).__init__()
+        self.generation = Generation()
+
+    @pyqtSlot(list, int)
+    def check(self, groups, generation):
+        """
+        Main worker method.
+        @param groups: list of (directory, [(track_id, file name), ...])
+        @type groups: list of (unicode, list of (int, unicode))
+        @param generation: generation of check, see Generation
+        @type generation: int
+        """
+        if self.generation.isStale(generation):
+            return
+        logger.debug("Checking existence of files in %s directories...", len(groups))
+
+        missing = []
+        last_batch = time.time()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.CHECK_THREADS)
+        futures = [pool.submit(self._missingFiles, directory, tracks, generation) for directory, tracks in groups]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                if self.generation.isStale(generation):
+                    logger.debug("Existence check abandoned")
+                    return
+
+                missing.extend(future.result())
+                if missing and (time.time() - last_batch) * 1000 >= self.BATCH_LATENCY:
+                    self.missingSignal.emit(missing, generation)
+                    missing = []
+                    last_batch = time.time()
+
+            if missing:
+                self.missingSignal.emit(missing, generation)
+            logger.debug("Existence check finished")
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def _missingFiles(self, directory, tracks, generation):
+        """
+        Pool worker.
+        @return: track ids of missing files in given directory
+        @rtype: list of int
+        """
+        if self.generation.isStale(generation):
+            return []
+
+        if len(tracks) >= self.SCANDIR_MIN:
+            try:
+                names = {os.path.normcase(entry.name) for entry in os.scandir(directory)}
+            except (FileNotFoundError, NotADirectoryError):
+                return [track_id for track_id, name in tracks]
+            except OSError:
+                logger.warning("Unable to list directory '%s', files are checked one by one", directory)
+            else:
+                return [track_id for track_id, name in tracks if os.path.normcase(name) not in names]
+
+        return [track_id for track_id, name in tracks if not os.path.exists(os.path.join(directory, name))]
+
+    def stop(self):
+        """
+        Called directly from main thread. Current check is abandoned.
+        """
+        self.generation.next()
+
+
+class FolderWatcher(QObject):
+    """
+    Live watcher of media library folders (folders from medialib.dat).
+    Every directory of watched folder trees is watched by QFileSystemWatcher (inotify on Linux,
+    one watch descriptor per directory). When directory cannot be watched (e.g. inotify limit is reached),
+    it is polled instead - its mtime is checked every POLL_INTERVAL ms.
+    Change notifications are debounced, so bulk copy is processed in a few batches, not file by file.
+    Changed directories are listed again (through scan index, which is kept up to date this way)
+    and compared with previous listing. Media files of changed directories and of new sub-directories
+    are sent to parser (which updates media library), media of removed directories and removed media files
+    are sent to media library to be removed. Unchanged media are skipped by parser cache and library.
+    Lives in own thread!
+    Worker method: FolderWatcher.setFolders(folders)
+    """
+
+    mediaChangedSignal = pyqtSignal(list)           # paths of new or possibly modified media files
+    mediaRemovedSignal = pyqtSignal(list)           # paths of removed media files
+    usageSignal = pyqtSignal(int, int, int)         # (watched directories, watch limit or -1, polled directories)
+
+    DEBOUNCE_DELAY = 1000           # in ms, changes are processed when watched folders are quiet for this long ...
+    MAX_DELAY = 10000               # ... but at least this often during long event storms (bulk copy)
+    POLL_INTERVAL = 60 * 1000       # in ms, how often directories which cannot be watched are checked
+    WATCH_LIMIT_FILE = "/proc/sys/fs/inotify/max_user_watches"
+
+    def __init__(self, names_filter, index=None):
+        """
+        @param names_filter: Which files or file extensions we looking for.
+        @type names_filter: tuple of str
+        @param index: scan index shared with disk browser, listings are read directly from disk when None
+        @type index: ScanIndex
+        """
+        super(FolderWatcher, self).__init__()
+        self.names_filter = tuple([ext.replace('*', '') for ext in names_filter])
+        self.index = index
+        self._stopped = False
+        self._watcher = None                        # created in watcher thread, see start()
+        self._folders = []                          # watched folder trees
+        self._listings = {}                         # directory path: (sub-directories, media files)
+        self._watched = set()                       # directories watched by QFileSystemWatcher
+        self._polled = {}                           # directory path: mtime_ns of directories which are polled
+        self._changed = set()                       # changed directories waiting for processing
+        self._first_change = 0.0                    # when the oldest unprocessed change came
+        self._follow_sym = False                    # read from settings when folders are listed
+
+        self._debounceTimer = QTimer(self)
+        self._debounceTimer.setSingleShot(True)
+        self._debounceTimer.timeout.connect(self._processChanges)
+        self._pollTimer = QTimer(self)
+        self._pollTimer.timeout.connect(self._poll)
+
+    @pyqtSlot()
+    def start(self):
+        """
+        Called when watcher thread is started, watcher must be created in its own thread.
+        """
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._directoryChanged)
+        self._pollTimer.start(self.POLL_INTERVAL)
+        logger.debug("Folder watcher started.")
+
+    @pyqtSlot(list)
+    def setFolders(self, folders):
+        """
+        Main worker method. Starts watching given folders, folders which are not given anymore are not watched.
+        Media found in newly watched folders are sent to parser, so media library is synced with them.
+        @type folders: list of unicode
+        """
+        if self._stopped:
+            return
+        settings = QSettings()
+        self._follow_sym = settings.value("components/disk/RecursiveBrowser/follow_symlinks", False, bool)
+        if not settings.value("components/disk/FolderWatcher/enabled", True, bool):
+            folders = []
+
+        folders = [os.path.abspath(folder) for folder in folders]
+        removed = [folder for folder in self._folders if not self._isWatched(folder, folders)]
+        self._folders = folders
+
+        for folder in removed:
+            logger.debug("Folder '%s' is not watched anymore.", folder)
+            self._dropTree(folder)                  # media stay in library, folder has been only un-watched
+
+        # dropped trees may have contained folders which are still watched (e.g. /a replaced by /a/b)
+        added = [folder for folder in folders if folder not in self._listings]
+
+        if added:
+            if self.index and not self.index.loaded:
+                self.index.load()
+
+            changed = []
+            for folder in added:
+                logger.debug("Watching folder '%s'...", folder)
+                self._addTree(folder, changed)
+            if changed:
+                self.mediaChangedSignal.emit(changed)
+            if self.index:
+                self.index.save()
+
+        self._reportUsage()
+
+    @staticmethod
+    def _isWatched(path, folders):
+        """
+        @return: True when given path is one of folders or it is inside one of them
+        @rtype: bool
+        """
+        return any(path == folder or path.startswith(os.path.join(folder, "")) for folder in folders)
+
+    def _listDir(self, path):
+        """
+        @return: (dirs, media files) or None if directory cannot be read
+        """
+        listing = self.index.listDir(path) if self.index else scanDir(path, self.names_filter)
+        if listing is None:
+            return None
+
+        dirs, links, files = listing
+        if links and not self._follow_sym:
+            dirs = [ddir for ddir in dirs if ddir not in links]
+        return dirs, files
+
+    def _addTree(self, path, changed):
+        """
+        Starts watching given directory tree (skipping already watched directories).
+        @param changed: list, where paths of all found media files are appended
+        """
+        stack = [path]
+        new_dirs = []
+        while stack and not self._stopped:
+            root = stack.pop()
+            if root in self._listings:
+                continue
+
+            listing = self._listDir(root)
+            if listing is None:
+                continue
+
+            self._listings[root] = listing
+            new_dirs.append(root)
+            dirs, files = listing
+            changed.extend(os.path.join(root, ffile) for ffile in files)
+            stack.extend(os.path.join(root, ddir) for ddir in reversed(dirs))
+
+        self._watch(new_dirs)
+
+    def _dropTree(self, path, removed=None):
+        """
+        Stops watching given directory tree.
+        @param removed: list, where paths of all known media files in the tree are appended
+        """
+        stack = [path]
+        dropped = []
+        while stack:
+            root = stack.pop()
+            listing = self._listings.pop(root, None)
+            if listing is None:
+                continue
+
+            dropped.append(root)
+            dirs, files = listing
+            if removed is not None:
+                removed.extend(os.path.join(root, ffile) for ffile in files)
+            stack.extend(os.path.join(root, ddir) for ddir in dirs)
+
+        watched = [root for root in dropped if root in self._watched]
+        if watched:
+            self._watched.difference_update(watched)
+            self._watcher.removePaths(watched)
+        for root in dropped:
+            self._polled.pop(root, None)
+
+    def _watch(self, paths):
+        """
+        Adds directories to watcher, directories which cannot be watched are polled.
+        """
+        if not paths:
+            return
+
+        failed = set(self._watcher.addPaths(paths))
+        for path in paths:
+            if path in failed:
+                try:
+                    self._polled[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    self._directoryChanged(path)
+            else:
+                self._watched.add(path)
+
+        if failed:
+            logger.warning("Unable to watch %s directories (watch limit reached?), they will be polled.",
+                           len(failed))
+
+    @pyqtSlot(str)
+    def _directoryChanged(self, path):
+        """
+        Called by QFileSystemWatcher when content of watched directory changes (or directory is removed).
+        Changes are collected and processed later at once.
+        """
+        if not self._changed:
+            self._first_change = time.time()
+        self._changed.add(path)
+
+        # storm of changes (e.g. bulk copy) would postpone processing forever
+        if (time.time() - self._first_change) * 1000 < self.MAX_DELAY or not self._debounceTimer.isActive():
+            self._debounceTimer.start(self.DEBOUNCE_DELAY)
+
+    @pyqtSlot()
+    def _poll(self):
+        """
+        Checks mtimes of directories which cannot be watched.
+        """
+        for path, mtime in list(self._polled.items()):
+            try:
+                current_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                current_mtime = None
+            if current_mtime != mtime:
+                self._polled[path] = current_mtime
+                self._directoryChanged(path)
+
+    @pyqtSlot()
+    def _processChanges(self):
+        """
+        Lists changed directories again and sends out changed and removed media.
+        """
+        changed_dirs, self._changed = sorted(self._changed), set()
+        self._follow_sym = QSettings().value("components/disk/RecursiveBrowser/follow_symlinks", False, bool)
+        changed = []
+        removed = []
+        for path in changed_dirs:
+            if self._stopped:
+                return
+
+            old_listing = self._listings.get(path)
+            if old_listing is None:
+                continue                            # already removed with its parent directory
+
+            listing = self._listDir(path) if os.path.isdir(path) else None
+            if listing is None:
+                logger.debug("Watched directory '%s' has been removed.", path)
+                self._dropTree(path, removed)
+                continue
+
+            dirs, files = listing
+            old_dirs, old_files = old_listing
+            self._listings[path] = listing
+
+            # media may have been replaced (e.g. tags edited), parser cache and library skip unchanged ones
+            changed.extend(os.path.join(path, ffile) for ffile in files)
+            removed.extend(os.path.join(path, ffile) for ffile in set(old_files).difference(files))
+            for ddir in set(old_dirs).difference(dirs):
+                self._dropTree(os.path.join(path, ddir), removed)
+            for ddir in dirs:
+                if ddir not in old_dirs:
+                    self._addTree(os.path.join(path, ddir), changed)
+
+        logger.debug("Changes in %s watched directories processed: %s media changed, %s removed.",
+                     len(changed_dirs), len(changed), len(removed))
+        if removed:
+            self.mediaRemovedSignal.emit(removed)
+        if changed:
+            self.mediaChangedSignal.emit(changed)
+        if self.index:
+            self.index.save()
+        self._reportUsage()
+
+    def watchLimit(self):
+        """
+        @return: max number of inotify watches of user or -1 if unknown (not Linux)
+        @rtype: int
+        """
+        try:
+            with open(self.WATCH_LIMIT_FILE, 'r') as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return -1
+
+    def _reportUsage(self):
+        limit = self.watchLimit()
+        logger.debug("Folder watcher: %s directories watched (limit %s), %s directories polled.",
+                     len(self._watched), limit, len(self._polled))
+        self.usageSignal.emit(len(self._watched), limit, len(self._polled))
+
+    def stop(self):
+        """
+        Called directly from main thread. Walking of newly watched folders is abandoned.
+        """
+        logger.debug("Stopping folder watcher...")
+        self._stopped = True
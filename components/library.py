@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# Woofer - free open-source cross-platform music player
+# Copyright (C) 2015 Milan Herbig <milanherbig[at]gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Media library components
+- SQLite database of parsed media files (tracks, albums, artists) with full-text search index
+"""
+
+import os
+import re
+import logging
+import sqlite3
+
+from PyQt5.QtCore import *
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS albums (
+    id INTEGER PRIMARY KEY,
+    artist_id INTEGER REFERENCES artists (id),
+    title TEXT NOT NULL,
+    UNIQUE (artist_id, title)
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    directory TEXT NOT NULL,
+    title TEXT,
+    artist_id INTEGER REFERENCES artists (id),
+    album_id INTEGER REFERENCES albums (id),
+    genre TEXT,
+    track_number INTEGER,
+    date TEXT,
+    duration INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_directory ON tracks (directory);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist_id);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album_id, track_number);
+"""
+
+# rowid of full-text index is id of track
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE tracks_fts USING fts5 (title, artist, album, genre, filename,
+                                            tokenize = 'unicode61', prefix = '2 3')
+"""
+
+FTS_SOURCE = """
+SELECT tracks.id, tracks.title, artists.name, albums.title, tracks.genre, tracks.path FROM tracks
+LEFT JOIN artists ON artists.id = tracks.artist_id
+LEFT JOIN albums ON albums.id = tracks.album_id
+"""
+
+SEARCH_COLUMNS = """
+SELECT tracks.path, tracks.title, artists.name, albums.title, tracks.duration FROM tracks
+LEFT JOIN artists ON artists.id = tracks.artist_id
+LEFT JOIN albums ON albums.id = tracks.album_id
+"""
+
+
+class MediaLibrary(QObject):
+    """
+    Media library, SQLite database of all media ever parsed by media parser.
+    Tracks are indexed by path, directory, artist and album, tags and file names are indexed
+    by FTS5 full-text index, so searching is fast even in huge libraries.
+    When SQLite is built without FTS5, tags are searched by LIKE queries (slow, but working).
+    Records are sent by media parser in batches and written in single transaction, unchanged files
+    (same size and mtime) are skipped.
+    Library runs in separated thread, database connection is opened in library thread.
+    Worker methods: MediaLibrary.update(records), MediaLibrary.remove(paths), MediaLibrary.search(...)
+    """
+
+    searchFinishedSignal = pyqtSignal(int, list)    # (request id, list of (path, title, artist, album, duration))
+
+    SCHEMA_VERSION = 1
+    SEARCH_LIMIT = 1000
+
+    def __init__(self, db_file):
+        """
+        @param db_file: path to library database
+        @type db_file: unicode
+        """
+        super(MediaLibrary, self).__init__()
+        self.db_file = db_file
+        self.fts = False                    # full-text index is available
+        self._db = None
+
+        logger.debug("MediaLibrary initialized")
+
+    @pyqtSlot()
+    def start(self):
+        """
+        Called as slot when library thread is started. Opens (or creates) library database.
+        """
+        try:
+            self._db = sqlite3.connect(self.db_file)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            with self._db:
+                version = self._db.execute("PRAGMA user_version").fetchone()[0]
+                if version != self.SCHEMA_VERSION:
+                    logger.debug("Creating media library database, schema version %s", self.SCHEMA_VERSION)
+                    self._db.execute("DROP TABLE IF EXISTS tracks_fts")
+                    for table in ("tracks", "albums", "artists"):
+                        self._db.execute("DROP TABLE IF EXISTS %s" % table)
+                self._db.executescript(SCHEMA)
+                self._db.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+            self._createFullTextIndex()
+        except sqlite3.Error:
+            logger.exception("Unable to open media library database '%s'", self.db_file)
+            self._db = None
+            return
+
+        n_tracks = self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+        logger.debug("Media library opened, %s tracks, full-text search: %s", n_tracks, self.fts)
+
+    def _createFullTextIndex(self):
+        exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'tracks_fts'").fetchone()
+        if exists:
+            self.fts = True
+            return
+
+        try:
+            with self._db:
+                self._db.execute(FTS_SCHEMA)
+                # index built by older SQLite without FTS5
+                self._db.executemany("INSERT INTO tracks_fts (rowid, title, artist, album, genre, filename) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)",
+                                     ((row[0], row[1], row[2], row[3], row[4], os.path.basename(row[5]))
+                                      for row in self._db.execute(FTS_SOURCE).fetchall()))
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite is built without FTS5, media library is searched without full-text index")
+            self.fts = False
+
+    def _nameId(self, ids, table, column, value, **keys):
+        """
+        @param ids: ids already looked up in current batch
+        @type ids: dict
+        @return: id of artist/album with given name, row is created if doesn't exist
+        @rtype: int or None
+        """
+        if not value:
+            return None
+
+        cache_key = (table, value) + tuple(sorted(keys.items()))
+        if cache_key in ids:
+            return ids[cache_key]
+
+        where = " AND ".join("%s IS ?" % key for key in sorted(keys))
+        params = [keys[key] for key in sorted(keys)]
+        query = "SELECT id FROM %s WHERE %s = ?" % (table, column) + (" AND " + where if where else "")
+        row = self._db.execute(query, [value] + params).fetchone()
+        if row is not None:
+            ids[cache_key] = row[0]
+        else:
+            columns = [column] + sorted(keys)
+            ids[cache_key] = self._db.execute("INSERT INTO %s (%s) VALUES (%s)" % (table, ", ".join(columns),
+                                                                                  ", ".join("?" * len(columns))),
+                                              [value] + params).lastrowid
+        return ids[cache_key]
+
+    @staticmethod
+    def _trackNumber(value):
+        # track number tag may look like "3/12"
+        match = re.match(r"\s*(\d+)", value or "")
+        return int(match.group(1)) if match else None
+
+    @pyqtSlot(list)
+    def update(self, records):
+        """
+        Adds or updates parsed media files. Thread worker!
+        @param records: list of (path, size, mtime_ns, duration, tags), see components.media.MediaCache
+        @type records: list of (unicode, int, int, int, dict)
+        """
+        if self._db is None:
+            return
+
+        changed = 0
+        updated = False
+        ids = {}
+        try:
+            with self._db:
+                for path, size, mtime_ns, duration, tags in records:
+                    row = self._db.execute("SELECT id, size, mtime_ns FROM tracks WHERE path = ?", (path,)).fetchone()
+                    if row is not None and row[1] == size and row[2] == mtime_ns:
+                        continue
+
+                    artist = tags.get('artist')
+                    artist_id = self._nameId(ids, "artists", "name", artist)
+                    album_id = self._nameId(ids, "albums", "title", tags.get('album'), artist_id=artist_id)
+                    values = (path, os.path.dirname(path), tags.get('title'), artist_id, album_id, tags.get('genre'),
+                              self._trackNumber(tags.get('track')), tags.get('date'), duration, size, mtime_ns)
+
+                    if row is None:
+                        track_id = self._db.execute("INSERT INTO tracks (path, directory, title, artist_id, album_id, "
+                                                    "genre, track_number, date, duration, size, mtime_ns) "
+                                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values).lastrowid
+                    else:
+                        track_id = row[0]
+                        updated = True
+                        self._db.execute("UPDATE tracks SET path = ?, directory = ?, title = ?, artist_id = ?, "
+                                         "album_id = ?, genre = ?, track_number = ?, date = ?, duration = ?, "
+                                         "size = ?, mtime_ns = ? WHERE id = ?", values + (track_id,))
+
+                    if self.fts:
+                        self._db.execute("DELETE FROM tracks_fts WHERE rowid = ?", (track_id,))
+                        self._db.execute("INSERT INTO tracks_fts (rowid, title, artist, album, genre, filename) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)",
+                                         (track_id, tags.get('title'), artist, tags.get('album'), tags.get('genre'),
+                                          os.path.basename(path)))
+                    changed += 1
+                if updated:
+                    self._removeOrphans()           # re-tagged tracks may have left their artist/album
+        except sqlite3.Error:
+            logger.exception("Unable to update media library!")
+            return
+
+        if changed:
+            logger.debug("Media library updated, %s of %s media changed", changed, len(records))
+
+    @pyqtSlot(list)
+    def remove(self, paths):
+        """
+        Removes files from library, e.g. files which no longer exist on disk. Thread worker!
+        @type paths: list of unicode
+        """
+        if self._db is None or not paths:
+            return
+
+        try:
+            with self._db:
+                for path in paths:
+                    row = self._db.execute("SELECT id FROM tracks WHERE path = ?", (path,)).fetchone()
+                    if row is None:
+                        continue
+                    self._db.execute("DELETE FROM tracks WHERE id = ?", row)
+                    if self.fts:
+                        self._db.execute("DELETE FROM tracks_fts WHERE rowid = ?", row)
+                self._removeOrphans()
+        except sqlite3.Error:
+            logger.exception("Unable to remove media from library!")
+
+    def _removeOrphans(self):
+        self._db.execute("DELETE FROM albums WHERE NOT EXISTS (SELECT 1 FROM tracks WHERE album_id = albums.id)")
+        self._db.execute("DELETE FROM artists WHERE NOT EXISTS (SELECT 1 FROM tracks WHERE artist_id = artists.id) "
+                         "AND NOT EXISTS (SELECT 1 FROM albums WHERE artist_id = artists.id)")
+
+    @staticmethod
+    def _matchQuery(text):
+        """
+        Builds FTS5 query from user input, every word is searched as prefix.
+        @rtype: str
+        """
+        words = re.findall(r"\w+", text, re.UNICODE)
+        return " ".join('"%s"*' % word for word in words)
+
+    def query(self, text, limit=SEARCH_LIMIT):
+        """
+        Searches library by title, artist, album, genre and file name, each word of text must match
+        (as prefix). Results are ordered by artist, album and track number.
+        @type text: unicode
+        @rtype: list of (unicode, unicode, unicode, unicode, int)
+        """
+        if self._db is None:
+            return []
+
+        if self.fts:
+            match = self._matchQuery(text)
+            if not match:
+                return []
+            return self._db.execute(SEARCH_COLUMNS + "WHERE tracks.id IN "
+                                    "(SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?) "
+                                    "ORDER BY artists.name, albums.title, tracks.track_number, tracks.path LIMIT ?",
+                                    (match, limit)).fetchall()
+
+        words = re.findall(r"\w+", text, re.UNICODE)
+        if not words:
+            return []
+        condition = " AND ".join("(tracks.title LIKE ? OR artists.name LIKE ? OR albums.title LIKE ? "
+                                 "OR tracks.genre LIKE ? OR tracks.path LIKE ?)" for _ in words)
+        params = [param for word in words for param in ["%" + word + "%"] * 5]
+        return self._db.execute(SEARCH_COLUMNS + "WHERE " + condition +
+                                " ORDER BY artists.name, albums.title, tracks.track_number, tracks.path LIMIT ?",
+                                params + [limit]).fetchall()
+
+    @pyqtSlot(int, str, int)
+    def search(self, request_id, text, limit):
+        """
+        Searches library, results are sent by searchFinishedSignal. Thread worker!
+        @param request_id: id of search request, sent back with results
+        @type request_id: int
+        @type text: unicode
+        @type limit: int
+        """
+        try:
+            results = self.query(text, limit)
+        except sqlite3.Error:
+            logger.exception("Unable to search media library!")
+            results = []
+        self.searchFinishedSignal.emit(request_id, [tuple(row) for row in results])
+
+    @pyqtSlot()
+    def close(self):
+        """
+        Closes database. Called when application is about to close.
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
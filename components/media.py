@@ -19,16 +19,31 @@
 """
 Media components
 - Media player
+- Volume fader (crossfade)
+- Callback bridge (vlc thread -> Qt thread)
 - Radio player
+- Media parser and persistent metadata cache
 """
 
 import os
+import math
 import logging
 import random
+import time
+import array
+import functools
+import heapq
+import itertools
+import threading
+import collections
+import concurrent.futures
+
+import ujson
 
 from PyQt5.QtCore import *
 
 from components import libvlc
+from components.playlist import PlaylistStore
 from components.translator import tr
 
 import tools
@@ -41,25 +56,37 @@ class MediaPlayer(QObject):
     """
     Media player class.
     Uses LibVLC highlevel wrapper.
+    In gapless mode, next media is pre-buffered in second (standby) player shortly before current media ends.
+    Standby player is paused at the beginning of next media and it is only resumed when end is reached,
+    then both players swap their roles.
+    In crossfade mode, standby player is resumed few seconds before current media ends and volumes of both players
+    are ramped by VolumeFader (in its own thread). Players swap their roles when fading starts.
     """
 
     errorSignal = pyqtSignal(int, str, str)        # (Message.CRITICAL, main_text, description)
-    tickTocSignal = pyqtSignal(int)
+    tickTocSignal = pyqtSignal(int, float)         # (time in ms, relative position) - see tick_rate
 
     mediaAddedSignal = pyqtSignal(list, bool)
     playingSignal = pyqtSignal()
     stoppedSignal = pyqtSignal()
     pausedSignal = pyqtSignal()
-    timeChangedSignal = pyqtSignal(int)
-    positionChangedSignal = pyqtSignal(float)
     mediaChangedSignal = pyqtSignal(int, int)
     endReachedSignal = pyqtSignal(bool)
 
-    # this signals are used as helper, because callback are called from vlc directly (from another thread),
-    # so to prevent cross-thread collision, variables (flags) are manipulated only from MediaPlayer thread
-    mediaChangedCallbackSignal = pyqtSignal()
-    endReachedCallbackSignal = pyqtSignal()
-    errorCallbackSignal = pyqtSignal()
+    fadeSignal = pyqtSignal(object, object, int, int)      # (fade out player, fade in player, duration, fade id)
+
+    # callbacks are called from vlc directly (from another thread), so they only push event codes to bridge,
+    # to prevent cross-thread collision, variables (flags) are manipulated only from MediaPlayer thread
+    EVENT_PLAYING = 0
+    EVENT_PAUSED = 1
+    EVENT_STOPPED = 2
+    EVENT_END_REACHED = 3
+    EVENT_MEDIA_CHANGED = 4
+    EVENT_ERROR = 5
+    EVENT_STANDBY_PLAYING = 6
+    EVENT_TICK = 7
+
+    GAPLESS_PREROLL = 5000              # next media is pre-buffered 5s before current media ends (or fading starts)
 
     def __init__(self):
         super(MediaPlayer, self).__init__()
@@ -71,12 +98,16 @@ class MediaPlayer(QObject):
         """@type: libvlc.MediaList"""
         self._event_manager = self._media_player.event_manager()
         """@type: libvlc.EventManager"""
+        self._standby_player = self._instance.media_player_new()
+        """@type: libvlc.MediaPlayer"""
+        self._standby_event_manager = self._standby_player.event_manager()
+        """@type: libvlc.EventManager"""
         logger.debug("Core instances of VLC player created")
 
-        self.tick_rate = 1000                           # in ms
-        self.media_list = []                            # path to media file is stored in _media_list but is
+        self.tick_rate = 250                            # in ms, time and position changes are announced
+                                                        # together by tickTocSignal at most this often
+        self.playlist = PlaylistStore(self)             # path to media file is stored in _media_list but is
                                                         # vlc translates the path to its form
-        self.shuffled_playlist = []                     # items are represented by its index in _media_list
         self.shuffled_playlist_current_index = 0        # points which media in shuffled_playlist is being played
         self.shuffled_playlist_old_index = 0            # points which media in shuffled_playlist was previously played
 
@@ -90,151 +121,230 @@ class MediaPlayer(QObject):
         self.player_is_empty = True
         self.adding_media = False
 
+        self.transition_latency = None  # ms from end of media to playing next one, measured on every transition
+        self._end_reached_time = None
+        self._volume = 100
+        self._muted = False
+        self._standby_id = -1           # track id of media pre-buffered in standby player
+        self._standby_ready = False     # standby player is paused at the beginning of media
+        self._standby_checked_id = -1   # track id of current media, when pre-buffering has already been considered
+        self._crossfade = 0             # crossfade duration (ms) for media in standby player, 0 = gapless only
+        self._gapless_enabled = False   # gapless/crossfade settings, read when media changes
+        self._crossfade_duration = 0
+        self._fading = False            # previous media is still being faded out in standby player
+        self._fade_id = 0
+        self._tick_time = 0             # last time and position reported by vlc, written from vlc thread
+        self._tick_position = 0.0
+        self._tick_pending = False      # tick has been requested and not emitted yet
+        self._last_tick = 0.0
+
+        self._tick_timer = QTimer(self)
+        self._tick_timer.setSingleShot(True)
+        self._tick_timer.timeout.connect(self._tickToc)
+
+        self.fader = VolumeFader()      # should be moved to another thread by owner
+
+        self.bridge = CallbackBridge({
+            self.EVENT_PLAYING: self.playingSignal.emit,
+            self.EVENT_PAUSED: self.pausedSignal.emit,
+            self.EVENT_STOPPED: self.stoppedSignal.emit,
+            self.EVENT_END_REACHED: self._endReachedSlot,
+            self.EVENT_MEDIA_CHANGED: self._mediaChangedSlot,
+            self.EVENT_ERROR: self._errorSlot,
+            self.EVENT_STANDBY_PLAYING: self._standbyPlayingSlot,
+            self.EVENT_TICK: self._scheduleTick,
+        }, parent=self)
+
         self.endReachedSignal.connect(self.next_track)
         self.playingSignal.connect(self._playingSlot)
         self.pausedSignal.connect(self._pausedSlot)
         self.stoppedSignal.connect(self._stoppedSlot)
         self.endReachedSignal.connect(self._stoppedSlot)
-        self.mediaChangedCallbackSignal.connect(self._mediaChangedSlot)
-        self.endReachedCallbackSignal.connect(self._endReachedSlot)
-        self.errorCallbackSignal.connect(self._errorSlot)
+        self.tickTocSignal.connect(self._prepareStandby)
+        self.tickTocSignal.connect(self._startCrossfade)
+        self.fadeSignal.connect(self.fader.fade)
+        self.fader.finishedSignal.connect(self._fadeFinishedSlot)
 
         self._attachEvents()
 
         logger.debug("Created Woofer player instance")
 
+    @property
+    def shuffled_playlist(self):
+        """
+        Play order of media, items are represented by its index in _media_list.
+        Must not be modified in place, new order must be set instead (see PlaylistStore.order).
+        @rtype: array.array
+        """
+        return self.playlist.order
+
+    @shuffled_playlist.setter
+    def shuffled_playlist(self, indices):
+        self.playlist.order = indices
+
     def _attachEvents(self):
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerOpening, self.__openingCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerBuffering, self.__bufferingCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerPlaying, self.__playingCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerPaused, self.__pausedCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerStopped, self.__stoppedCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerForward, self.__forwardCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerBackward, self.__backwardCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerEndReached, self.__endReachedCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerEncounteredError, self.__errorCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerTimeChanged, self.__timeChangedCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerPositionChanged, self.__positionChangedCallback)
-        self._event_manager.event_attach(libvlc.EventType.MediaPlayerMediaChanged, self.__mediaChangedCallback)
+        # both players have callbacks attached, but only events of currently active player are processed
+        for player, event_manager in ((self._media_player, self._event_manager),
+                                      (self._standby_player, self._standby_event_manager)):
+            event_manager.event_attach(libvlc.EventType.MediaPlayerOpening, self.__openingCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerBuffering, self.__bufferingCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerPlaying, self.__playingCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerPaused, self.__pausedCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerStopped, self.__stoppedCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerForward, self.__forwardCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerBackward, self.__backwardCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerEndReached, self.__endReachedCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerEncounteredError, self.__errorCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerTimeChanged, self.__timeChangedCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerPositionChanged,
+                                       self.__positionChangedCallback, player)
+            event_manager.event_attach(libvlc.EventType.MediaPlayerMediaChanged, self.__mediaChangedCallback, player)
 
     def _detachEvents(self):
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerOpening)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerBuffering)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerPlaying)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerPaused)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerStopped)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerForward)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerBackward)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerEndReached)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerEncounteredError)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerTimeChanged)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerPositionChanged)
-        self._event_manager.event_detach(libvlc.EventType.MediaPlayerMediaChanged)
+        for event_manager in (self._event_manager, self._standby_event_manager):
+            event_manager.event_detach(libvlc.EventType.MediaPlayerOpening)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerBuffering)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerPlaying)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerPaused)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerStopped)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerForward)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerBackward)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerEndReached)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerEncounteredError)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerTimeChanged)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerPositionChanged)
+            event_manager.event_detach(libvlc.EventType.MediaPlayerMediaChanged)
 
     @pyqtSlot(list)
-    def addMedia(self, mlist, restoring_session=False):
+    def addMedia(self, mlist):
         """
         Adds list of media objects to player media_list.
-        Usually called as slot from parser thread, but could be called manually
-        when last session is restored on application start.
-        @param restoring_session: flag when method is called manually to restore playlist from saved session
-        @param mlist: list of (unicode_path, media_object) or list of (unicode_path)
-        @type mlist: list of (unicode, libvlc.Media) or list of (unicode)
-        """
-        # when restoring session, no parsed media files are available, but vlc takes both vlc.Media and mrl
-        if restoring_session:
-            logger.debug("Restoring session, adding media paths to _media_list...")
-
-            self._media_list.lock()
-            for path in mlist:
-                # unicode_path, byte_path = tools.unicode2bytes(path)       # fix Windows encoding issues
-                # vlc will parse media automatically if needed (before playing)
-                self._media_list.add_media(path)
-                self.media_list.append(os.path.normpath(path))
-                # normpath to preserve win/unix compatibility when restoring session
-
-            # set previous current media now as current
-            media = self._media_list.item_at_index(self.shuffled_playlist[self.shuffled_playlist_current_index])
-            self._media_list.unlock()
+        Called as slot from parser thread.
+        @param mlist: list of (unicode_path, duration, media_object)
+                      media_object is None when media metadata has been taken from cache
+        @type mlist: list of (unicode, int, libvlc.Media or None)
+        """
+        export = []
+
+        self._media_list.lock()
+        for path, duration, media in mlist:
+            if media is None:
+                # metadata taken from cache, media has not been parsed
+                media = self._instance.media_new(path)
+            self._media_list.add_media(media)
+            media.release()
+            export.append((path, duration))
+        self._media_list.unlock()
+
+        first_index = self.playlist.addItems(export)
+        # new media are on the end of the list
+        self.playlist.appendToOrder(range(first_index, first_index + len(export)))
+
+        self.mediaAddedSignal.emit(export, self.append_media)
 
+        # set set_mode, set media and switch to append mode for next iteration
+        if not self.append_media or self.player_is_empty:
+            logger.debug("Setting current media %s", mlist[0][0])
+            media = self._media_list.item_at_index(first_index)
             self._media_player.set_media(media)
-            self.player_is_empty = False
             media.release()
-            logger.debug("All media paths restored.")
+            self.player_is_empty = False
+            self.append_media = True
+            self.play()         # in set_mode, Play or Play All has been chosen => play()
 
-        else:
-            export = []
+    def restorePlaylist(self, playlist, current_index):
+        """
+        Replaces playlist by playlist restored from last session on application start.
+        @param playlist: restored playlist with play order
+        @type playlist: PlaylistStore
+        @param current_index: position of current media in play order
+        @type current_index: int
+        """
+        logger.debug("Restoring session, adding media paths to _media_list...")
 
-            self._media_list.lock()
-            for path, media in mlist:
-                self._media_list.add_media(media)
-                media.release()
-                self.media_list.append(path)
-                self.shuffled_playlist.append(len(self.shuffled_playlist))        # new media is on the end of the list
-                export.append((path, media.get_duration()))
-            self._media_list.unlock()
+        # no parsed media files are available, but vlc takes both vlc.Media and mrl
+        # vlc will parse media automatically if needed (before playing)
+        self._media_list.lock()
+        for path in playlist.paths():
+            self._media_list.add_media(path)
+        self._media_list.unlock()
 
-            self.mediaAddedSignal.emit(export, self.append_media)
+        self.playlist.load(*playlist.columns())
+        self.shuffled_playlist_current_index = current_index
 
-            # set set_mode, set media and switch to append mode for next iteration
-            if not self.append_media or self.player_is_empty:
-                path, media = mlist[0]
-                logger.debug("Setting current media %s", path)
-                self._media_player.set_media(media)
-                self.player_is_empty = False
-                self.append_media = True
-                self.play()         # in set_mode, Play or Play All has been chosen => play()
+        # set previous current media now as current
+        media = self._media_list.item_at_index(self.shuffled_playlist[self.shuffled_playlist_current_index])
+        self._media_player.set_media(media)
+        self.player_is_empty = False
+        media.release()
+        logger.debug("All media paths restored.")
 
     def removeItem(self, remove_index):
         """
         Removes item from media list by index.
-        If media is currently being played, next media is played.
-        If there is no next media, playing is stopped.
         @param remove_index: index of removed item in media_list
         @type remove_index: int
         """
-        logger.debug("Removing media item on index: %s", remove_index)
+        self.removeItems([remove_index])
+
+    def removeItems(self, indices):
+        """
+        Removes items from media list by indices. Media list, playlist and play order are compacted at once.
+        If media is currently being played, next media is played.
+        If there is no next media, playing is stopped.
+        @param indices: indices of removed items in media_list, in any order
+        @type indices: list of int
+        """
+        removed = set(indices)
+        if not removed:
+            return
+        logger.debug("Removing %s media items.", len(removed))
 
         must_change_song = False
         restore_playing = self.is_playing
         current_index = self.shuffled_playlist[self.shuffled_playlist_current_index]
 
         # remove media from player if media is currently being played
-        if remove_index == current_index:
+        if current_index in removed:
             must_change_song = True
             self._media_player.stop()
             self._media_player.set_media(None)
             self.player_is_empty = True
 
+        # number of removed media played before the current one
+        removed_before = 0
+        for i in range(self.shuffled_playlist_current_index):
+            if self.shuffled_playlist[i] in removed:
+                removed_before += 1
+
+        self._releaseStandby()
+
         # remove media from _media_list
         self._media_list.lock()
-        remove_error = (self._media_list.remove_index(remove_index) == -1)
+        remove_error = False
+        for remove_index in sorted(removed, reverse=True):
+            if self._media_list.remove_index(remove_index) == -1:
+                remove_error = True
         self._media_list.unlock()
-        del self.media_list[remove_index]
 
         if remove_error:
-            logger.error("Unable to remove item from _media_list. "
+            logger.error("Unable to remove items from _media_list. "
                          "Item is not in the list or _media_list is read only! "
-                         "Playlist len: %s, index: %s" % (len(self.shuffled_playlist), remove_index))
+                         "Playlist len: %s, indices: %s" % (len(self.shuffled_playlist), sorted(removed)))
             self.errorSignal.emit(tools.ErrorMessages.CRITICAL, tr['PLAYLIST_REMOVE_ERROR'], "")
 
-        # decrease all references with higher index
-        for i in range(len(self.shuffled_playlist)):
-            index = self.shuffled_playlist[i]
-            if index > remove_index:
-                self.shuffled_playlist[i] -= 1
-            elif index == remove_index:
-                rem_idx_in_shuffled_playlist = i
-        # remove media reference from shuffled_playlist
-        del self.shuffled_playlist[rem_idx_in_shuffled_playlist]
+        # remove media from playlist and from play order (shuffled_playlist)
+        self.playlist.removeItems(removed)
+        self.shuffled_playlist_current_index -= removed_before
 
         # change song if removed == played, but stop if there is no next song
         if must_change_song:
             logger.debug("Currently playing media has been removed from playlist, selecting next one.")
             if not self.shuffled_playlist:
                 logger.debug("There is no next media left!")
+                self.shuffled_playlist_current_index = 0
             elif self.shuffled_playlist_current_index >= len(self.shuffled_playlist):
-                self.shuffled_playlist_current_index -= 1
+                self.shuffled_playlist_current_index = len(self.shuffled_playlist) - 1
                 self.play(item_playlist_id=self.shuffled_playlist[self.shuffled_playlist_current_index])
                 self.stop()
             else:
@@ -242,22 +352,18 @@ class MediaPlayer(QObject):
                 if not restore_playing:
                     self.stop()
 
-        elif rem_idx_in_shuffled_playlist < self.shuffled_playlist_current_index:
-            self.shuffled_playlist_current_index -= 1
-
     def clearMediaList(self):
         """
         Clears all existing items in media_list
         """
         logger.debug("Clearing _media_list")
-        self.stop()
+        self.stop()                                              # releases standby player as well
         self._media_list.release()                              # delete old media list
         self._media_list = self._instance.media_list_new()       # create new and empty list
         self._media_player.set_media(None)
-        self.media_list = []
+        self.playlist.clear()
         self.player_is_empty = True
 
-        self.shuffled_playlist = []
         self.shuffled_playlist_current_index = 0
         self.shuffled_playlist_old_index = 0
 
@@ -311,12 +417,14 @@ class MediaPlayer(QObject):
             return
 
         self.shuffled_playlist_old_index = self.shuffled_playlist_current_index
+        self._end_reached_time = None
 
         # play given media (index) - find item in playlist
         if item_playlist_id is not None:
             logger.debug("Play method called with index: %s" % item_playlist_id)
+            self._releaseStandby()
             self._media_player.stop()
-            self.shuffled_playlist_current_index = self.shuffled_playlist.index(item_playlist_id)
+            self.shuffled_playlist_current_index = self.playlist.positionOf(item_playlist_id)
 
             play_media = self._media_list.item_at_index(item_playlist_id)
             self._media_player.set_media(play_media)
@@ -326,7 +434,7 @@ class MediaPlayer(QObject):
             logger.debug("Play method called")
 
         if self._media_player.play() == -1:
-            current_media_path = self.media_list[self.shuffled_playlist[self.shuffled_playlist_current_index]]
+            current_media_path = self.playlist.path(self.shuffled_playlist[self.shuffled_playlist_current_index])
             self.errorSignal.emit(tools.ErrorMessages.ERROR, tr['MEDIA_PLAY_ERROR'], "Media: %s" % current_media_path)
 
     @pyqtSlot()
@@ -335,6 +443,8 @@ class MediaPlayer(QObject):
         Pause media_player (no effect if there is no media).
         """
         logger.debug("Pause method called")
+        if self._fading:
+            self._releaseStandby()              # fading out media would keep playing
         self._media_player.pause()
 
     @pyqtSlot()
@@ -343,6 +453,7 @@ class MediaPlayer(QObject):
         Stop (no effect if there is no media)
         """
         logger.debug("Stop method called, stopping playback...")
+        self._releaseStandby()
         self._media_player.stop()
 
     @pyqtSlot(bool)
@@ -353,6 +464,7 @@ class MediaPlayer(QObject):
         @type repeat: bool
         """
         self.shuffled_playlist_old_index = self.shuffled_playlist_current_index
+        self._releaseStandby()
 
         if playlist_index is not None:
             logger.debug("Setting next media to play by playlist_id: %s" % playlist_index)
@@ -361,7 +473,7 @@ class MediaPlayer(QObject):
             self._media_player.set_media(play_media)
             self.player_is_empty = False
             play_media.release()
-            self.shuffled_playlist_current_index = self.shuffled_playlist.index(playlist_index)  # find item in playlist
+            self.shuffled_playlist_current_index = self.playlist.positionOf(playlist_index)  # find item in playlist
 
         elif repeat:
             logger.debug("Next media method called, repeating current song")
@@ -384,6 +496,16 @@ class MediaPlayer(QObject):
             else:
                 logger.debug("There is no next media (song) to play!")
                 self._media_player.stop()
+                self._end_reached_time = None
+
+    def nextItemIndex(self):
+        """
+        Returns playlist index of media which will be played after current one.
+        @return: index in media_list or None if current media is the last one
+        @rtype: int or None
+        """
+        if self.shuffled_playlist_current_index + 1 < len(self.shuffled_playlist):
+            return self.shuffled_playlist[self.shuffled_playlist_current_index + 1]
 
     @pyqtSlot()
     def prev_track(self):
@@ -395,6 +517,7 @@ class MediaPlayer(QObject):
         logger.debug("Previous media method called")
 
         self.shuffled_playlist_old_index = self.shuffled_playlist_current_index
+        self._releaseStandby()
 
         if self._media_player.is_playing():
             self._media_player.stop()
@@ -423,7 +546,10 @@ class MediaPlayer(QObject):
             raise ValueError("Volume must be in range <0, 200>")
 
         logger.debug("Volume set: %s", value)
-        self._media_player.audio_set_volume(int(value))
+        self._volume = int(value)
+        self.fader.volume = int(value)
+        if not self._fading:
+            self._media_player.audio_set_volume(int(value))      # fader applies new volume itself
 
     def getVolume(self):
         """
@@ -435,7 +561,10 @@ class MediaPlayer(QObject):
 
     def setMute(self, status):
         logger.debug("Setting audio MUTE to %s", status)
+        self._muted = status
         self._media_player.audio_set_mute(status)
+        if self._fading:
+            self._standby_player.audio_set_mute(status)
 
     def isMuted(self):
         """
@@ -527,17 +656,20 @@ class MediaPlayer(QObject):
         @type state: bool
         """
         self.shuffle_mode = state
+        self._releaseStandby()              # next media will be different
         if not self.shuffled_playlist:      # playlist is empty
             return
 
         current_id = self.shuffled_playlist[self.shuffled_playlist_current_index]
         if state:
-            random.shuffle(self.shuffled_playlist)
-            self.shuffled_playlist.remove(current_id)
-            self.shuffled_playlist.insert(0, current_id)
+            shuffled_playlist = list(self.shuffled_playlist)
+            random.shuffle(shuffled_playlist)
+            shuffled_playlist.remove(current_id)
+            shuffled_playlist.insert(0, current_id)
+            self.shuffled_playlist = shuffled_playlist
             self.shuffled_playlist_current_index = 0
         else:
-            self.shuffled_playlist = sorted(self.shuffled_playlist)
+            self.shuffled_playlist = range(len(self.shuffled_playlist))
             self.shuffled_playlist_current_index = current_id         # id_playlist is range-type (sorted) array
 
         logger.debug("SHUFFLE mode: %s", state)
@@ -573,9 +705,9 @@ class MediaPlayer(QObject):
             # shuffle newly added media with the rest, which have not been played yet
             if self.appending_mode:
                 index = self.shuffled_playlist_current_index+1      # shuffle all from currently played
-                tmp_list = self.shuffled_playlist[index:]
+                tmp_list = list(self.shuffled_playlist[index:])
                 random.shuffle(tmp_list)
-                self.shuffled_playlist[index:] = tmp_list
+                self.shuffled_playlist = self.shuffled_playlist[:index] + array.array('i', tmp_list)
             else:
                 self.setShuffle(True)       # implicit shuffle
         self.adding_media = False
@@ -584,6 +716,153 @@ class MediaPlayer(QObject):
         self.stop()
         self._detachEvents()
 
+    # ------------------------- GAPLESS PLAYBACK ------------------------------------------
+
+    @pyqtSlot(int)
+    def _prepareStandby(self, current_time):
+        """
+        Called when playback time changes. Shortly before current media ends, next media is pre-buffered
+        in standby player, if gapless mode is enabled. This is decided only once per media.
+        @param current_time: playback time in ms
+        @type current_time: int
+        """
+        if not self.shuffled_playlist or self.adding_media:
+            return
+
+        current_row = self.shuffled_playlist[self.shuffled_playlist_current_index]
+        current_id = self.playlist.trackId(current_row)
+        if current_id == self._standby_checked_id or self._fading:
+            return
+
+        crossfade = self._crossfade_duration
+        total_time = self._media_player.get_length()
+        if total_time <= 0 or total_time - current_time > self.GAPLESS_PREROLL + crossfade:
+            return
+
+        self._standby_checked_id = current_id
+        if not crossfade and not self._gapless_enabled:
+            return
+
+        next_row = current_row if self.repeat_mode else self.nextItemIndex()
+        if next_row is None:
+            return
+
+        self._releaseStandby()
+        self._standby_checked_id = current_id
+        logger.debug("Pre-buffering next media for gapless playback: %s", self.playlist.path(next_row))
+        media = self._instance.media_new(self.playlist.path(next_row))
+        self._standby_player.set_media(media)
+        media.release()
+        self._standby_player.audio_set_mute(True)
+        self._standby_id = self.playlist.trackId(next_row)
+        self._standby_ready = False
+        self._crossfade = crossfade
+        self._standby_player.play()         # paused as soon as it starts playing
+
+    @pyqtSlot(int)
+    def _startCrossfade(self, current_time):
+        """
+        Called when playback time changes. In crossfade mode, standby player is resumed
+        when remaining time of current media drops under crossfade duration.
+        @param current_time: playback time in ms
+        @type current_time: int
+        """
+        if not self._standby_ready or not self._crossfade:
+            return
+
+        remaining_time = self._media_player.get_length() - current_time
+        if 0 < remaining_time <= self._crossfade:
+            self._switchToStandby(fade_duration=remaining_time)
+
+    @pyqtSlot()
+    def _standbyPlayingSlot(self):
+        """
+        Called when standby player started playing pre-buffered media.
+        Player is paused and rewound, so media is ready to be resumed immediately.
+        """
+        if self._standby_id == -1 or self._standby_ready:
+            return
+
+        self._standby_player.set_pause(1)
+        self._standby_player.set_position(0.0)
+        self._standby_ready = True
+        logger.debug("Next media pre-buffered, standby player is ready.")
+
+    def _releaseStandby(self):
+        """
+        Stops standby player and throws pre-buffered media away.
+        """
+        self._standby_checked_id = -1
+        if self._fading:
+            self.fader.abort(self._fade_id)
+            self._fading = False
+            self._media_player.audio_set_volume(self._volume)
+        elif self._standby_id == -1:
+            return
+
+        self._standby_player.stop()
+        self._standby_player.set_media(None)
+        self._standby_id = -1
+        self._standby_ready = False
+
+    def _switchToStandby(self, fade_duration=0):
+        """
+        Called when end of media is reached or when crossfade should start. If standby player is ready
+        with next media, it is resumed and both players swap their roles.
+        When crossfading, previous media keeps playing in standby player until it is faded out.
+        @param fade_duration: crossfade duration in ms, 0 = switch immediately
+        @type fade_duration: int
+        @return: False when standby player is not ready (or holds wrong media), next media must be played as usual
+        @rtype: bool
+        """
+        if not self._standby_ready:
+            return False
+
+        current_row = self.shuffled_playlist[self.shuffled_playlist_current_index]
+        next_row = current_row if self.repeat_mode else self.nextItemIndex()
+        if next_row is None or next_row != self.playlist.rowOf(self._standby_id):
+            return False
+
+        self._media_player, self._standby_player = self._standby_player, self._media_player
+        self._event_manager, self._standby_event_manager = self._standby_event_manager, self._event_manager
+        self._standby_id = -1
+        self._standby_ready = False
+
+        self._media_player.audio_set_volume(0 if fade_duration else self._volume)
+        self._media_player.audio_set_mute(self._muted)
+        self._media_player.set_pause(0)
+        if fade_duration:
+            self._fading = True
+            self._fade_id += 1
+            self.fader.volume = self._volume
+            self.fadeSignal.emit(self._standby_player, self._media_player, fade_duration, self._fade_id)
+        else:
+            self._standby_player.stop()
+            self._standby_player.set_media(None)
+
+        self.shuffled_playlist_old_index = self.shuffled_playlist_current_index
+        self.shuffled_playlist_current_index = self.playlist.positionOf(next_row)
+        self.player_is_empty = False
+        logger.debug("Crossfade to next media started." if fade_duration else "Gapless transition to next media.")
+        self._mediaChangedSlot()        # media changed event of standby player is not processed
+        return True
+
+    @pyqtSlot(int)
+    def _fadeFinishedSlot(self, fade_id):
+        """
+        Called when previous media has been faded out, standby player is stopped.
+        @param fade_id: id of finished fade, fades aborted in the meantime are ignored
+        @type fade_id: int
+        """
+        if not self._fading or fade_id != self._fade_id:
+            return
+
+        self._fading = False
+        self._standby_player.stop()
+        self._standby_player.set_media(None)
+        self._media_player.audio_set_volume(self._volume)
+        logger.debug("Crossfade finished.")
+
     # ------------------------- CALLBACKS ------------------------------------------
 
     @pyqtSlot()
@@ -616,6 +895,24 @@ class MediaPlayer(QObject):
         self.is_playing = False
         self.is_paused = False
         self.is_stopped = True
+        self._tick_timer.stop()                 # late tick would overwrite reset time and position
+        self._tick_pending = False
+
+    @pyqtSlot()
+    def _scheduleTick(self):
+        """
+        Called when vlc reports new time or position and no tick is pending.
+        Tick is emitted immediately if last one is older than tick_rate, otherwise it is postponed,
+        so all changes reported in the meantime are coalesced into one tick.
+        """
+        elapsed = (time.perf_counter() - self._last_tick) * 1000
+        self._tick_timer.start(max(0, int(self.tick_rate - elapsed)))
+
+    @pyqtSlot()
+    def _tickToc(self):
+        self._tick_pending = False
+        self._last_tick = time.perf_counter()
+        self.tickTocSignal.emit(self._tick_time, self._tick_position)
 
     @pyqtSlot()
     def _mediaChangedSlot(self):
@@ -623,6 +920,10 @@ class MediaPlayer(QObject):
         Slot is used as helper, because callback are called from vlc directly (from another thread),
         so to prevent cross-thread collision, variables (flags) are manipulated only from MediaPlayer thread
         """
+        self._standby_checked_id = -1
+        settings = QSettings()
+        self._gapless_enabled = settings.value("components/media/MediaPlayer/gapless", False, bool)
+        self._crossfade_duration = settings.value("components/media/MediaPlayer/crossfade", 0, int) * 1000
         current_index = self.shuffled_playlist[self.shuffled_playlist_current_index]
         last_index = self.shuffled_playlist[self.shuffled_playlist_old_index]
         self.mediaChangedSignal.emit(current_index, last_index)
@@ -633,118 +934,980 @@ class MediaPlayer(QObject):
         Slot is used as helper, because callback are called from vlc directly (from another thread),
         so to prevent cross-thread collision, variables (flags) are manipulated only from MediaPlayer thread
         """
-        self.endReachedSignal.emit(self.repeat_mode)          # if repeat_mode then do not switch to next song
+        if not self._switchToStandby():
+            self.endReachedSignal.emit(self.repeat_mode)          # if repeat_mode then do not switch to next song
 
     @pyqtSlot()
     def _errorSlot(self):
         logger.warning("Media encountered error")
-        current_media_path = self.media_list[self.shuffled_playlist[self.shuffled_playlist_current_index]]
+        current_media_path = self.playlist.path(self.shuffled_playlist[self.shuffled_playlist_current_index])
         self.errorSignal.emit(tools.ErrorMessages.ERROR, tr['MEDIA_PLAY_ERROR'], "Media: %s" % current_media_path)
 
     # WARNING: CALLBACKS CALLED DIRECTLY FROM ANOTHER THREAD (VLC THREAD) !!!!
+    # Events of standby player (pre-buffering in gapless mode) are ignored.
 
-    def __timeChangedCallback(self, event):
+    def __timeChangedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         try:
             new_time = event.u.new_time
         except RuntimeError:
             logger.warning("Media player callback called, but C++ object does not exist. "
                            "If program is being closed, this is a possible behaviour.")
         else:
-            self.timeChangedSignal.emit(new_time)
+            self._tick_time = new_time
+            self.__requestTick()
 
-    def __positionChangedCallback(self, event):
+    def __positionChangedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         try:
             newPos = event.u.new_position
         except RuntimeError:
             logger.warning("Media player callback called, but C++ object does not exist. "
                            "If program is being closed, this is a possible behaviour.")
         else:
-            newPos = 0 if newPos > 1 else newPos
-            self.positionChangedSignal.emit(newPos)
-
-    def __playingCallback(self, event):
+            self._tick_position = 0 if newPos > 1 else newPos
+            self.__requestTick()
+
+    def __requestTick(self):
+        # only one event per tick crosses threads, values are read when tick is emitted
+        if not self._tick_pending:
+            self._tick_pending = True
+            self.bridge.push(self.EVENT_TICK)
+
+    def __playingCallback(self, event, player):
+        if player is not self._media_player:
+            self.bridge.push(self.EVENT_STANDBY_PLAYING)
+            return
         logger.debug("Player playing callback")
-        self.playingSignal.emit()
-
-    def __pausedCallback(self, event):
+        end_reached_time = self._end_reached_time
+        if end_reached_time is not None:
+            self._end_reached_time = None
+            self.transition_latency = (time.perf_counter() - end_reached_time) * 1000
+            logger.debug("Transition to next media took %.1f ms.", self.transition_latency)
+        self.bridge.push(self.EVENT_PLAYING)
+
+    def __pausedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         logger.debug("Player paused callback")
-        self.pausedSignal.emit()
+        self.bridge.push(self.EVENT_PAUSED)
 
-    def __stoppedCallback(self, event):
+    def __stoppedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         logger.debug("Player stopped callback")
-        self.stoppedSignal.emit()
+        self.bridge.push(self.EVENT_STOPPED)
 
-    def __forwardCallback(self, event):
+    def __forwardCallback(self, event, player):
         logger.debug("Player next track callback")
 
-    def __backwardCallback(self, event):
+    def __backwardCallback(self, event, player):
         logger.debug("Player prev track callback")
 
-    def __endReachedCallback(self, event):
+    def __endReachedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         logger.debug("Player media end reached callback")
-        self.endReachedCallbackSignal.emit()
+        self._end_reached_time = time.perf_counter()
+        self.bridge.push(self.EVENT_END_REACHED)
 
-    def __mediaChangedCallback(self, event):
+    def __mediaChangedCallback(self, event, player):
+        if player is not self._media_player:
+            return
         logger.debug("Player media changed callback")
-        self.mediaChangedCallbackSignal.emit()
+        self.bridge.push(self.EVENT_MEDIA_CHANGED)
 
-    def __errorCallback(self, event):
-        self.errorCallbackSignal.emit()
+    def __errorCallback(self, event, player):
+        if player is not self._media_player:
+            return
+        self.bridge.push(self.EVENT_ERROR)
 
-    def __bufferingCallback(self, event):
+    def __bufferingCallback(self, event, player):
         pass
 
-    def __openingCallback(self, event):
+    def __openingCallback(self, event, player):
         pass
 
 
+class VolumeFader(QObject):
+    """
+    Ramps volume of two media players during crossfade.
+    Previous media is faded out and next one faded in along equal-power curve,
+    so perceived loudness doesn't drop in the middle of transition.
+    Fader runs in separated thread, volume steps add no work to GUI thread.
+    Worker method: VolumeFader.fade()
+    """
+
+    finishedSignal = pyqtSignal(int)        # id of finished fade
+
+    STEP = 40           # volume is updated every 40 ms
+
+    def __init__(self):
+        super(VolumeFader, self).__init__()
+        self.volume = 100           # target volume, may be changed by media player during fading
+
+        self._lock = threading.Lock()
+        self._fade_out_player = None
+        self._fade_in_player = None
+        self._fade_id = 0
+        self._aborted_id = 0
+        self._duration = 0
+        self._start_time = 0
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.STEP)
+        self._timer.timeout.connect(self._step)
+
+    @pyqtSlot(object, object, int, int)
+    def fade(self, fade_out_player, fade_in_player, duration, fade_id):
+        """
+        Starts crossfade between given players.
+        @type fade_out_player: libvlc.MediaPlayer
+        @type fade_in_player: libvlc.MediaPlayer
+        @param duration: fade duration in ms
+        @type duration: int
+        @param fade_id: id of fade, returned by finishedSignal
+        @type fade_id: int
+        """
+        with self._lock:
+            if fade_id <= self._aborted_id:
+                return                  # aborted before it even started
+
+            self._fade_out_player = fade_out_player
+            self._fade_in_player = fade_in_player
+            self._fade_id = fade_id
+            self._duration = max(duration, 1)
+            self._start_time = time.perf_counter()
+
+        logger.debug("Fading volume for %s ms", duration)
+        self._timer.start()
+        self._step()
+
+    def abort(self, fade_id):
+        """
+        Called directly from another thread. Stops fading immediately,
+        fader doesn't touch players anymore when method returns.
+        @param fade_id: id of fade to be aborted
+        @type fade_id: int
+        """
+        with self._lock:
+            self._aborted_id = max(self._aborted_id, fade_id)
+            if self._fade_id <= self._aborted_id:
+                self._fade_out_player = None
+                self._fade_in_player = None
+
+    @pyqtSlot()
+    def _step(self):
+        with self._lock:
+            if self._fade_in_player is None:
+                self._timer.stop()
+                return
+
+            progress = min((time.perf_counter() - self._start_time) * 1000 / self._duration, 1.0)
+            self._fade_out_player.audio_set_volume(int(self.volume * math.cos(progress * math.pi / 2)))
+            self._fade_in_player.audio_set_volume(int(round(self.volume * math.sin(progress * math.pi / 2))))
+            if progress < 1.0:
+                return
+
+            self._fade_out_player = None
+            self._fade_in_player = None
+
+        self._timer.stop()
+        self.finishedSignal.emit(self._fade_id)
+
+
+class CallbackBridge(QObject):
+    """
+    Passes event codes from vlc threads to Qt thread without emitting signal for every event.
+    Callbacks write codes to preallocated ring buffer, Qt thread drains the buffer in batches.
+    Only one queued call is posted per batch (when drain is not pending already).
+    Writers don't lock: each writer gets unique ticket (itertools.count is atomic in CPython)
+    and publishes its slot by writing the ticket to it, reader stops at first unpublished slot.
+    When buffer is full, event is dropped and counted.
+    Bridge statistics (queue depth, drops, latency) are available by stats() method.
+    """
+
+    drainRequestSignal = pyqtSignal()
+
+    CAPACITY = 256
+
+    def __init__(self, handlers, capacity=CAPACITY, parent=None):
+        """
+        @param handlers: event code: callable without arguments, called from Qt thread
+        @type handlers: dict
+        @param capacity: max number of events waiting for drain
+        @type capacity: int
+        """
+        super(CallbackBridge, self).__init__(parent)
+        self.capacity = capacity
+        self._handlers = handlers
+        self._codes = array.array('i', bytes(4 * capacity))
+        self._tickets = array.array('q', [-1]) * capacity       # ticket of event published in each slot
+        self._stamps = array.array('d', bytes(8 * capacity))    # time of each push
+        self._ticket_counter = itertools.count()
+        self._dropped_tickets = set()
+        self._written = 0               # approximate, for queue depth only
+        self._read = 0                  # next ticket to be drained, written by Qt thread only
+        self._drain_pending = False
+
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0              # largest batch drained at once
+        self.max_latency = 0.0          # longest time (ms) from push to handling
+
+        self.drainRequestSignal.connect(self.drain, Qt.QueuedConnection)
+
+    def push(self, code):
+        """
+        Called from any thread (vlc callbacks). Never blocks.
+        @type code: int
+        """
+        ticket = next(self._ticket_counter)
+        self._written = ticket + 1
+        if ticket - self._read >= self.capacity:
+            self._dropped_tickets.add(ticket)           # slot still holds event not drained yet
+        else:
+            slot = ticket % self.capacity
+            self._codes[slot] = code
+            self._stamps[slot] = time.perf_counter()
+            self._tickets[slot] = ticket                # publish
+
+        if not self._drain_pending:
+            self._drain_pending = True
+            self.drainRequestSignal.emit()
+
+    @pyqtSlot()
+    def drain(self):
+        """
+        Handles all published events in order of their tickets.
+        """
+        self._drain_pending = False         # events pushed from now on request another drain
+        batch = 0
+        dropped = 0
+        now = time.perf_counter()
+        while True:
+            ticket = self._read
+            slot = ticket % self.capacity
+            if self._tickets[slot] == ticket:
+                code = self._codes[slot]
+                self.max_latency = max(self.max_latency, (now - self._stamps[slot]) * 1000)
+                self._read = ticket + 1
+                batch += 1
+                self._handlers[code]()
+            elif ticket in self._dropped_tickets:
+                self._dropped_tickets.discard(ticket)
+                self._read = ticket + 1
+                dropped += 1
+            else:
+                break                       # not published yet, writer will request another drain
+
+        self.delivered += batch
+        self.max_depth = max(self.max_depth, batch + dropped)
+        if dropped:
+            self.dropped += dropped
+            logger.warning("Callback bridge is full, %s events dropped (%s in total).", dropped, self.dropped)
+
+    def depth(self):
+        """
+        @return: number of events waiting for drain
+        @rtype: int
+        """
+        return max(0, self._written - self._read)
+
+    def stats(self):
+        """
+        @return: depth, max_depth, delivered, dropped, max_latency (ms)
+        @rtype: dict
+        """
+        return {'depth': self.depth(), 'max_depth': self.max_depth, 'delivered': self.delivered,
+                'dropped': self.dropped, 'max_latency': self.max_latency}
+
+
+class MediaCache(object):
+    """
+    Persistent metadata cache of parsed media files.
+    Records are keyed by file path and validated by file size and mtime,
+    each holds media duration and basic tags read by libvlc (see TAGS).
+    Cache is bounded, least recently used records are evicted first.
+    Cache is shared by parse workers, all records are guarded by mutex.
+    """
+
+    VERSION = 1
+    TAGS = (('title', libvlc.Meta.Title),
+            ('artist', libvlc.Meta.Artist),
+            ('album', libvlc.Meta.Album),
+            ('genre', libvlc.Meta.Genre),
+            ('track', libvlc.Meta.TrackNumber),
+            ('date', libvlc.Meta.Date))
+
+    def __init__(self, cache_file, max_entries=200000):
+        """
+        @param cache_file: where the cache is stored
+        @type cache_file: unicode
+        @param max_entries: max number of cached media files
+        @type max_entries: int
+        """
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+
+        self._records = collections.OrderedDict()      # path: [size, mtime_ns, duration, tags], LRU is first
+        self._dirty = False
+        self._mutex = QMutex()
+
+    def load(self):
+        """
+        Loads cache records from disk. Invalid or outdated cache file is ignored.
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        self.loaded = True
+        if not os.path.isfile(self.cache_file):
+            logger.debug("No media cache file found, cache will be created.")
+            return
+
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = ujson.load(f)
+        except (IOError, ValueError):
+            logger.exception("Unable to load media cache from '%s', cache will be rebuilt.", self.cache_file)
+            return
+
+        if data.get('version') != self.VERSION:
+            logger.debug("Media cache is outdated, cache will be rebuilt.")
+            self._dirty = True
+            return
+
+        # records are stored in LRU order
+        self._records = collections.OrderedDict(data.get('media', []))
+        logger.debug("Media cache loaded, %s media cached.", len(self._records))
+
+    def save(self):
+        """
+        Dumps cache records to disk if anything changed. File is written atomically (write-temp-then-rename).
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        if not self._dirty:
+            return
+
+        tmp_file = self.cache_file + ".tmp"
+        data = {'version': self.VERSION, 'media': list(self._records.items())}
+        try:
+            with open(tmp_file, 'w') as f:
+                ujson.dump(data, f)
+            os.replace(tmp_file, self.cache_file)
+        except (IOError, OSError):
+            logger.exception("Unable to save media cache to '%s'", self.cache_file)
+        else:
+            self._dirty = False
+            logger.debug("Media cache saved, %s media cached. Hits: %s, misses: %s.",
+                         len(self._records), self.hits, self.misses)
+
+    def get(self, path, size, mtime):
+        """
+        @return: (duration, tags) if media is cached and file has not changed, else None
+        @rtype: (int, dict) or None
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        record = self._records.get(path)
+        if record is None or record[0] != size or record[1] != mtime:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._records.move_to_end(path)
+        return record[2], record[3]
+
+    def put(self, path, size, mtime, duration, tags):
+        """
+        Stores media metadata to cache. Least recently used records are evicted when cache is full.
+        """
+        mutexLocker = QMutexLocker(self._mutex)
+        self._records[path] = [size, mtime, duration, tags]
+        self._records.move_to_end(path)
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+        self._dirty = True
+
+    def paths(self):
+        mutexLocker = QMutexLocker(self._mutex)
+        return list(self._records.keys())
+
+    def remove(self, paths):
+        mutexLocker = QMutexLocker(self._mutex)
+        for path in paths:
+            if self._records.pop(path, None) is not None:
+                self._dirty = True
+
+    @staticmethod
+    def readTags(media_object):
+        """
+        Reads basic tags from parsed media object.
+        @type media_object: libvlc.Media
+        @rtype: dict
+        """
+        tags = {}
+        for name, meta in MediaCache.TAGS:
+            value = media_object.get_meta(meta)
+            if value:
+                tags[name] = value
+        return tags
+
+
 class MediaParser(QObject):
     """
     Class for parsing media object.
-    Runs in separated thread.
+    Runs in separated thread, media files are parsed by pool of worker threads.
+    Each worker thread has its own libvlc instance, so media are really parsed in parallel.
+    Parsed media are reordered, so they are sent to media player in the same order as they were scanned.
+    In ASYNC_ENGINE mode, no worker threads are used, parsing is left to libvlc (parse_async) instead.
+    Metadata of already parsed media are taken from persistent cache, so libvlc is not used at all.
+    Metadata (with tags) of all parsed media are sent to media library in batches (see libraryRecordsSignal).
+    In lazy mode, media are sent to player immediately (with unknown duration) and parsed later on background,
+    parsed metadata are then sent via metadataParsedSignal. Background parsing is driven by priority queue,
+    media prioritized by prioritizeMedia() (e.g. visible playlist rows) are parsed first, the rest
+    in scan order when there is nothing more important to do. Media found in watched library folders
+    (see parseLibraryMedia()) are parsed the same way, but only when there is nothing else to parse.
+    Media adding is cancelled by starting new generation (see components.disk.Generation), media of stale
+    generations are not parsed (if not in progress already) and they are thrown away instead of being sent.
     Data are transferred via Signal/Slot mechanism.
     Worker method: MediaParser.parseMedia()
     """
 
-    finishedSignal = pyqtSignal()
-    dataParsedSignal = pyqtSignal(list)
+    finishedSignal = pyqtSignal(int)                # generation of finished media adding
+    dataParsedSignal = pyqtSignal(list, int)        # (list of (unicode_path, duration, media_object), generation)
+    metadataParsedSignal = pyqtSignal(list)         # list of (unicode_path, duration) parsed in lazy mode
+    libraryRecordsSignal = pyqtSignal(list)         # list of (unicode_path, size, mtime_ns, duration, tags)
+    libraryRemovedSignal = pyqtSignal(list)         # list of unicode_path, files which no longer exist
 
-    def __init__(self):
-        super(MediaParser, self).__init__()
-        self.vlc_instance = libvlc.Instance()        # for parsing
-        self._stop = False
+    # helper signals, parsed media are sent from worker threads (or libvlc threads) back to parser thread
+    _mediaParsedSignal = pyqtSignal(int, object)
+    _asyncParsedSignal = pyqtSignal(int)
+    _dropPendingSignal = pyqtSignal()
 
-        logger.debug("Media Parser initialized.")
+    WORKERS_ENGINE = "workers"
+    ASYNC_ENGINE = "async"
 
-    @pyqtSlot(list)
-    def parseMedia(self, sources):
+    PURGE_DELAY = 60 * 1000             # invalidate cache of removed files 1 minute after start
+    PURGE_CHUNK = 500                   # number of checked files per one purge step
+    METADATA_DELAY = 250                # lazily parsed metadata are sent in batches every 250ms
+    LIBRARY_DELAY = 1000                # records for media library are sent in batches every second
+    ASYNC_TIMEOUT = 10                  # in sec, async parsing not reported by libvlc within this time is ended
+
+    PRIORITY_HIGH = 0                   # lazy parsing priority of media requested by prioritizeMedia()
+    PRIORITY_BACKGROUND = 1             # lazy parsing priority of all other media (scan order)
+    PRIORITY_LIBRARY = 2                # lazy parsing priority of media found by folder watcher
+
+    def __init__(self, cache_file=None, backpressure=None, generation=None):
+        """
+        @param cache_file: path to persistent metadata cache, cache is not used when None
+        @type cache_file: unicode
+        @param backpressure: flow control shared with disk browser, released when media leave parser
+        @type backpressure: components.disk.Backpressure
+        @param generation: generation counter of media adding shared with disk browser
+        @type generation: components.disk.Generation
+        """
+        super(MediaParser, self).__init__()
+        self.backpressure = backpressure
+        self.generation = generation
+        self._generation = 0                        # generation of media adding in progress
+        self._generation_seq = 0                    # sequence number of first media of current generation
+        self._closed = False                        # application is closing, nothing new is submitted
+        self._pool = None
+        self._local = threading.local()             # each worker thread has its own libvlc instance
+
+        self._next_seq = 0                          # sequence number of next media submitted for parsing
+        self._emit_seq = 0                          # sequence number of next media which will be sent to player
+        self._parsed = {}                           # seq: (unicode_path, duration, media_object) to be reordered
+        self._finishing = False                     # end flag received, waiting for workers
+        self._adding = False                        # media adding is running (first batch has been received)
+        self._purge_paths = []                      # cached paths waiting for existence check
+
+        self.lazy = False                           # parse later mode, read from settings when adding starts
+        self._lazy_queue = []                       # heap of (priority_key, unicode_path) waiting for lazy parsing
+        self._lazy_keys = {}                        # unicode_path: valid priority_key, other heap items are stale
+        self._lazy_order = 0                        # scan order of media waiting for lazy parsing
+        self._lazy_stamp = 0                        # incremented by every prioritizeMedia() call
+        self._lazy_seq = 0                          # lazily parsed media have negative sequence numbers
+        self._lazy_parsing = 0                      # number of lazily parsed media in-flight
+        self._metadata = []                         # (unicode_path, duration) waiting to be sent
+        self._metadataTimer = QTimer(self)
+        self._metadataTimer.setSingleShot(True)
+        self._metadataTimer.timeout.connect(self._sendMetadata)
+        self._library = collections.deque()         # records for media library, appended by worker threads
+        self._libraryTimer = QTimer(self)
+        self._libraryTimer.setSingleShot(True)
+        self._libraryTimer.timeout.connect(self._sendLibraryRecords)
+
+        self._vlc_instance = None                   # libvlc instance for async parsing
+        self._async_queue = collections.deque()     # (seq, unicode_path) waiting for async parsing
+        self._async_parsing = {}                    # seq: (unicode_path, media_object, event_manager, stat, time)
+        self._asyncTimer = QTimer(self)
+        self._asyncTimer.timeout.connect(self._checkAsyncTimeouts)
+
+        settings = QSettings()
+        self.engine = settings.value("components/media/MediaParser/engine", self.WORKERS_ENGINE)
+        self.n_workers = settings.value("components/media/MediaParser/workers", os.cpu_count() or 1, int)
+        self.n_workers = max(1, self.n_workers)
+        self.async_window = settings.value("components/media/MediaParser/async_window", 16, int)
+        self.async_window = max(1, self.async_window)
+
+        self.cache = None
+        if cache_file:
+            max_entries = settings.value("components/media/MediaCache/max_entries", 200000, int)
+            self.cache = MediaCache(cache_file, max_entries)
+
+        self._mediaParsedSignal.connect(self._mediaParsed)
+        self._asyncParsedSignal.connect(self._asyncParsed)
+        self._dropPendingSignal.connect(self._dropPending)
+
+        if self.engine == self.ASYNC_ENGINE:
+            logger.debug("Media Parser initialized, async parsing with %s media in-flight.", self.async_window)
+        else:
+            logger.debug("Media Parser initialized, %s parse workers.", self.n_workers)
+
+    @pyqtSlot(list, int)
+    def parseMedia(self, sources, generation):
         """
-        Parses media files. Result is send to media player in separated thread.
+        Submits media files to parse engine. Result is send to media player in separated thread.
         Thread worker!
         @type sources: list of unicode
+        @param generation: generation of media adding, media of stale generation are thrown away
+        @type generation: int
         """
+        if self.generation is not None and self.generation.isStale(generation):
+            if self.backpressure:
+                self.backpressure.release(len(sources))         # thrown away
+            return
+
+        if generation != self._generation:
+            # new media adding, media of previous one are stale from now on
+            self._generation = generation
+            self._generation_seq = self._next_seq
+            self._finishing = False
+            self._adding = False
+
         # END FLAG RECEIVED
         if not sources:
-            logger.debug("Parser finished, end flag received.")
-            self._stop = False           # reset stop flag
-            self.finishedSignal.emit()
+            logger.debug("Parser end flag received, waiting for parse workers.")
+            self._finishing = True
+            self._schedule()
 
         # PARSE MEDIA FILES
-        elif not self._stop:
-            media_list = []
+        else:
+            if not self._adding:
+                self._adding = True
+                self.lazy = QSettings().value("components/media/MediaParser/lazy_parsing", False, bool)
+            if self.cache and not self.cache.loaded:
+                self.cache.load()
+
             for unicode_path in sources:
-                media_object = self.vlc_instance.media_new(unicode_path)
-                media_object.parse()
-                media_list.append((unicode_path, media_object))
+                if self.lazy:
+                    # send media to player right now, parse them later
+                    self._parsed[self._next_seq] = (unicode_path, -1, None)
+                    key = self._lazy_keys.get(unicode_path)
+                    if key is None or key[0] == self.PRIORITY_LIBRARY:
+                        self._pushLazy(unicode_path, (self.PRIORITY_BACKGROUND, 0, self._lazy_order))
+                        self._lazy_order += 1
+                else:
+                    self._submit(self._next_seq, unicode_path)
+                self._next_seq += 1
+
+            self._schedule()
+
+    @pyqtSlot(list)
+    def parseLibraryMedia(self, sources):
+        """
+        Queues media found in media library folders (see components.disk.FolderWatcher) for lazy parsing,
+        so their records in media library are kept up to date. Media are parsed after all other media,
+        media with cached metadata are not parsed at all.
+        Thread worker!
+        @type sources: list of unicode
+        """
+        if self.cache and not self.cache.loaded:
+            self.cache.load()
+
+        for unicode_path in sources:
+            if unicode_path not in self._lazy_keys:
+                self._pushLazy(unicode_path, (self.PRIORITY_LIBRARY, 0, self._lazy_order))
+                self._lazy_order += 1
+
+        self._schedule()
 
-            self.dataParsedSignal.emit(media_list)
+    def _isStale(self, seq):
+        """
+        @return: True when media belongs to cancelled media adding (lazily parsed media never are)
+        @rtype: bool
+        """
+        if seq < 0:
+            return False
+        return seq < self._generation_seq or \
+            (self.generation is not None and self.generation.isStale(self._generation))
+
+    @pyqtSlot(list)
+    def prioritizeMedia(self, sources):
+        """
+        Moves given media waiting for lazy parsing to the front of the queue.
+        Media from the latest call are parsed first, in given order.
+        Media which are not waiting for lazy parsing are ignored.
+        Thread worker!
+        @param sources: paths ordered by importance
+        @type sources: list of unicode
+        """
+        self._lazy_stamp += 1
+        for i, unicode_path in enumerate(sources):
+            if unicode_path in self._lazy_keys:
+                self._pushLazy(unicode_path, (self.PRIORITY_HIGH, -self._lazy_stamp, i))
+
+        self._schedule()
+
+    def _pushLazy(self, unicode_path, key):
+        """
+        Adds media to lazy parsing queue or changes priority of already queued media.
+        Previous heap item of media becomes stale and it is skipped when popped.
+        """
+        self._lazy_keys[unicode_path] = key
+        heapq.heappush(self._lazy_queue, (key, unicode_path))
+
+        # get rid of stale items when they outnumber valid ones
+        if len(self._lazy_queue) > 2 * len(self._lazy_keys) + 1000:
+            self._lazy_queue = [(key, path) for path, key in self._lazy_keys.items()]
+            heapq.heapify(self._lazy_queue)
+
+    def _popLazy(self):
+        """
+        Takes the most important media from lazy parsing queue.
+        @return: path of media or None if queue is empty
+        @rtype: unicode or None
+        """
+        while self._lazy_queue:
+            key, unicode_path = heapq.heappop(self._lazy_queue)
+            if self._lazy_keys.get(unicode_path) == key:
+                del self._lazy_keys[unicode_path]
+                return unicode_path
+
+    def _submit(self, seq, unicode_path):
+        """
+        Hands media file over to parse engine - to worker threads or to async parsing queue.
+        """
+        if self.engine == self.ASYNC_ENGINE:
+            self._async_queue.append((seq, unicode_path))
+        else:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers)
+
+            generation = None if seq < 0 else self._generation
+            future = self._pool.submit(self._parseWorker, unicode_path, generation)
+            future.add_done_callback(functools.partial(self._workerDone, seq))
+
+    def _schedule(self):
+        """
+        Submits queued work to parse engine and sends out all parsed results.
+        Media waiting for lazy parsing are submitted only when all other media are parsed and sent out.
+        """
+        if self.engine == self.ASYNC_ENGINE:
+            self._dispatchAsync()
+
+        self._emitParsed()
+
+        window = self.async_window if self.engine == self.ASYNC_ENGINE else self.n_workers
+        while not self._closed and self._lazy_keys and self._lazy_parsing < window and \
+                self._emit_seq == self._next_seq:
+            self._lazy_seq -= 1
+            self._lazy_parsing += 1
+            self._submit(self._lazy_seq, self._popLazy())
+
+        if self.engine == self.ASYNC_ENGINE:
+            self._dispatchAsync()
+
+        if self._library and not self._libraryTimer.isActive():
+            self._libraryTimer.start(self.LIBRARY_DELAY)
+
+    @pyqtSlot()
+    def _sendLibraryRecords(self):
+        records = []
+        while self._library:
+            records.append(self._library.popleft())
+        self.libraryRecordsSignal.emit(records)
+
+    def _storeResult(self, seq, result):
+        """
+        Stores parsed media to be reordered and sent to player or to be sent as lazily parsed metadata.
+        @type result: (unicode, int, libvlc.Media or None)
+        """
+        if seq >= 0:
+            self._parsed[seq] = result
+            return
+
+        self._lazy_parsing -= 1
+        unicode_path, duration, media_object = result
+        if media_object is not None:
+            media_object.release()          # player already has its own media object
+        if unicode_path is not None and duration >= 0:
+            self._metadata.append((unicode_path, duration))
+            if not self._metadataTimer.isActive():
+                self._metadataTimer.start(self.METADATA_DELAY)
+
+    @pyqtSlot()
+    def _sendMetadata(self):
+        metadata, self._metadata = self._metadata, []
+        self.metadataParsedSignal.emit(metadata)
+
+        if self.cache and not self._lazy_keys and not self._lazy_parsing:
+            logger.debug("Lazy parsing finished.")
+            self.cache.save()
+
+    def _parseWorker(self, unicode_path, generation):
+        """
+        Parses single media file or takes its metadata from cache. Called in worker thread!
+        @type unicode_path: unicode
+        @param generation: generation of media adding, None for lazy parsing
+        @type generation: int or None
+        @return: (path, duration, parsed media object) or (path, duration, None) if metadata are cached
+        @rtype: (unicode, int, libvlc.Media or None)
+        """
+        if self._closed or (generation is not None and self.generation is not None and
+                            self.generation.isStale(generation)):
+            return unicode_path, -1, None
+
+        stat = None
+        if self.cache:
+            try:
+                stat = os.stat(unicode_path)
+            except OSError:
+                pass
+            else:
+                cached = self.cache.get(unicode_path, stat.st_size, stat.st_mtime_ns)
+                if cached is not None:
+                    self._library.append((unicode_path, stat.st_size, stat.st_mtime_ns, cached[0], cached[1]))
+                    return unicode_path, cached[0], None
+
+        vlc_instance = getattr(self._local, 'vlc_instance', None)
+        if vlc_instance is None:
+            vlc_instance = self._local.vlc_instance = libvlc.Instance()
+
+        media_object = vlc_instance.media_new(unicode_path)
+        media_object.parse()
+        duration = media_object.get_duration()
+
+        if stat is not None and duration >= 0:
+            self._storeMetadata(unicode_path, stat, duration, media_object)
+
+        return unicode_path, duration, media_object
+
+    def _storeMetadata(self, unicode_path, stat, duration, media_object):
+        """
+        Stores metadata of freshly parsed media to cache and queues them for media library.
+        Called in worker thread or in parser thread!
+        """
+        tags = MediaCache.readTags(media_object)
+        self.cache.put(unicode_path, stat.st_size, stat.st_mtime_ns, duration, tags)
+        self._library.append((unicode_path, stat.st_size, stat.st_mtime_ns, duration, tags))
+
+    def _workerDone(self, seq, future):
+        """
+        Called in worker thread when media is parsed. Result is passed to parser thread.
+        """
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("Parse worker failed!")
+            result = (None, -1, None)
+
+        self._mediaParsedSignal.emit(seq, result)
+
+    def _dispatchAsync(self):
+        """
+        Starts async parsing (libvlc parse_async) of queued media, but only up to async_window media at once.
+        Completion is reported by libvlc via MediaParsedChanged event. Some libvlc versions do not send
+        the event for media which cannot be parsed, so parsing is ended after ASYNC_TIMEOUT anyway.
+        """
+        if self._vlc_instance is None:
+            self._vlc_instance = libvlc.Instance()
+
+        while self._async_queue and len(self._async_parsing) < self.async_window:
+            seq, unicode_path = self._async_queue.popleft()
+            if self._closed or self._isStale(seq):
+                self._storeResult(seq, (unicode_path, -1, None))
+                continue
+
+            stat = None
+            if self.cache:
+                try:
+                    stat = os.stat(unicode_path)
+                except OSError:
+                    pass
+                else:
+                    cached = self.cache.get(unicode_path, stat.st_size, stat.st_mtime_ns)
+                    if cached is not None:
+                        self._library.append((unicode_path, stat.st_size, stat.st_mtime_ns, cached[0], cached[1]))
+                        self._storeResult(seq, (unicode_path, cached[0], None))
+                        continue
+
+            media_object = self._vlc_instance.media_new(unicode_path)
+            event_manager = media_object.event_manager()        # must be kept alive until event is detached
+            event_manager.event_attach(libvlc.EventType.MediaParsedChanged, self.__parsedCallback, seq)
+            self._async_parsing[seq] = (unicode_path, media_object, event_manager, stat, time.time())
+            media_object.parse_async()
+
+        if self._async_parsing and not self._asyncTimer.isActive():
+            self._asyncTimer.start(1000)
+
+    @pyqtSlot(int)
+    def _asyncParsed(self, seq):
+        """
+        Called as slot when libvlc finished async parsing of media.
+        """
+        if seq not in self._async_parsing:
+            return          # parsed status changed more than once
+
+        self._finishAsync(seq, parsed=True)
+        self._schedule()
+
+    @pyqtSlot()
+    def _checkAsyncTimeouts(self):
+        """
+        Ends async parsing of media, whose parsed event has not come in time.
+        Media are sent with unknown duration (if not parsed in the meantime), so media adding does not stall.
+        """
+        now = time.time()
+        expired = [seq for seq, item in self._async_parsing.items() if now - item[4] >= self.ASYNC_TIMEOUT]
+        for seq in expired:
+            media_object = self._async_parsing[seq][1]
+            parsed = bool(media_object.is_parsed())
+            if not parsed:
+                logger.warning("Async parsing of '%s' timed out.", self._async_parsing[seq][0])
+            self._finishAsync(seq, parsed)
+
+        if not self._async_parsing:
+            self._asyncTimer.stop()
+        if expired:
+            self._schedule()
+
+    def _finishAsync(self, seq, parsed):
+        """
+        Stores result of async parsing of given media.
+        @param parsed: False when parsing timed out, media duration is unknown then
+        """
+        unicode_path, media_object, event_manager, stat, started = self._async_parsing.pop(seq)
+        event_manager.event_detach(libvlc.EventType.MediaParsedChanged)
+        duration = media_object.get_duration() if parsed else -1
+
+        if stat is not None and duration >= 0:
+            self._storeMetadata(unicode_path, stat, duration, media_object)
+
+        self._storeResult(seq, (unicode_path, duration, media_object))
+
+    # WARNING: CALLBACK CALLED DIRECTLY FROM ANOTHER THREAD (VLC THREAD) !!!!
+
+    def __parsedCallback(self, event, seq):
+        self._asyncParsedSignal.emit(seq)
+
+    @pyqtSlot(int, object)
+    def _mediaParsed(self, seq, result):
+        self._storeResult(seq, result)
+        self._schedule()
+
+    def _emitParsed(self):
+        """
+        Sends all parsed media which are next in order to media player.
+        When end flag has been received and all media are parsed, finished signal is sent.
+        """
+        media_list = []
+        emit_seq = self._emit_seq
+        while self._emit_seq in self._parsed:
+            seq = self._emit_seq
+            unicode_path, duration, media_object = self._parsed.pop(seq)
+            self._emit_seq += 1
+
+            if self._isStale(seq) or unicode_path is None:
+                if media_object is not None:
+                    media_object.release()
+            else:
+                media_list.append((unicode_path, duration, media_object))
+
+        if self.backpressure and self._emit_seq > emit_seq:
+            self.backpressure.release(self._emit_seq - emit_seq)
+        if media_list:
+            self.dataParsedSignal.emit(media_list, self._generation)
+
+        if self._finishing and self._emit_seq == self._next_seq:
+            logger.debug("Parser finished, all media parsed.")
+            self._finishing = False
+            self._adding = False
+            if self.cache:
+                self.cache.save()
+            if not self._isStale(self._generation_seq):
+                self.finishedSignal.emit(self._generation)
+
+    @pyqtSlot()
+    def start(self):
+        """
+        Called as slot when parser thread is started. Schedules invalidation of cached media,
+        which do not exist anymore.
+        """
+        if self.cache:
+            QTimer.singleShot(self.PURGE_DELAY, self.purgeCache)
+
+    @pyqtSlot()
+    def purgeCache(self):
+        """
+        Removes records of disappeared files from metadata cache.
+        Files are checked in small chunks, so parsing requests are not blocked.
+        Thread worker!
+        """
+        if not self._purge_paths:
+            if not self.cache.loaded:
+                self.cache.load()
+            self._purge_paths = self.cache.paths()
+            logger.debug("Checking %s cached media files for existence...", len(self._purge_paths))
+
+        chunk = self._purge_paths[-self.PURGE_CHUNK:]
+        del self._purge_paths[-self.PURGE_CHUNK:]
+        removed = [path for path in chunk if not os.path.exists(path)]
+        self.cache.remove(removed)
+        if removed:
+            self.libraryRemovedSignal.emit(removed)
+
+        if self._purge_paths:
+            QTimer.singleShot(0, self.purgeCache)
+        else:
+            logger.debug("Media cache invalidation finished.")
+            self.cache.save()
 
     def stop(self):
         """
         Called outside the thread to stop parsing.
-        When _stop set, all incoming paths for parsing will be thrown away.
+        Current media adding is abandoned, all its media are thrown away.
         """
-        self._stop = True
+        if self.generation is not None:
+            self.generation.next()
 
-    def init(self):
-        self._stop = False
+    def dropPending(self):
+        """
+        Called directly from main thread when playlist is cleared.
+        Media waiting for lazy (background) parsing are thrown away, except media from library folders.
+        Queue is dropped in parser thread, but before any media added later.
+        """
+        self._dropPendingSignal.emit()
+
+    @pyqtSlot()
+    def _dropPending(self):
+        self._lazy_keys = {path: key for path, key in self._lazy_keys.items() if key[0] == self.PRIORITY_LIBRARY}
+        self._lazy_queue = [(key, path) for path, key in self._lazy_keys.items()]
+        heapq.heapify(self._lazy_queue)
+        if not self._lazy_keys:
+            self._lazy_order = 0
+
+    def quit(self):
+        """
+        Called directly from main thread when application is closing. Parse workers are not awaited.
+        """
+        self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        if self.cache:
+            self.cache.save()
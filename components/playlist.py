@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+#
+# Woofer - free open-source cross-platform music player
+# Copyright (C) 2015 Milan Herbig <milanherbig[at]gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Playlist components
+- Compact playlist storage shared by media player and GUI
+- Incremental index for filtering playlist
+"""
+
+import os
+import array
+import bisect
+import logging
+import operator
+import itertools
+
+from PyQt5.QtCore import *
+
+logger = logging.getLogger(__name__)
+
+
+class PlaylistStore(QObject):
+    """
+    Columnar storage of playlist, single source of truth for media player and playlist table.
+    Directory part of paths is interned, so each track keeps only its file name, index of its directory
+    and few numbers stored in compact arrays.
+    Each track has its own id, which is stable (does not change when other tracks are removed).
+    Tracks can be looked up by row, by id or by path in O(1), position of track in play order as well.
+    Reverse indexes (path: ids, id: play position) are built on first lookup and then kept up to date.
+    Changes are announced by signals, so Qt models can be built on top of the store.
+    Lives in main thread!
+    """
+
+    aboutToInsertSignal = pyqtSignal(int, int)      # (first row, last row)
+    insertedSignal = pyqtSignal()
+    aboutToRemoveSignal = pyqtSignal(int, int)      # (first row, last row)
+    removedSignal = pyqtSignal()
+    aboutToResetSignal = pyqtSignal()
+    resetSignal = pyqtSignal()
+    changedSignal = pyqtSignal(int, int)            # (first row, last row) with changed duration or state
+    durationsChangedSignal = pyqtSignal(int, int)   # (first row, last row) with changed duration
+    orderChangedSignal = pyqtSignal()               # new play order has been set
+
+    RESET_RANGES = 100          # when removing more row ranges at once, reset is announced instead of removals
+
+    def __init__(self, parent=None):
+        super(PlaylistStore, self).__init__(parent)
+        self._init()
+
+    def _init(self):
+        self._dirs = []                         # interned directory paths
+        self._dir_ids = {}                      # directory path: index in _dirs
+        self._names = []                        # file name of track in each row
+        self._dir_index = array.array('i')      # index of directory in _dirs for each row
+        self._durations = array.array('q')      # duration in ms for each row, -1 when track is not parsed yet
+        self._missing = bytearray()             # 1 when track file doesn't exist on disk
+        self._ids = array.array('i')            # track id for each row
+        self._id_rows = array.array('i')        # row of each track id ever added, -1 when track is removed
+        self._path_ids = None                   # normalized path: track id or list of track ids
+        self._setOrder(array.array('i'))        # rows in play order (shuffled or sorted)
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def order(self):
+        return self._order
+
+    @order.setter
+    def order(self, rows):
+        """
+        Sets new play order. Order must not be modified in place, new one must be set instead,
+        so position index can be kept up to date.
+        @type rows: array.array or list of int
+        """
+        self._setOrder(rows)
+        self.orderChangedSignal.emit()
+
+    def _setOrder(self, rows):
+        self._order = rows if isinstance(rows, array.array) else array.array('i', rows)
+        self._id_positions = None               # track id: position in play order, built when needed
+
+    def appendToOrder(self, rows):
+        """
+        Appends rows to the end of play order.
+        @type rows: iterable of int
+        """
+        position = len(self._order)
+        self._order.extend(rows)
+        if self._id_positions is not None:
+            self._id_positions.extend(itertools.repeat(-1, len(self._id_rows) - len(self._id_positions)))
+            for position in range(position, len(self._order)):
+                self._id_positions[self._ids[self._order[position]]] = position
+
+    def positionOf(self, row):
+        """
+        @return: position of track in play order, -1 when track is not in play order
+        @rtype: int
+        """
+        if self._id_positions is None:
+            self._id_positions = array.array('i', [-1]) * len(self._id_rows)
+            for position, order_row in enumerate(self._order):
+                self._id_positions[self._ids[order_row]] = position
+        track_id = self._ids[row]
+        return self._id_positions[track_id] if track_id < len(self._id_positions) else -1
+
+    @staticmethod
+    def normPath(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def _buildPathIndex(self):
+        self._path_ids = {}
+        for row in range(len(self._names)):
+            self._indexPath(self.path(row), self._ids[row])
+
+    def _indexPath(self, path, track_id):
+        key = self.normPath(path)
+        ids = self._path_ids.get(key)
+        if ids is None:
+            self._path_ids[key] = track_id
+        elif isinstance(ids, list):
+            ids.append(track_id)
+        else:
+            self._path_ids[key] = [ids, track_id]
+
+    def _unindexPath(self, path, track_id):
+        key = self.normPath(path)
+        ids = self._path_ids.get(key)
+        if isinstance(ids, list):
+            ids.remove(track_id)
+            if len(ids) == 1:
+                self._path_ids[key] = ids[0]
+        elif ids == track_id:
+            del self._path_ids[key]
+
+    def idsOf(self, path):
+        """
+        @return: ids of tracks with given path (one path may be in playlist more than once)
+        @rtype: list of int
+        """
+        if self._path_ids is None:
+            self._buildPathIndex()
+        ids = self._path_ids.get(self.normPath(path), [])
+        return ids if isinstance(ids, list) else [ids]
+
+    def rowsOf(self, path):
+        """
+        @return: rows of tracks with given path
+        @rtype: list of int
+        """
+        return [self._id_rows[track_id] for track_id in self.idsOf(path)]
+
+    def path(self, row):
+        return os.path.join(self._dirs[self._dir_index[row]], self._names[row])
+
+    def name(self, row):
+        return self._names[row]
+
+    def directory(self, row):
+        return self._dirs[self._dir_index[row]]
+
+    def duration(self, row):
+        return self._durations[row]
+
+    def isMissing(self, row):
+        return bool(self._missing[row])
+
+    def trackId(self, row):
+        return self._ids[row]
+
+    def rowOf(self, track_id):
+        """
+        @return: row of track with given id or -1 when track has been removed
+        @rtype: int
+        """
+        if 0 <= track_id < len(self._id_rows):
+            return self._id_rows[track_id]
+        return -1
+
+    def trackIds(self, first_row, last_row):
+        """
+        @return: ids of tracks in given range of rows
+        @rtype: array.array
+        """
+        return self._ids[first_row:last_row + 1]
+
+    def idCount(self):
+        """
+        @return: number of track ids assigned so far (id of next added track), equals len() if nothing was removed
+        @rtype: int
+        """
+        return len(self._id_rows)
+
+    def directories(self, first_index=0):
+        """
+        @return: interned directory paths starting at given directory index
+        @rtype: list of unicode
+        """
+        return self._dirs[first_index:]
+
+    def tracksSince(self, first_id):
+        """
+        Returns file names and directory indexes (see directories()) of tracks with id starting at given id.
+        Tracks already removed have empty name and directory index 0.
+        @rtype: (list of unicode, list of int)
+        """
+        rows = self._id_rows[first_id:]
+        if -1 in rows:
+            return ([self._names[row] if row >= 0 else "" for row in rows],
+                    [self._dir_index[row] if row >= 0 else 0 for row in rows])
+        return list(map(self._names.__getitem__, rows)), list(map(self._dir_index.__getitem__, rows))
+
+    def rowsOfIds(self, track_ids):
+        """
+        @param track_ids: sorted track ids
+        @return: sorted rows of given tracks, removed tracks are left out
+        @rtype: list of int
+        """
+        if len(self._id_rows) == len(self._names):
+            return list(track_ids)          # nothing has been removed, rows are the same as ids
+        # rows of tracks keep order of their ids, removed tracks have row -1
+        return list(filter((-1).__ne__, map(self._id_rows.__getitem__, track_ids)))
+
+    def paths(self):
+        """
+        @return: generator of paths of all tracks in row order
+        """
+        prefixes = [os.path.join(directory, "") for directory in self._dirs]     # same as joining with name
+        for name, dir_index in zip(self._names, self._dir_index):
+            yield prefixes[dir_index] + name
+
+    def indexOf(self, path):
+        """
+        @return: first row with given path or -1 if path is not in playlist
+        @rtype: int
+        """
+        rows = self.rowsOf(path)
+        return min(rows) if rows else -1
+
+    def addItems(self, items):
+        """
+        Appends tracks to the end of playlist.
+        @param items: list of (path, duration), duration is -1 when track has not been parsed yet
+        @type items: list of (unicode, int)
+        @return: row of first added track
+        @rtype: int
+        """
+        first_row = len(self._names)
+        if not items:
+            return first_row
+
+        self.aboutToInsertSignal.emit(first_row, first_row + len(items) - 1)
+        for row, (path, duration) in enumerate(items, first_row):
+            directory, name = os.path.split(path)
+            dir_index = self._dir_ids.get(directory)
+            if dir_index is None:
+                dir_index = self._dir_ids[directory] = len(self._dirs)
+                self._dirs.append(directory)
+
+            self._names.append(name)
+            self._dir_index.append(dir_index)
+            self._durations.append(duration)
+            self._ids.append(len(self._id_rows))
+            if self._path_ids is not None:
+                self._indexPath(path, len(self._id_rows))
+            self._id_rows.append(row)
+        self._missing.extend(bytes(len(items)))
+        self.insertedSignal.emit()
+
+        return first_row
+
+    def removeItems(self, rows):
+        """
+        Removes tracks from playlist and from play order in a single pass.
+        Each range of adjacent rows is announced as one removal, if there are too many ranges,
+        reset is announced instead.
+        @param rows: rows to be removed, in any order
+        @type rows: iterable of int
+        """
+        removed = sorted(set(rows))
+        if not removed:
+            return
+
+        ranges = []
+        for row in removed:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+
+        keep = bytearray(b'\x01') * len(self._names)
+        for row in removed:
+            keep[row] = 0
+            self._id_rows[self._ids[row]] = -1
+            if self._path_ids is not None:
+                self._unindexPath(self.path(row), self._ids[row])
+
+        if len(ranges) > self.RESET_RANGES:
+            self.aboutToResetSignal.emit()
+            self._names = [name for name, kept in zip(self._names, keep) if kept]
+            self._dir_index = array.array('i', (value for value, kept in zip(self._dir_index, keep) if kept))
+            self._durations = array.array('q', (value for value, kept in zip(self._durations, keep) if kept))
+            self._ids = array.array('i', (value for value, kept in zip(self._ids, keep) if kept))
+            self._missing = bytearray(value for value, kept in zip(self._missing, keep) if kept)
+        else:
+            for first, last in reversed(ranges):
+                self.aboutToRemoveSignal.emit(first, last)
+                del self._names[first:last + 1]
+                del self._dir_index[first:last + 1]
+                del self._durations[first:last + 1]
+                del self._ids[first:last + 1]
+                del self._missing[first:last + 1]
+                self.removedSignal.emit()
+
+        for row in range(removed[0], len(self._ids)):
+            self._id_rows[self._ids[row]] = row
+
+        # new row of every remaining row
+        new_rows = array.array('i', bytes(4 * len(keep)))
+        next_row = 0
+        for row, kept in enumerate(keep):
+            new_rows[row] = next_row
+            next_row += kept
+        self._setOrder(array.array('i', (new_rows[row] for row in self._order if keep[row])))
+
+        if len(ranges) > self.RESET_RANGES:
+            self.resetSignal.emit()
+
+    def clear(self):
+        self.aboutToResetSignal.emit()
+        self._init()
+        self.resetSignal.emit()
+
+    def columns(self):
+        """
+        Cheap copy of all stored columns, see load().
+        @return: (dirs, names, dir_index, durations, missing, order)
+        @rtype: tuple
+        """
+        return (list(self._dirs), list(self._names), self._dir_index[:], self._durations[:],
+                self._missing[:], self._order[:])
+
+    def load(self, dirs, names, dir_index, durations, missing, order):
+        """
+        Replaces whole playlist by given columns (e.g. restored session), columns are taken as they are.
+        Track ids are assigned from zero again.
+        @type dirs: list of unicode
+        @type names: list of unicode
+        @type dir_index: array.array
+        @type durations: array.array
+        @type missing: bytearray
+        @type order: array.array
+        """
+        self.aboutToResetSignal.emit()
+        self._init()
+        self._dirs = dirs
+        self._dir_ids = {directory: index for index, directory in enumerate(dirs)}
+        self._names = names
+        self._dir_index = dir_index
+        self._durations = durations
+        self._missing = missing
+        self._ids = array.array('i', range(len(names)))
+        self._id_rows = array.array('i', range(len(names)))
+        self._setOrder(order)
+        self.resetSignal.emit()
+
+    def updateDurations(self, metadata):
+        """
+        Fills in durations of tracks parsed later (lazy mode).
+        @param metadata: list of (path, duration)
+        @type metadata: list of (unicode, int)
+        """
+        changed_rows = []
+        for path, duration in metadata:
+            for row in self.rowsOf(path):
+                self._durations[row] = duration
+                changed_rows.append(row)
+
+        if changed_rows:
+            self.durationsChangedSignal.emit(min(changed_rows), max(changed_rows))
+            self.changedSignal.emit(min(changed_rows), max(changed_rows))
+
+    def setDurations(self, first_row, durations):
+        """
+        Sets durations of consecutive rows.
+        @type first_row: int
+        @type durations: list of int
+        """
+        self._durations[first_row:first_row + len(durations)] = array.array('q', durations)
+        if durations:
+            self.durationsChangedSignal.emit(first_row, first_row + len(durations) - 1)
+            self.changedSignal.emit(first_row, first_row + len(durations) - 1)
+
+    def tracksByDirectory(self):
+        """
+        @return: tracks grouped by directory
+        @rtype: list of (unicode, list of (int, unicode))
+        """
+        groups = [[] for _ in self._dirs]
+        for name, dir_index, track_id in zip(self._names, self._dir_index, self._ids):
+            groups[dir_index].append((track_id, name))
+        return [(directory, tracks) for directory, tracks in zip(self._dirs, groups) if tracks]
+
+    def setMissing(self, rows):
+        """
+        Marks tracks, whose files don't exist on disk.
+        @type rows: list of int
+        """
+        for row in rows:
+            self._missing[row] = 1
+        if rows:
+            self.changedSignal.emit(min(rows), max(rows))
+
+
+class PlaylistFilterIndex(QObject):
+    """
+    Incremental index for instant filtering of playlist by text typed by user.
+    Query is matched (case insensitive substring) against file names and directory paths of tracks,
+    which covers title, folder and path column of playlist table.
+    File names are indexed by trigrams, so only tracks sharing the rarest trigram with query are tested.
+    Index is built on background in small steps (BUILD_CHUNK tracks per event loop iteration),
+    tracks not indexed yet are always tested. Directories are few, so they are simply scanned.
+    When query is only extended (typing), tracks matched by previous query are narrowed instead.
+    Tracks are tested by chains of builtin iterators and byte masks, no Python code runs per track.
+    Queries shorter than trigram and queries with path separator can't use the index and scan all tracks,
+    with 100k tracks it's 10-18 ms on slow CPU, i.e. slightly over one frame (16 ms), indexed queries are faster.
+    Index follows the store lazily, new tracks are picked up on next search, reset of store drops the index.
+    Lives in main thread!
+    """
+
+    BUILD_CHUNK = 1000          # tracks indexed in one step (~10 ms)
+    GRAM = 3
+
+    def __init__(self, store, parent=None):
+        """
+        @type store: PlaylistStore
+        """
+        super(PlaylistFilterIndex, self).__init__(parent)
+        self._store = store
+        self._build_timer = QTimer(self)
+        self._build_timer.setSingleShot(True)
+        self._build_timer.timeout.connect(self._buildStep)
+        self._init()
+        store.insertedSignal.connect(self._storeInserted)
+        store.aboutToResetSignal.connect(self._storeAboutToReset)
+        store.resetSignal.connect(self._storeInserted)
+
+    def _init(self):
+        self._dir_texts = []                    # lowercase directory path (with separator) for each directory
+        self._dir_runs = []                     # ranges of ids of tracks in each directory
+        self._name_texts = []                   # lowercase file name for each track id
+        self._all_ids = []                      # all track ids, candidates when all tracks may match
+        self._grams = {}                        # trigram: ids of tracks with trigram in file name
+        self._indexed = 0                       # tracks with lower ids are indexed by trigrams
+        self._last = None                       # (query, ids, names) matched by last search
+        self._stale = False                     # store has been reset, index must be dropped
+
+    def _sync(self):
+        """
+        Takes over tracks added to store since last search.
+        """
+        if self._stale:
+            self._init()
+        store = self._store
+        first_id = len(self._name_texts)
+        if first_id >= store.idCount():
+            return
+
+        for directory in store.directories(len(self._dir_texts)):
+            self._dir_texts.append(os.path.join(directory, "").lower())
+            self._dir_runs.append([])
+        names, dirs = store.tracksSince(first_id)
+        self._all_ids.extend(range(first_id, first_id + len(names)))
+        self._name_texts.extend(map(str.lower, names))
+
+        track_id = first_id
+        for dir_index, group in itertools.groupby(dirs):
+            run = range(track_id, track_id + len(list(group)))
+            runs = self._dir_runs[dir_index]
+            if runs and runs[-1].stop == run.start:
+                runs[-1] = range(runs[-1].start, run.stop)
+            else:
+                runs.append(run)
+            track_id = run.stop
+        self._last = None
+
+    @pyqtSlot()
+    def _buildStep(self):
+        self._sync()
+        grams = self._grams
+        size = self.GRAM
+        last_id = min(self._indexed + self.BUILD_CHUNK, len(self._name_texts))
+        for track_id in range(self._indexed, last_id):
+            text = self._name_texts[track_id]
+            for gram in {text[i:i + size] for i in range(len(text) - size + 1)}:
+                ids = grams.get(gram)
+                if ids is None:
+                    grams[gram] = array.array('i', (track_id,))
+                else:
+                    ids.append(track_id)
+        self._indexed = last_id
+
+        if self._indexed < len(self._name_texts):
+            self._build_timer.start(0)
+        else:
+            logger.debug("Playlist filter index built, %s tracks, %s trigrams", self._indexed, len(grams))
+
+    @pyqtSlot()
+    def _storeInserted(self):
+        if not self._build_timer.isActive():
+            self._build_timer.start(0)
+
+    @pyqtSlot()
+    def _storeAboutToReset(self):
+        self._build_timer.stop()
+        self._stale = True              # track ids are reused after reset, index is dropped on next search
+
+    @staticmethod
+    def _splitPathQuery(query):
+        """
+        Splits query after its last path separator. Match of query spanning directory and file name
+        consists of directory path ending with the head and file name starting with the tail.
+        @return: (head, tail) or None if query has no path separator
+        """
+        cut = max(query.rfind(os.sep), query.rfind(os.altsep) if os.altsep else -1) + 1
+        return (query[:cut], query[cut:]) if cut else None
+
+    def _candidates(self, query):
+        """
+        @return: (ids, names) of tracks, which may match query, ids are sorted
+        """
+        if self._last is not None and self._last[0] in query:
+            return self._last[1:]                   # query has been extended, narrow previous result
+
+        all_tracks = (self._all_ids, self._name_texts)
+        if len(query) < self.GRAM or not self._indexed or self._splitPathQuery(query):
+            return all_tracks
+
+        postings = []
+        for i in range(len(query) - self.GRAM + 1):
+            ids = self._grams.get(query[i:i + self.GRAM])
+            if ids is None:
+                postings = [()]
+                break
+            postings.append(ids)
+        ids = list(min(postings, key=len))
+        ids.extend(range(self._indexed, len(self._name_texts)))            # not indexed yet
+
+        dir_runs = [self._dir_runs[index] for index, text in enumerate(self._dir_texts) if query in text]
+        for runs in dir_runs:
+            for run in runs:
+                ids.extend(run)
+        if dir_runs:
+            # concatenated sorted runs are merged in linear time, duplicates are dropped keeping order
+            ids = list(dict.fromkeys(sorted(ids)))
+
+        if len(ids) > len(self._name_texts) // 2:
+            return all_tracks
+        return ids, list(map(self._name_texts.__getitem__, ids))
+
+    def _dirMask(self, ids, dir_hits):
+        """
+        Tracks of directory are whole ranges of ids and given ids are sorted, so matching tracks of each
+        directory are found by bisection and marked at once.
+        @param ids: sorted ids of tracks
+        @param dir_hits: byte for each directory, 1 when all its tracks match
+        @return: byte for each of given tracks, 1 when its directory matches
+        @rtype: bytearray
+        """
+        mask = bytearray(len(ids))
+        for runs in itertools.compress(self._dir_runs, dir_hits):
+            for run in runs:
+                first = bisect.bisect_left(ids, run.start)
+                last = bisect.bisect_left(ids, run.stop, first)
+                mask[first:last] = b'\x01' * (last - first)
+        return mask
+
+    def _match(self, query, ids, names):
+        """
+        @return: (ids, names) of given tracks matching query
+        """
+        split = self._splitPathQuery(query)
+        dir_hits = bytes(query in text for text in self._dir_texts)
+        if 0 not in dir_hits:
+            return ids, names
+
+        if split is None:
+            mask = bytes(map(operator.contains, names, itertools.repeat(query)))
+        else:
+            # query with path separator matches only directory paths or directory path + start of file name
+            head, tail = split
+            dir_heads = bytes(text.endswith(head) for text in self._dir_texts)
+            mask = bytes(len(ids))
+            if tail and 1 in dir_heads:
+                mask = bytes(map(str.startswith, names, itertools.repeat(tail)))
+                if 0 in dir_heads:
+                    mask = bytes(map(operator.and_, mask, self._dirMask(ids, dir_heads)))
+
+        if 1 in dir_hits:
+            dir_mask = self._dirMask(ids, dir_hits)
+            mask = (int.from_bytes(mask, 'little') | int.from_bytes(dir_mask, 'little')).to_bytes(
+                len(mask), 'little')
+
+        if 0 not in mask:
+            return ids, names
+        return list(itertools.compress(ids, mask)), list(itertools.compress(names, mask))
+
+    def search(self, text):
+        """
+        Finds tracks matching given filter text.
+        @type text: unicode
+        @return: sorted rows of matching tracks
+        @rtype: list of int
+        """
+        self._sync()
+        query = text.lower()
+        self._last = (query,) + self._match(query, *self._candidates(query))
+        return self._store.rowsOfIds(self._last[1])
+
+    def matchRows(self, text, first, last):
+        """
+        @return: rows in given range of rows matching given filter text
+        @rtype: list of int
+        """
+        self._sync()
+        ids = self._store.trackIds(first, last)
+        matched = set(self._match(text.lower(), ids, list(map(self._name_texts.__getitem__, ids)))[0])
+        return [row for row, track_id in enumerate(ids, first) if track_id in matched]
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+#
+# Woofer - free open-source cross-platform music player
+# Copyright (C) 2015 Milan Herbig <milanherbig[at]gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Session persistence components
+- Recorder of playlist changes (main thread)
+- Append-only session journal with periodic compaction (worker thread)
+- Session restore (snapshot + journal replay)
+
+Session is stored in two files:
+    snapshot - full session state written on compaction, binary (see SNAPSHOT_HEADER)
+    journal  - operations done since the snapshot, one JSON list per line, first line is ["base", snapshot_id]
+"""
+
+import os
+import sys
+import mmap
+import array
+import struct
+import itertools
+import logging
+
+import ujson
+from PyQt5.QtCore import *
+
+from components.playlist import PlaylistStore
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_MAGIC = b'WOOF'
+SNAPSHOT_VERSION = 3
+
+# snapshot file starts with header (magic, version, snapshot id, number of dirs, rows, play order items
+# and length of state), followed by sections (all little-endian):
+#   dir ends    - uint32 for each dir, end offset of dir path in dir blob
+#   dir blob    - UTF-8 encoded dir paths
+#   name ends   - uint32 for each row, end offset of file name in name blob
+#   name blob   - UTF-8 encoded file names
+#   dir index   - int32 for each row
+#   durations   - int64 for each row
+#   flags       - uint8 for each row, 1 when file doesn't exist
+#   order       - int32 for each play order item
+#   state       - JSON encoded playback state
+SNAPSHOT_HEADER = struct.Struct('<4sIIIIII')
+
+# journal operations
+OP_BASE = "base"            # ["base", snapshot_id]
+OP_ADD = "add"              # ["add", [[path, duration], ...]] - appended to playlist and to play order
+OP_REMOVE = "remove"        # ["remove", first_row, last_row]
+OP_ORDER = "order"          # ["order", [row, ...]] - new play order
+OP_DURATIONS = "durations"  # ["durations", first_row, [duration, ...]]
+OP_STATE = "state"          # ["state", {"current": int, "shuffle": bool, "repeat": bool, "volume": int}]
+
+
+def restoreSession(snapshot_file, journal_file):
+    """
+    Loads session snapshot and replays journal operations recorded after the snapshot.
+    Journal is read until the first broken line (e.g. last line written partially before crash).
+    Snapshot in old format (transposed playlist table) is accepted as well.
+    @return: dict with keys id, playlist (PlaylistStore), state, clean and journaled
+             (clean is False when journal cannot be continued and session should be compacted)
+             or None if there is no session
+    @rtype: dict or None
+    """
+    if not os.path.isfile(snapshot_file):
+        return None
+
+    with open(snapshot_file, 'rb') as f:
+        binary = f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+    store = PlaylistStore()
+    if binary:
+        clean = True
+        snapshot_id, state = readSnapshot(snapshot_file, store)
+    else:
+        # old session.dat, playlist table is saved as transposed 2D array of strings
+        with open(snapshot_file, 'r') as f:
+            snapshot = ujson.load(f)
+        clean = False
+        snapshot_id = 0
+        table_content = snapshot.get('playlist_table') or [[]]
+        items = []
+        for path, ttime in zip(table_content[-1], table_content[2] if len(table_content) > 2 else []):
+            qtime = QTime.fromString(ttime or "", "hh:mm:ss")
+            items.append((os.path.normpath(path), QTime(0, 0, 0, 0).msecsTo(qtime) if qtime.isValid() else -1))
+        store.addItems(items)
+        store.order = snapshot.get('shuffled_playlist', [])
+        state = {'current': snapshot.get('shuffled_playlist_current_index', 0),
+                 'shuffle': snapshot.get('shuffle', False),
+                 'repeat': snapshot.get('repeat', False),
+                 'volume': snapshot.get('volume', 100)}
+
+    n_ops = 0
+    journaled = 0                               # entries in journal, see SessionRecorder
+    if not os.path.isfile(journal_file):
+        clean = False
+    elif clean:
+        with open(journal_file, 'r') as f:
+            for line in f:
+                try:
+                    op = ujson.loads(line)
+                except ValueError:
+                    logger.error("Broken line in session journal, rest of the journal is ignored")
+                    clean = False
+                    break
+
+                if n_ops == 0 and op != [OP_BASE, snapshot_id]:
+                    logger.debug("Session journal doesn't belong to snapshot %s, ignored", snapshot_id)
+                    clean = False
+                    break
+
+                if op[0] == OP_ADD:
+                    first_row = store.addItems([tuple(item) for item in op[1]])
+                    store.appendToOrder(range(first_row, len(store)))
+                    journaled += len(op[1])
+                elif op[0] == OP_REMOVE:
+                    store.removeItems(range(op[1], op[2] + 1))
+                    journaled += 1
+                elif op[0] == OP_ORDER:
+                    store.order = op[1]
+                    journaled += len(op[1])
+                elif op[0] == OP_DURATIONS:
+                    store.setDurations(op[1], op[2])
+                    journaled += len(op[2])
+                elif op[0] == OP_STATE:
+                    state = op[1]
+                    journaled += 1
+                n_ops += 1
+
+    logger.debug("Session restored from snapshot %s and %s journal operations", snapshot_id, n_ops)
+    order = store.order
+    if sorted(order) != list(range(len(store))) or not (0 <= state.get('current', 0) < max(len(order), 1)):
+        raise ValueError("Restored play order doesn't match playlist!")
+
+    return {'id': snapshot_id,
+            'playlist': store,
+            'state': state,
+            'clean': clean,
+            'journaled': journaled}
+
+
+def _toLittleEndian(values):
+    if sys.byteorder == 'big':
+        values = values[:]
+        values.byteswap()
+    return values
+
+
+def writeSnapshot(snapshot_file, snapshot):
+    """
+    Writes session snapshot in binary format to given file (file is synced to disk).
+    @param snapshot: see SessionRecorder.snapshot()
+    @type snapshot: dict
+    """
+    dirs, names, dir_index, durations, missing, order = snapshot['columns']
+    dir_paths = [directory.encode('utf-8', 'surrogateescape') for directory in dirs]
+    file_names = [name.encode('utf-8', 'surrogateescape') for name in names]
+    state = ujson.dumps(snapshot['state']).encode('utf-8')
+
+    with open(snapshot_file, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snapshot['id'],
+                                     len(dirs), len(names), len(order), len(state)))
+        for blobs in (dir_paths, file_names):
+            ends = array.array('I')
+            end = 0
+            for blob in blobs:
+                end += len(blob)
+                ends.append(end)
+            f.write(_toLittleEndian(ends).tobytes())
+            f.write(b"".join(blobs))
+        f.write(_toLittleEndian(dir_index).tobytes())
+        f.write(_toLittleEndian(durations).tobytes())
+        f.write(bytes(missing))
+        f.write(_toLittleEndian(order).tobytes())
+        f.write(state)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def readSnapshot(snapshot_file, store):
+    """
+    Reads session snapshot in binary format to given playlist store.
+    File is memory-mapped, fixed-width columns are copied at once, only paths are decoded row by row.
+    @type store: PlaylistStore
+    @return: (snapshot id, playback state)
+    @rtype: (int, dict)
+    """
+    with open(snapshot_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, snapshot_id, n_dirs, n_rows, n_order, state_len = SNAPSHOT_HEADER.unpack_from(data)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported session snapshot version %s" % version)
+
+        view = memoryview(data)
+        offset = [SNAPSHOT_HEADER.size]
+
+        def column(typecode, count):
+            values = array.array(typecode)
+            size = values.itemsize * count
+            values.frombytes(view[offset[0]:offset[0] + size])
+            offset[0] += size
+            return _toLittleEndian(values)
+
+        def strings(count):
+            ends = column('I', count)
+            blob = view[offset[0]:offset[0] + (ends[-1] if count else 0)]
+            offset[0] += len(blob)
+            starts = itertools.chain((0,), ends)
+            text = str(blob, 'utf-8', 'surrogateescape')
+            if len(text) == len(blob):
+                # ASCII only, byte offsets are offsets in decoded text as well
+                return [text[start:end] for start, end in zip(starts, ends)]
+            return [str(blob[start:end], 'utf-8', 'surrogateescape') for start, end in zip(starts, ends)]
+
+        try:
+            dirs = strings(n_dirs)
+            names = strings(n_rows)
+            dir_index = column('i', n_rows)
+            durations = column('q', n_rows)
+            missing = bytearray(view[offset[0]:offset[0] + n_rows])
+            offset[0] += n_rows
+            order = column('i', n_order)
+            state = ujson.loads(bytes(view[offset[0]:offset[0] + state_len]).decode('utf-8'))
+            if offset[0] + state_len != len(data):
+                raise ValueError("Session snapshot has unexpected length")
+        finally:
+            view.release()
+
+    store.load(dirs, names, dir_index, durations, missing, order)
+    return snapshot_id, state
+
+
+class SessionRecorder(QObject):
+    """
+    Records changes of playlist store as journal operations.
+    Operations are collected and sent to session journal in batches (see FLUSH_DELAY),
+    so single playlist change costs only few appended lines on disk.
+    When journal grows bigger than session itself (or playlist is reset), snapshot of whole session is sent
+    for compaction instead.
+    Lives in main thread!
+    """
+
+    writeSignal = pyqtSignal(list)          # journal operations
+    compactSignal = pyqtSignal(dict)        # session snapshot
+
+    FLUSH_DELAY = 1000                      # in ms
+    COMPACT_MIN = 10000                     # journal may contain at least this many entries before compaction
+
+    def __init__(self, store, state_getter, parent=None):
+        """
+        @param store: recorded playlist
+        @type store: PlaylistStore
+        @param state_getter: returns current playback state (current index, shuffle, repeat, volume)
+        @type state_getter: callable
+        """
+        super(SessionRecorder, self).__init__(parent)
+        self.store = store
+        self.state_getter = state_getter
+        self.enabled = False
+        self.snapshot_id = 0
+
+        self._ops = []
+        self._journaled = 0                 # entries written to journal since last compaction
+        self._compact = False
+        self._order_changed = False
+        self._inserting = None              # (first, last) rows being inserted
+        self._durations = None              # (first, last) rows with changed durations
+        self._state = None                  # last recorded state
+
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+
+    def attach(self, snapshot_id=0, journaled=0, compact=True):
+        """
+        Starts recording. Store must be in the same state as snapshot + journal on disk,
+        otherwise compaction must be requested.
+        @param snapshot_id: id of session snapshot on disk
+        @param journaled: number of entries in journal on disk
+        @param compact: write snapshot of current session right away
+        """
+        self.snapshot_id = snapshot_id
+        self._journaled = journaled
+        self._compact = compact
+        self._state = self.state_getter()
+        self.enabled = True
+
+        self.store.aboutToInsertSignal.connect(self._storeAboutToInsert)
+        self.store.insertedSignal.connect(self._storeInserted)
+        self.store.aboutToRemoveSignal.connect(self._storeAboutToRemove)
+        self.store.resetSignal.connect(self._storeReset)
+        self.store.durationsChangedSignal.connect(self._storeDurationsChanged)
+        self.store.orderChangedSignal.connect(self._storeOrderChanged)
+        self.schedule()
+
+    @pyqtSlot()
+    def schedule(self):
+        """
+        Schedules flush of recorded operations. Called when playback state changes as well.
+        """
+        if self.enabled and not self._flush_timer.isActive():
+            self._flush_timer.start(self.FLUSH_DELAY)
+
+    def _recordDurations(self):
+        # durations are recorded by rows, so they must be written before any following row change
+        if self._durations is not None:
+            first, last = self._durations
+            self._ops.append([OP_DURATIONS, first, [self.store.duration(row) for row in range(first, last + 1)]])
+            self._journaled += last - first + 1
+            self._durations = None
+
+    @pyqtSlot(int, int)
+    def _storeAboutToInsert(self, first, last):
+        self._recordDurations()
+        self._inserting = (first, last)
+
+    @pyqtSlot()
+    def _storeInserted(self):
+        first, last = self._inserting
+        self._ops.append([OP_ADD, [[self.store.path(row), self.store.duration(row)] for row in range(first, last + 1)]])
+        self._journaled += last - first + 1
+        self.schedule()
+
+    @pyqtSlot(int, int)
+    def _storeAboutToRemove(self, first, last):
+        self._recordDurations()
+        self._ops.append([OP_REMOVE, first, last])
+        self._journaled += 1
+        self.schedule()
+
+    @pyqtSlot()
+    def _storeReset(self):
+        # playlist has been cleared or bulk removal has been done, whole session is written again
+        self._ops = []
+        self._durations = None
+        self._compact = True
+        self.schedule()
+
+    @pyqtSlot(int, int)
+    def _storeDurationsChanged(self, first, last):
+        if self._durations is not None:
+            first, last = min(first, self._durations[0]), max(last, self._durations[1])
+        self._durations = (first, last)
+        self.schedule()
+
+    @pyqtSlot()
+    def _storeOrderChanged(self):
+        self._order_changed = True
+        self.schedule()
+
+    @pyqtSlot()
+    def flush(self):
+        """
+        Sends recorded operations to session journal.
+        Called by timer, or directly when application is about to close.
+        """
+        self._flush_timer.stop()
+        if not self.enabled:
+            return
+
+        if not QSettings().value("session/saveRestoreSession", True, bool):
+            # journal would be incomplete, whole session is written when functionality is enabled again
+            self._ops = []
+            self._durations = None
+            self._order_changed = False
+            self._compact = True
+            return
+
+        self._recordDurations()
+        state = self.state_getter()
+        if self._order_changed:
+            self._ops.append([OP_ORDER, self.store.order.tolist()])
+            self._journaled += len(self.store)
+        if state != self._state:
+            self._ops.append([OP_STATE, state])
+            self._journaled += 1
+        self._order_changed = False
+        self._state = state
+
+        if self._compact or self._journaled > max(self.COMPACT_MIN, len(self.store)):
+            self.snapshot_id += 1
+            logger.debug("Compacting session journal, new snapshot %s", self.snapshot_id)
+            self.compactSignal.emit(self.snapshot(self.snapshot_id, state))
+            self._ops = []
+            self._journaled = 0
+            self._compact = False
+        elif self._ops:
+            self.writeSignal.emit(self._ops)
+            self._ops = []
+
+    def snapshot(self, snapshot_id, state):
+        """
+        Cheap copy of playlist store, serialized later in journal thread.
+        @rtype: dict
+        """
+        return {'id': snapshot_id,
+                'columns': self.store.columns(),
+                'state': state}
+
+
+class SessionJournal(QObject):
+    """
+    Writes session journal and snapshots to disk.
+    Journal is append-only, each batch of operations is written as few lines at the end of the file.
+    Snapshot is written to temporary file and renamed, then journal is started again,
+    so crash in any moment leaves restorable session on disk.
+    Journal is synced to disk periodically by autosave timer, so session survives power loss as well.
+    Session journal runs in separated thread.
+    Worker methods: SessionJournal.write(ops), SessionJournal.compact(snapshot), SessionJournal.autosave()
+    """
+
+    def __init__(self, snapshot_file, journal_file):
+        super(SessionJournal, self).__init__()
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.delay = 30 * 1000                              # 30 seconds in ms
+        self._journal = None
+        self._dirty = False                                 # journal written, but not synced to disk yet
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.autosave)
+
+        logger.debug("SessionJournal initialized")
+
+    @pyqtSlot()
+    def start(self):
+        """
+        Called when journal thread is started to schedule periodic autosave.
+        """
+        logger.debug("Scheduling session autosave - interval %s", self.delay)
+        self._timer.start(self.delay)
+
+    @pyqtSlot()
+    def autosave(self):
+        """
+        Syncs journal to disk. Skipped when nothing has been written since the last sync.
+        Thread worker called by class timer.
+        """
+        if not self._dirty or self._journal is None:
+            return
+
+        try:
+            os.fsync(self._journal.fileno())
+            self._dirty = False
+        except (IOError, OSError):
+            logger.exception("Unable to sync session journal!")
+
+    @pyqtSlot(list)
+    def write(self, ops):
+        """
+        Appends operations to the journal.
+        @type ops: list of list
+        """
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            self._journal.write("".join(ujson.dumps(op) + "\n" for op in ops))
+            self._journal.flush()
+            self._dirty = True
+        except (IOError, OSError):
+            logger.exception("Unable to write to session journal!")
+
+    @pyqtSlot(dict)
+    def compact(self, snapshot):
+        """
+        Replaces session snapshot and starts new journal.
+        @type snapshot: dict
+        """
+        logger.debug("Writing session snapshot %s...", snapshot['id'])
+        tmp_file = self.snapshot_file + ".tmp"
+        try:
+            writeSnapshot(tmp_file, snapshot)
+            os.replace(tmp_file, self.snapshot_file)
+            self._syncDir()
+
+            self._closeJournal()
+            self._journal = open(self.journal_file, 'w')
+            self.write([[OP_BASE, snapshot['id']]])
+            self.autosave()
+        except (IOError, OSError):
+            logger.exception("Unable to write session snapshot!")
+
+        logger.debug("Session snapshot written")
+
+    def _syncDir(self):
+        # renamed snapshot is durable only when directory entry is synced (not possible on Windows)
+        if sys.platform.startswith('win'):
+            return
+        try:
+            fd = os.open(os.path.dirname(self.snapshot_file) or ".", os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            logger.exception("Unable to sync session folder!")
+
+    def _closeJournal(self):
+        if self._journal is not None:
+            try:
+                self.autosave()
+                self._journal.close()
+            except (IOError, OSError):
+                logger.exception("Unable to close session journal!")
+            self._journal = None
+
+    @pyqtSlot()
+    def close(self):
+        """
+        Syncs journal to disk and stops autosave. Called when application is about to close.
+        """
+        self._timer.stop()
+        self._closeJournal()
@@ -38,7 +38,10 @@ from components.translator import tr
 
 import components.disk
 import components.media
+import components.playlist
+import components.library
 import components.scheduler
+import components.session
 import components.network
 import tools
 
@@ -72,13 +75,17 @@ class MainApp(QMainWindow, main_form.MainForm):
 
     errorSignal = pyqtSignal(int, str, str)        # (tools.Message.CRITICAL, main_text, description)
     removeFileSignal = pyqtSignal(str)
-    scanFilesSignal = pyqtSignal(str)
+    scanFilesSignal = pyqtSignal(str, int)          # (path, generation of media adding)
+    prioritizeMediaSignal = pyqtSignal(list)
+    checkMediaSignal = pyqtSignal(list, int)        # (tracks grouped by directory, generation of check)
+    watchFoldersSignal = pyqtSignal(list)           # media library folders
 
     INFO_MSG_DELAY = 5000
     WARNING_MSG_DELAY = 10000
     ERROR_MSG_DELAY = 20000
     QUEUED_SETTINGS_DELAY = 40
     TERMINATE_DELAY = 3000
+    PRIORITIZE_DELAY = 100
     
     FILES_SOURCE = 0
     PLAYLISTS_SOURCE = 1
@@ -88,18 +95,24 @@ class MainApp(QMainWindow, main_form.MainForm):
         super(MainApp, self).__init__()
         self.mediaLibFile = os.path.join(tools.DATA_DIR, 'medialib.dat')
         self.session_file = os.path.join(tools.DATA_DIR, 'session.dat')
+        self.sessionJournalFile = os.path.join(tools.DATA_DIR, 'session.journal')
+        self.scanIndexFile = os.path.join(tools.DATA_DIR, 'scanindex.dat')
+        self.mediaCacheFile = os.path.join(tools.DATA_DIR, 'mediacache.dat')
+        self.libraryFile = os.path.join(tools.DATA_DIR, 'library.db')
         self.input_path = play_path if play_path else None
         self.mediaPlayer = components.media.MediaPlayer()
 
         self.myComputerPathIndex = None
         self.homeDirIndex = None
         self.oldVolumeValue = 0
+        self.lastTick = (0, 0.0)            # last (time, position) received from media player
         self.updateOnExit = False
         self.updateExe = None
         self.availableUpdateLabel = None
         self.downloadUpdateBtn = None
         self.updateOnExit = False
         self.restartAfterUpdate = False
+        self.watchLimitReported = False
 
         # setups all GUI components from form (design part)
         self.setupUi(self)
@@ -113,6 +126,7 @@ class MainApp(QMainWindow, main_form.MainForm):
 
         # create all components in their independent threads
         self.setupDiskTools()
+        self.setupSessionJournal()
         self.setupSystemHook()
         self.setupScheduledTasks()
 
@@ -135,7 +149,8 @@ class MainApp(QMainWindow, main_form.MainForm):
         self.libraryBtn.clicked.connect(self.openLibraryDialog)
         self.mainTreeBrowser.customContextMenuRequested.connect(self.fileBrowserContextMenu)
         self.playlistTable.customContextMenuRequested.connect(self.playlistContextMenu)
-        self.playlistTable.cellDoubleClicked.connect(self.playlistPlayNow)
+        self.playlistTable.doubleClicked.connect(self.playlistDoubleClicked)
+        self.playlistFilterEdit.textChanged.connect(self.playlistFilterModel.setFilterText)
         self.progressCancelBtn.clicked.connect(self.cancelAdding)
         self.mainTreeBrowser.activated.connect(self.fileBrowserActivated)
 
@@ -194,14 +209,19 @@ class MainApp(QMainWindow, main_form.MainForm):
         """
         Initializes VLC based media player.
         Player class (basically it is only the interface) lives in main thread.
-        VlC player itself lives in separated threads!
+        VlC player itself lives in separated threads, volume fader (crossfade) as well!
         """
-        self.mediaPlayer.mediaAddedSignal.connect(self.addToPlaylist)
+        self.faderThread = QThread(self)
+        self.mediaPlayer.fader.moveToThread(self.faderThread)
+        self.faderThread.start()
+
+        self.playlistModel.setStore(self.mediaPlayer.playlist)
+        self.playlistFilterModel.setFilterIndex(
+            components.playlist.PlaylistFilterIndex(self.mediaPlayer.playlist, parent=self))
         self.mediaPlayer.playingSignal.connect(self.playing)
         self.mediaPlayer.pausedSignal.connect(self.paused)
         self.mediaPlayer.stoppedSignal.connect(self.stopped)
-        self.mediaPlayer.timeChangedSignal.connect(self.syncPlayTime)
-        self.mediaPlayer.positionChangedSignal.connect(self.syncSeeker)
+        self.mediaPlayer.tickTocSignal.connect(self.syncPlayback)
         self.mediaPlayer.mediaChangedSignal.connect(self.displayCurrentMedia)
         self.mediaPlayer.errorSignal.connect(self.displayErrorMsg)
 
@@ -210,33 +230,101 @@ class MainApp(QMainWindow, main_form.MainForm):
         Setup classes for disk digging (media searching) and asynchronous parsing.
         Scanner and parser live in separated threads.
         """
+        # every media adding has its own generation, cancelled adding is abandoned by scanner and parser
+        self.addingGeneration = components.disk.Generation()
+
         # asynchronous scanner
-        self.scanner = components.disk.RecursiveBrowser(names_filter=FileExt)
+        self.scanner = components.disk.RecursiveBrowser(names_filter=FileExt, index_file=self.scanIndexFile,
+                                                        generation=self.addingGeneration)
         self.scannerThread = QThread(self)
 
         # asynchronous parser
-        self.parser = components.media.MediaParser()
+        self.parser = components.media.MediaParser(cache_file=self.mediaCacheFile,
+                                                   backpressure=self.scanner.backpressure,
+                                                   generation=self.addingGeneration)
         self.parserThread = QThread(self)
 
+        # media library, filled by parser
+        self.library = components.library.MediaLibrary(self.libraryFile)
+        self.libraryThread = QThread(self)
+
         # asynchronous file/folder remover
         self.fileRemover = components.disk.MoveToTrash()
         self.fileRemoverThread = QThread(self)
 
+        # asynchronous checker of missing playlist files
+        self.existenceChecker = components.disk.ExistenceChecker()
+        self.existenceCheckerThread = QThread(self)
+
+        # live watcher of media library folders, keeps scan index and media library up to date
+        self.folderWatcher = components.disk.FolderWatcher(names_filter=FileExt, index=self.scanner.index)
+        self.folderWatcherThread = QThread(self)
+
         self.scanFilesSignal.connect(self.scanner.scanFiles)
-        self.parser.finishedSignal.connect(self.clearProgress)
-        self.parser.finishedSignal.connect(self.mediaPlayer.mediaAddingFinished)
-        self.parser.dataParsedSignal.connect(self.mediaPlayer.addMedia)
+        self.parser.finishedSignal.connect(self.addingFinished)
+        self.parser.dataParsedSignal.connect(self.addParsedMedia)
+        self.parser.metadataParsedSignal.connect(self.updatePlaylistDurations)
+        self.parser.libraryRecordsSignal.connect(self.library.update)
+        self.parser.libraryRemovedSignal.connect(self.library.remove)
+        self.libraryThread.started.connect(self.library.start)
         self.scanner.parseDataSignal.connect(self.parser.parseMedia)
         self.scanner.errorSignal.connect(self.displayErrorMsg)
         self.removeFileSignal.connect(self.fileRemover.remove)
         self.fileRemover.errorSignal.connect(self.displayErrorMsg)
+        self.parserThread.started.connect(self.parser.start)
+        self.prioritizeMediaSignal.connect(self.parser.prioritizeMedia)
+        self.checkMediaSignal.connect(self.existenceChecker.check)
+        self.existenceChecker.missingSignal.connect(self.markMissingMedia)
+        self.watchFoldersSignal.connect(self.folderWatcher.setFolders)
+        self.folderWatcher.mediaChangedSignal.connect(self.parser.parseLibraryMedia)
+        self.folderWatcher.mediaRemovedSignal.connect(self.library.remove)
+        self.folderWatcher.usageSignal.connect(self.folderWatcherUsage)
+        self.folderWatcherThread.started.connect(self.folderWatcher.start)
+        self.mediaPlayer.playlist.resetSignal.connect(self.playlistReset)
         self.scanner.moveToThread(self.scannerThread)
         self.parser.moveToThread(self.parserThread)
+        self.library.moveToThread(self.libraryThread)
         self.fileRemover.moveToThread(self.fileRemoverThread)
+        self.existenceChecker.moveToThread(self.existenceCheckerThread)
+        self.folderWatcher.moveToThread(self.folderWatcherThread)
 
         self.scannerThread.start()
         self.parserThread.start()
+        self.libraryThread.start()
         self.fileRemoverThread.start()
+        self.existenceCheckerThread.start()
+        self.folderWatcherThread.start()
+
+        # media visible in playlist and the next one are parsed first in lazy mode
+        self.prioritizeTimer = QTimer(self)
+        self.prioritizeTimer.setSingleShot(True)
+        self.prioritizeTimer.timeout.connect(self.prioritizeVisibleMedia)
+        self.playlistTable.verticalScrollBar().valueChanged.connect(self.schedulePrioritization)
+        self.playlistTable.verticalScrollBar().rangeChanged.connect(self.schedulePrioritization)
+        self.mediaPlayer.mediaAddedSignal.connect(self.schedulePrioritization)
+        self.mediaPlayer.mediaChangedSignal.connect(self.schedulePrioritization)
+        self.shuffleBtn.toggled.connect(self.schedulePrioritization)
+
+    def setupSessionJournal(self):
+        """
+        Setup session recorder and journal. Changes of playlist are recorded in main thread
+        and written (and periodically synced) to disk in separated thread.
+        """
+        self.sessionRecorder = components.session.SessionRecorder(self.mediaPlayer.playlist, self.sessionState,
+                                                                  parent=self)
+        self.sessionJournal = components.session.SessionJournal(self.session_file, self.sessionJournalFile)
+        self.sessionJournalThread = QThread(self)
+        self.sessionJournal.moveToThread(self.sessionJournalThread)
+        self.sessionJournalThread.started.connect(self.sessionJournal.start)
+
+        self.sessionRecorder.writeSignal.connect(self.sessionJournal.write)
+        self.sessionRecorder.compactSignal.connect(self.sessionJournal.compact)
+        self.mediaPlayer.mediaChangedSignal.connect(self.sessionRecorder.schedule)
+        self.volumeSlider.valueChanged.connect(self.sessionRecorder.schedule)
+        self.shuffleBtn.toggled.connect(self.sessionRecorder.schedule)
+        self.repeatBtn.toggled.connect(self.sessionRecorder.schedule)
+
+        self.sessionJournalThread.start()
 
     def setupScheduledTasks(self):
         """
@@ -338,14 +426,19 @@ class MainApp(QMainWindow, main_form.MainForm):
         folders_to_display = [tr['HOME_DIR'], tr['MY_COMPUTER'], ]         # save table of contents
 
         # add only valid folders from medialib to folderCombobox
+        watched_folders = []
         for folder in mediaFolders:
             folder = QDir.cleanPath(folder)       # normalize => remove redundant slashes, etc.
             if os.path.isdir(folder):
                 self.folderCombo.addItem(folder)
                 folders_to_display.append(folder)
+                watched_folders.append(folder)
             else:
                 self.errorSignal.emit(tools.ErrorMessages.WARNING, tr['WARNING_NONEXIST_MEDIALIB_PATH'], "")
 
+        # keep media library in sync with its folders
+        self.watchFoldersSignal.emit(watched_folders)
+
         # set back previously selected (current) item in folderCombo if exists (may be deleted => set root folder)
         if current_folder_text in folders_to_display:
             self.folderCombo.setCurrentIndex(folders_to_display.index(current_folder_text))
@@ -388,104 +481,91 @@ class MainApp(QMainWindow, main_form.MainForm):
 
     def loadSession(self):
         """
-        Loads last session information
-        e.g. last playlist, etc.
+        Loads last session information (snapshot and journal of changes done after it)
+        e.g. last playlist, etc. Playlist changes are recorded from now on.
         """
-        if not os.path.isfile(self.session_file):
-            logger.debug("No session file found, skipping")
-            return
-
         if not QSettings().value("session/saveRestoreSession", True, bool):
             logger.debug("Skipped session load, functionality disabled")
+            self.sessionRecorder.attach()
             return
 
         logger.debug("Loading session...")
         try:
-            with open(self.session_file, 'r') as f:
-                session_data = ujson.load(f)
+            session_data = components.session.restoreSession(self.session_file, self.sessionJournalFile)
         except Exception:
             logger.exception("Unable to load data from session file!")
+            session_data = None
+
+        if session_data is None:
+            logger.debug("No session restored")
+            self.sessionRecorder.attach()
+            return
+
+        state = session_data['state']
+        volume = state.get('volume', 100)
+        self.volumeSlider.setValue(volume)
+        self.mediaPlayer.setVolume(volume)
+        self.volumeChanged(self.volumeSlider.value())
+
+        # do not load playlist
+        # if not program started with input path argument (i.e. user double clicked on .mp3 file and woofer opened)
+        if not self.input_path:
+            self.loadPlaylist(session_data)
+
+            # load shuffle, repeat and volume
+            self.mediaPlayer.shuffle_mode = state.get('shuffle', False)
+            self.mediaPlayer.repeat_mode = state.get('repeat', False)
+            self.shuffleBtn.blockSignals(True)
+            self.shuffleBtn.setChecked(self.mediaPlayer.shuffle_mode)
+            self.shuffleBtn.blockSignals(False)
+            self.mediaShuffleAction.setChecked(self.mediaPlayer.shuffle_mode)
+            self.repeatBtn.blockSignals(True)
+            self.repeatBtn.setChecked(self.mediaPlayer.repeat_mode)
+            self.repeatBtn.blockSignals(False)
+            self.mediaRepeatAction.setChecked(self.mediaPlayer.repeat_mode)
+
+            # journal on disk continues, unless it is broken or in old format
+            self.sessionRecorder.attach(session_data['id'], session_data['journaled'],
+                                        compact=not session_data['clean'])
         else:
-            volume = session_data.get('volume', 100)
-            self.volumeSlider.setValue(volume)
-            self.mediaPlayer.setVolume(volume)
-            self.volumeChanged(self.volumeSlider.value())
-
-            # do not load playlist
-            # if not program started with input path argument (i.e. user double clicked on .mp3 file and woofer opened)
-            if not self.input_path:
-                self.loadPlaylist(session_data)
-
-                # load shuffle, repeat and volume
-                self.mediaPlayer.shuffle_mode = session_data.get('shuffle', False)
-                self.mediaPlayer.repeat_mode = session_data.get('repeat', False)
-                self.shuffleBtn.blockSignals(True)
-                self.shuffleBtn.setChecked(self.mediaPlayer.shuffle_mode)
-                self.shuffleBtn.blockSignals(False)
-                self.mediaShuffleAction.setChecked(self.mediaPlayer.shuffle_mode)
-                self.repeatBtn.blockSignals(True)
-                self.repeatBtn.setChecked(self.mediaPlayer.repeat_mode)
-                self.repeatBtn.blockSignals(False)
-                self.mediaRepeatAction.setChecked(self.mediaPlayer.repeat_mode)
-
-            logger.debug("Session restored successfully")
+            self.sessionRecorder.attach(session_data['id'])
+
+        logger.debug("Session restored successfully")
 
     def loadPlaylist(self, session_data):
         """
         Loads and sets saved playlist from last session (from disk)
-        @param session_data: data from disk are stored in this dict file
+        @param session_data: restored session, see components.session.restoreSession()
+        @type session_data: dict
         """
-        table_content = session_data.get('playlist_table', [])              # playlistTable content
-        if not table_content:                                               # playlist is empty
-            return
-
-        n_cols = len(table_content)
-        n_rows = len(table_content[0])
-        if n_rows == 0:
+        playlist = session_data['playlist']
+        if not len(playlist):
             logger.debug("No playlist to restore")
             return
 
-        paths_list = table_content[-1]
-
-        logger.debug("Restoring items from playlist in playlistTable...")
-        self.playlistTable.setRowCount(n_rows)
-        self.playlistTable.setColumnCount(n_cols)
-
-        column_with_path = self.playlistTable.columnCount() - 1
-        for row in range(n_rows):
-            for column in range(n_cols):
-                cell_data = table_content[column][row]      # 2D array is saved as transposed
-                if cell_data:       # empty or None cell -> skip
-                    item = QTableWidgetItem(cell_data)
-                    item.setToolTip(cell_data)
-                    self.playlistTable.setItem(row, column, item)
-
-                    # if given track doesn't exist, set whole row italic and gray
-                    if column == column_with_path and not os.path.exists(cell_data):
-                        for i in (0, 1, 2):        # title and duration items
-                            title_item = self.playlistTable.item(row, i)
-                            if title_item:          # could be None
-                                font = title_item.font()
-                                font.setItalic(True)
-                                title_item.setFont(font)
-                                title_item.setForeground(QBrush(Qt.gray))
+        logger.debug("Restoring items from playlist in mediaPlayer object...")
+        self.mediaPlayer.restorePlaylist(playlist, session_data['state'].get('current', 0))
 
+        # if given track doesn't exist, whole row is set italic and gray later
+        self.checkMediaSignal.emit(self.mediaPlayer.playlist.tracksByDirectory(),
+                                   self.existenceChecker.generation.next())
         self.playlistTable.resizeColumnToContents(1)
 
-        logger.debug("Restoring items from playlist in mediaPlayer object...")
-        self.mediaPlayer.shuffled_playlist = session_data.get('shuffled_playlist', [])
-        self.mediaPlayer.shuffled_playlist_current_index = session_data.get('shuffled_playlist_current_index', 0)
-
-        if paths_list and len(self.mediaPlayer.shuffled_playlist) == len(paths_list):
-            self.mediaPlayer.addMedia(paths_list, restoring_session=True)
+        # set current media in table as current item and scroll to the item
+        currentIndex = self.playlistTable.sourceIndex(
+            self.mediaPlayer.shuffled_playlist[self.mediaPlayer.shuffled_playlist_current_index])
+        self.playlistTable.setCurrentIndex(currentIndex)
+        self.playlistTable.scrollTo(currentIndex, QAbstractItemView.PositionAtCenter)
 
-            # set current media in table as current item and scroll to the item
-            self.playlistTable.setCurrentCell(self.mediaPlayer.shuffled_playlist[self.mediaPlayer.shuffled_playlist_current_index], 0)
-            self.playlistTable.scrollToItem(self.playlistTable.currentItem(), QAbstractItemView.PositionAtCenter)
-        else:
-            logger.error("Error when loading/restoring playlist: "
-                         "paths_list and shuffled_playlist are not the same length")
-            self.clearPlaylist()
+    def sessionState(self):
+        """
+        @return: playback state saved in session
+        @rtype: dict
+        """
+        return {'current': self.mediaPlayer.shuffled_playlist_current_index,
+                'shuffle': self.mediaPlayer.shuffle_mode,
+                'repeat': self.mediaPlayer.repeat_mode,
+                'volume': self.volumeSlider.value()}
 
     def saveSettings(self):
         """
@@ -504,60 +584,12 @@ class MainApp(QMainWindow, main_form.MainForm):
 
     def saveSession(self):
         """
-        Save current session information
-        e.g. current playlist, etc.
+        Writes the rest of recorded session changes to disk.
+        Whole session is already on disk (see components.session), so only few last changes are written.
         """
-        if not QSettings().value("session/saveRestoreSession", True):
-            logger.debug("Skipped session save, functionality disabled")
-            return
-
-        session_data = {}
-
-        self.savePlaylist(session_data)
-
-        session_data['shuffle'] = self.mediaPlayer.shuffle_mode
-        session_data['repeat'] = self.mediaPlayer.repeat_mode
-        session_data['volume'] = self.volumeSlider.value()
-
-        logger.debug("Dumping session file to disk...")
-        with open(self.session_file, 'w') as f:
-            ujson.dump(session_data, f)
-
-    def savePlaylist(self, session_data):
-        """
-        Dump information about playlist from playlist_table and from media_player
-        @param session_data: all information are stored to this dict file
-        """
-        logger.debug("Dumping and saving playlist information...")
-
-        n_cols = self.playlistTable.columnCount()
-        n_rows = self.playlistTable.rowCount()
-
-        n_shuf_play = len(self.mediaPlayer.shuffled_playlist)
-        n_media_list = self.mediaPlayer._media_list.count()     # access to protected for sanity-check purposes only
-        shuf_play_index = self.mediaPlayer.shuffled_playlist_current_index
-        if (n_shuf_play == n_rows == n_media_list) and (shuf_play_index == 0 or 0 < shuf_play_index < n_shuf_play):
-            # array is transposed ... [ [1st col], [2nd col], etc ] for easier manipulation when loading data back
-            table_content = [[None for x in range(n_rows)] for x in range(n_cols)]
-            for row in range(self.playlistTable.rowCount()):
-                for column in range(self.playlistTable.columnCount()):
-                    item = self.playlistTable.item(row, column)
-
-                    if item is not None:
-                        table_content[column][row] = self.playlistTable.item(row, column).text()
-                    else:
-                        table_content[column][row] = None
-
-            session_data['playlist_table'] = table_content
-            session_data['shuffled_playlist'] = self.mediaPlayer.shuffled_playlist
-            session_data['shuffled_playlist_current_index'] = self.mediaPlayer.shuffled_playlist_current_index
-
-        else:
-            # woofer may crash during some playlist operation, so records may be inconsistent
-            logger.error("Playlist (gui) and _media_list are not are not the same length!")
-            session_data['playlist_table'] = []
-            session_data['shuffled_playlist'] = []
-            session_data['shuffled_playlist_current_index'] = 0
+        logger.debug("Flushing session journal to disk...")
+        self.sessionRecorder.flush()
+        QMetaObject.invokeMethod(self.sessionJournal, "close", Qt.BlockingQueuedConnection)
 
     @pyqtSlot(str)
     def messageFromAnotherInstance(self, message):
@@ -594,31 +626,10 @@ class MainApp(QMainWindow, main_form.MainForm):
         """
         logger.debug("File (media) browser activated, now checking if activated index if file or folder...")
 
-        # stop current media adding
-        self.scanner.stop()
-        self.parser.stop()
-        n_tries = 300       # wait 3 sec
-        while self.mediaPlayer.adding_media and (n_tries > 0):
-            QCoreApplication.processEvents()        # to unfreeze gui
-            self.thread().msleep(33)            # to get responsible look&feel
-            n_tries -= 1
-
-        if self.mediaPlayer.adding_media:
-            logger.error("Media adding didn't stopped!")
-            self.displayErrorMsg(tools.ErrorMessages.ERROR,
-                                 "Can't add another media when media adding is already running", "")
-            return
-
-        self.scanner.init()     # reset _stop flags
-        self.parser.init()
-
         fileInfo = self.fileBrowserModel.fileInfo(modelIndex)
         targetPath = fileInfo.absoluteFilePath()
         logger.debug("Initializing playing of path: %s", targetPath)
-        self.mediaPlayer.clearMediaList()
-        self.mediaPlayer.initMediaAdding(append=False)
-        self.scanFilesSignal.emit(targetPath)                 # asynchronously recursively search for media files
-        self.displayProgress(tr['PROGRESS_ADDING'])
+        self.playPath(targetPath, append=False)             # current media adding is abandoned
 
     @pyqtSlot(QPoint)
     def fileBrowserContextMenu(self, pos):
@@ -668,16 +679,17 @@ class MainApp(QMainWindow, main_form.MainForm):
         elif choice is removeFromDisk:
             path = fileInfo.absoluteFilePath()
             path = os.path.normpath(path)
-            if path in self.mediaPlayer.media_list:
+            row = self.mediaPlayer.playlist.indexOf(path)
+            if row != -1:
                 # implicitly removes media from media player
-                self.playlistRemFromDisk(self.mediaPlayer.media_list.index(path))
+                self.playlistRemFromDisk([row])
             else:
                 logger.debug("Removing path '%s' to Trash", path)
                 self.removeFileSignal.emit(path)
 
     @pyqtSlot(QPoint)
     def playlistContextMenu(self, pos):
-        selected_rows = [sel_index.row() for sel_index in self.playlistTable.selectionModel().selectedRows()]
+        selected_rows = self.playlistTable.selectedSourceRows()
         if not selected_rows:
             return
 
@@ -777,50 +789,126 @@ class MainApp(QMainWindow, main_form.MainForm):
         # libraryDialog.finished.connect(self.setupFileBrowser)
         settingsDialog.exec_()
 
-    @pyqtSlot(list, bool)
-    def addToPlaylist(self, sources, append):
-        """
-        Sets and adds media files to playlist.
-        @param sources: list of (path, duration)
-        @type sources: list of (unicode, int)
-        """
-        lastItemIndex = self.playlistTable.rowCount() if append else 0
-        self.playlistTable.setRowCount(lastItemIndex + len(sources))
-
-        i = 0
-        for path, duration in sources:
-            titleItem = QTableWidgetItem(os.path.basename(path))
-            titleItem.setToolTip(os.path.basename(path))
-            folder = os.path.dirname(path)
-            fname = os.path.basename(folder)
-            if fname.strip().lower().startswith(("cd", "dvd")):
-                parent_fname = os.path.basename(os.path.dirname(folder))
-                fname = parent_fname + "/" + fname
-            folderNameItem = QTableWidgetItem(fname)
-            folderNameItem.setToolTip(fname)
-            ttime = QTime(0, 0, 0, 0).addMSecs(duration).toString("hh:mm:ss")
-            durationItem = QTableWidgetItem(ttime)
-            durationItem.setToolTip(ttime)
-            pathItem = QTableWidgetItem(path)
-            self.playlistTable.setItem(i + lastItemIndex, 0, titleItem)
-            self.playlistTable.setItem(i + lastItemIndex, 1, folderNameItem)
-            self.playlistTable.setItem(i + lastItemIndex, 2, durationItem)
-            self.playlistTable.setItem(i + lastItemIndex, 3, pathItem)
-            i += 1
+    @pyqtSlot(list)
+    def updatePlaylistDurations(self, metadata):
+        """
+        Called when media added in lazy mode are parsed on background to fill in their durations.
+        @param metadata: list of (path, duration)
+        @type metadata: list of (unicode, int)
+        """
+        self.mediaPlayer.playlist.updateDurations(metadata)
+
+    @pyqtSlot()
+    def schedulePrioritization(self):
+        """
+        Called when playlist is scrolled or changed. Visible media are prioritized after short delay,
+        so fast scrolling or adding does not flood the parser.
+        """
+        if not self.prioritizeTimer.isActive():
+            self.prioritizeTimer.start(self.PRIORITIZE_DELAY)
+
+    @pyqtSlot()
+    def prioritizeVisibleMedia(self):
+        """
+        Sends not yet parsed media from visible playlist rows (and the next media to play) to parser,
+        so they are parsed before off-screen media.
+        """
+        rowCount = self.playlistModel.rowCount()
+        viewRowCount = self.playlistFilterModel.rowCount()
+        if not viewRowCount:
+            return
+
+        firstRow = max(self.playlistTable.rowAt(0), 0)
+        lastRow = self.playlistTable.rowAt(self.playlistTable.viewport().height() - 1)
+        if lastRow == -1:
+            lastRow = viewRowCount - 1
+
+        rows = [self.playlistFilterModel.sourceRow(row) for row in range(firstRow, lastRow + 1)]
+        nextRow = self.mediaPlayer.nextItemIndex()
+        if nextRow is not None and nextRow < rowCount:
+            rows.insert(0, nextRow)
+
+        paths = [self.playlistModel.path(row) for row in rows if self.playlistModel.duration(row) < 0]
+
+        if paths:
+            self.prioritizeMediaSignal.emit(paths)
 
     @pyqtSlot()
     def clearPlaylist(self):
         logger.debug("Clear media playlist called")
         self.mediaPlayer.clearMediaList()
-
-        self.playlistTable.clearContents()
-        self.playlistTable.setRowCount(0)
+        self.parser.dropPending()
 
     @pyqtSlot()
     def cancelAdding(self):
         logger.debug("Canceling adding new files to playlist (parsing).")
-        self.scanner.stop()
-        self.parser.stop()
+        self.addingGeneration.next()            # scanner and parser abandon their work
+        self.clearProgress()
+        if self.mediaPlayer.adding_media:
+            self.mediaPlayer.mediaAddingFinished()
+
+    @pyqtSlot(int, int, int)
+    def folderWatcherUsage(self, watched, limit, polled):
+        """
+        Called when watched media library folders change. When system limit of watched directories is reached,
+        user is told that some folders are only checked from time to time.
+        @param watched: number of watched directories (watch descriptors used)
+        @param limit: max number of watch descriptors or -1 if unknown
+        @param polled: number of directories which could not be watched
+        """
+        if polled and not self.watchLimitReported:
+            self.watchLimitReported = True
+            self.displayErrorMsg(tools.ErrorMessages.INFO, tr['WATCH_LIMIT_REACHED'] % (watched, polled), "")
+
+    @pyqtSlot(list, int)
+    def markMissingMedia(self, track_ids, generation):
+        """
+        Called when existence checker finds playlist files, which don't exist on disk.
+        @param track_ids: ids of missing tracks
+        @type track_ids: list of int
+        @param generation: generation of check
+        @type generation: int
+        """
+        if self.existenceChecker.generation.isStale(generation):
+            return
+
+        playlist = self.mediaPlayer.playlist
+        playlist.setMissing([row for row in map(playlist.rowOf, track_ids) if row != -1])
+
+    @pyqtSlot()
+    def playlistReset(self):
+        # track ids are reused when playlist is cleared, results of running existence check would be wrong
+        if not len(self.mediaPlayer.playlist):
+            self.existenceChecker.stop()
+
+    @pyqtSlot(list, int)
+    def addParsedMedia(self, mlist, generation):
+        """
+        Called when parser sends parsed media. Media of cancelled media adding are thrown away.
+        @param mlist: list of (unicode_path, duration, media_object)
+        @param generation: generation of media adding
+        @type generation: int
+        """
+        if self.addingGeneration.isStale(generation):
+            for path, duration, media in mlist:
+                if media is not None:
+                    media.release()
+            return
+
+        self.mediaPlayer.addMedia(mlist)
+
+    @pyqtSlot(int)
+    def addingFinished(self, generation):
+        """
+        Called when parser finished media adding.
+        @param generation: generation of finished media adding
+        @type generation: int
+        """
+        if self.addingGeneration.isStale(generation):
+            return
+
+        self.clearProgress()
+        self.mediaPlayer.mediaAddingFinished()
 
     @pyqtSlot(int, str, str)
     def displayErrorMsg(self, er_type, text, details=" "):
@@ -972,6 +1060,24 @@ class MainApp(QMainWindow, main_form.MainForm):
         self.mediaPlayPauseAction.setIcon(icon)
         self.mediaPlayPauseAction.setText(tr['PLAY'])
 
+    @pyqtSlot(int, float)
+    def syncPlayback(self, play_time, position):
+        """
+        Called periodically by media player (see MediaPlayer.tick_rate).
+        Time label and seeker are not updated while window is minimized or hidden,
+        they are synced when window is restored.
+        @param play_time: time in milliseconds
+        @type play_time: int
+        @param position: relative position from [0; 1]
+        @type position: float
+        """
+        self.lastTick = (play_time, position)
+        if self.isMinimized() or not self.isVisible():
+            return
+
+        self.syncPlayTime(play_time)
+        self.syncSeeker(position)
+
     @pyqtSlot(int)
     def syncPlayTime(self, value):
         """
@@ -1003,15 +1109,16 @@ class MainApp(QMainWindow, main_form.MainForm):
         @param last_index: previous position of media in media_list
         @type last_index: int
         """
-        # remove icon from previous item (playlist row)
-        last_item = self.playlistTable.item(last_index, 0)
-        null_icon = QIcon()
-        last_item.setIcon(null_icon)
+        # move play icon from previous row to current playlist row
+        self.playlistModel.flushInserts()
+        self.playlistModel.setPlayingRow(current_index)
 
-        # set play icon to current item (current playlist row)
-        self.playlistTable.setCurrentCell(current_index, 0)          # select the entire row due to table selection behaviour
-        current_item = self.playlistTable.item(current_index, 0)
-        current_item.setIcon(QIcon(QPixmap(":/icons/media-play.png")))
+        # select the entire row due to table selection behaviour
+        self.playlistTable.setCurrentIndex(self.playlistTable.sourceIndex(current_index))
+
+    @pyqtSlot(QModelIndex)
+    def playlistDoubleClicked(self, index):
+        self.playlistPlayNow(row=self.playlistTable.sourceRow(index))
 
     @pyqtSlot()
     def playlistPlayNow(self, row=None, col=None):
@@ -1020,11 +1127,11 @@ class MainApp(QMainWindow, main_form.MainForm):
         @param row: song row number
         @param col: ignore - just slot requirement
         """
-        index = self.playlistTable.currentRow() if row is None else row
+        index = self.playlistTable.sourceRow(self.playlistTable.currentIndex()) if row is None else row
         if index == -1:
             return
 
-        fileName = os.path.basename(self.playlistTable.item(index, self.playlistTable.columnCount()-1).text())
+        fileName = os.path.basename(self.playlistModel.path(index))
         logger.debug("Play now called, playing #%s song from playlist named '%s'.", index, fileName)
 
         self.mediaPlayer.play(index)
@@ -1036,18 +1143,19 @@ class MainApp(QMainWindow, main_form.MainForm):
         @param rows: row numbers in playlist table
         """
         if rows is None:
-            rows = [sel_index.row() for sel_index in self.playlistTable.selectionModel().selectedRows()]
+            rows = self.playlistTable.selectedSourceRows()
             rows = sorted(rows, reverse=True)
 
         if not rows:
             return
 
-        for row in rows:
-            fileName = os.path.basename(self.playlistTable.item(row, self.playlistTable.columnCount()-1).text())
-            logger.debug("Removing from playlist #%s song named '%s'", row, fileName)
+        if len(rows) == 1:
+            fileName = os.path.basename(self.playlistModel.path(rows[0]))
+            logger.debug("Removing from playlist #%s song named '%s'", rows[0], fileName)
+        else:
+            logger.debug("Removing %s songs from playlist", len(rows))
 
-            self.playlistTable.removeRow(row)
-            self.mediaPlayer.removeItem(row)
+        self.mediaPlayer.removeItems(rows)
 
     @pyqtSlot()
     def playlistRemFromDisk(self, rows=None):
@@ -1056,31 +1164,34 @@ class MainApp(QMainWindow, main_form.MainForm):
         @param rows: row numbers in playlist table
         """
         if rows is None:
-            rows = [sel_index.row() for sel_index in self.playlistTable.selectionModel().selectedRows()]
+            rows = self.playlistTable.selectedSourceRows()
             rows = sorted(rows, reverse=True)
 
         if not rows:
             return
 
-        for row in rows:
-            filePath = self.playlistTable.item(row, self.playlistTable.columnCount()-1).text()
-            fileName = os.path.basename(filePath)
-            self.playlistRemFromPlaylist((row,))
+        filePaths = [self.playlistModel.path(row) for row in rows]
+        self.playlistRemFromPlaylist(rows)
 
+        for row, filePath in zip(rows, filePaths):
+            fileName = os.path.basename(filePath)
             logger.debug("Removing to Trash #%s song named '%s' on path '%s'", row, fileName, filePath)
             self.removeFileSignal.emit(filePath)
 
     def playPath(self, targetPath, append):
         """
         Initializes scanning, parsing and adding new media files from given path.
+        When playlist is replaced, media adding in progress (if any) is abandoned, new one starts immediately.
         @type targetPath: unicode
         @type append: bool
         """
+        generation = self.addingGeneration.current if append else self.addingGeneration.next()
         if not append:
             self.mediaPlayer.clearMediaList()
+            self.parser.dropPending()
 
         self.mediaPlayer.initMediaAdding(append=append)
-        self.scanFilesSignal.emit(targetPath)                 # asynchronously recursively search for media files
+        self.scanFilesSignal.emit(targetPath, generation)     # asynchronously recursively search for media files
         self.displayProgress(tr['PROGRESS_ADDING'])
 
     @pyqtSlot(bool)
@@ -1344,6 +1455,16 @@ class MainApp(QMainWindow, main_form.MainForm):
         self.restartAfterUpdate = True
         self.close()
 
+    def changeEvent(self, event):
+        """
+        Syncs time label and seeker skipped while window was minimized.
+        :type event: QEvent
+        """
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized() and self.seekerSlider.isEnabled():
+            self.syncPlayTime(self.lastTick[0])
+            self.syncSeeker(self.lastTick[1])
+        super(MainApp, self).changeEvent(event)
+
     def closeEvent(self, event):
         """
         Method called when close event caught.
@@ -1353,28 +1474,41 @@ class MainApp(QMainWindow, main_form.MainForm):
         self.hkHook.stop_listening()    # stop hotkey listener
         self.updater.stop()             # stop downloading if any
         self.scanner.stop()             # stop hard disk browsing
-        self.parser.stop()              # stop media parsing
+        self.parser.quit()              # stop media parsing
         self.logCleaner.stop()          # stop scheduled timer or file listing/removing
         self.fileRemover.stop()         # nothing here
+        self.existenceChecker.stop()    # abandon checking of missing files
+        self.folderWatcher.stop()       # abandon walking of newly watched folders
         self.mediaPlayer.quit()         # stop media player playback (libvlc)
 
         self.saveSettings()             # save session and app configuration
+        QMetaObject.invokeMethod(self.library, "close", Qt.BlockingQueuedConnection)
 
         self.thread().msleep(100)
 
         self.scannerThread.quit()
         self.parserThread.quit()
+        self.libraryThread.quit()
         self.logCleanerThread.quit()
         self.fileRemoverThread.quit()
+        self.existenceCheckerThread.quit()
+        self.folderWatcherThread.quit()
+        self.sessionJournalThread.quit()
         self.hkHookThread.quit()
         self.updaterThread.quit()
+        self.faderThread.quit()
 
         self.scannerThread.wait(self.TERMINATE_DELAY)
         self.parserThread.wait(self.TERMINATE_DELAY)
+        self.libraryThread.wait(self.TERMINATE_DELAY)
         self.logCleanerThread.wait(self.TERMINATE_DELAY)
         self.fileRemoverThread.wait(self.TERMINATE_DELAY)
+        self.existenceCheckerThread.wait(self.TERMINATE_DELAY)
+        self.folderWatcherThread.wait(self.TERMINATE_DELAY)
+        self.sessionJournalThread.wait(self.TERMINATE_DELAY)
         self.hkHookThread.wait(self.TERMINATE_DELAY)
         self.updaterThread.wait(self.TERMINATE_DELAY)
+        self.faderThread.wait(self.TERMINATE_DELAY)
 
         if self.hkHookThread.isRunning():
             logger.error("hkHookThread still running after timeout! Thread will be terminated.")
@@ -1391,5 +1525,5 @@ class MainApp(QMainWindow, main_form.MainForm):
             else:
                 logger.error("Unable to locate Woofer updater launcher at '%s'!", self.updateExe)
 
-        self.playlistTable.clear()  # fixes Python crashing on exit (no one knows why)
+        self.mediaPlayer.playlist.clear()       # fixes Python crashing on exit (no one knows why)
         event.accept()              # emits quit events
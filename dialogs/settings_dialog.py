@@ -58,6 +58,10 @@ class SettingsDialog(QDialog, Ui_settingsDialog):
         self.settings = QSettings()
 
         self.followSymChBox.setChecked(self.settings.value("components/disk/RecursiveBrowser/follow_symlinks", False, bool))
+        self.parallelScanChBox.setChecked(self.settings.value("components/disk/RecursiveBrowser/parallel_scan", False, bool))
+        self.lazyParsingChBox.setChecked(self.settings.value("components/media/MediaParser/lazy_parsing", False, bool))
+        self.gaplessChBox.setChecked(self.settings.value("components/media/MediaPlayer/gapless", False, bool))
+        self.crossfadeSpinBox.setValue(self.settings.value("components/media/MediaPlayer/crossfade", 0, int))
         self.saveRestoreSessionChBox.setChecked(self.settings.value("session/saveRestoreSession", True, bool))
         self.checkUpdatesChBox.setChecked(self.settings.value("components/scheduler/Updater/check_updates", True, bool))
         self.downUpdatesChBox.setChecked(self.settings.value("components/scheduler/Updater/auto_updates", False, bool))
@@ -89,6 +93,10 @@ class SettingsDialog(QDialog, Ui_settingsDialog):
         """
         logger.debug("Resetting factory default settings to GUI")
         self.followSymChBox.setChecked(False)
+        self.parallelScanChBox.setChecked(False)
+        self.lazyParsingChBox.setChecked(False)
+        self.gaplessChBox.setChecked(False)
+        self.crossfadeSpinBox.setValue(0)
         self.saveRestoreSessionChBox.setChecked(True)
         self.checkUpdatesChBox.setChecked(True)
         self.channelCombo.setCurrentIndex(0)
@@ -123,6 +131,10 @@ class SettingsDialog(QDialog, Ui_settingsDialog):
         restart_dialog = False
 
         self.settings.setValue("components/disk/RecursiveBrowser/follow_symlinks", self.followSymChBox.isChecked())
+        self.settings.setValue("components/disk/RecursiveBrowser/parallel_scan", self.parallelScanChBox.isChecked())
+        self.settings.setValue("components/media/MediaParser/lazy_parsing", self.lazyParsingChBox.isChecked())
+        self.settings.setValue("components/media/MediaPlayer/gapless", self.gaplessChBox.isChecked())
+        self.settings.setValue("components/media/MediaPlayer/crossfade", self.crossfadeSpinBox.value())
         self.settings.setValue("session/saveRestoreSession", self.saveRestoreSessionChBox.isChecked())
         self.settings.setValue("components/scheduler/Updater/check_updates", self.checkUpdatesChBox.isChecked())
         self.settings.setValue("components/scheduler/Updater/auto_updates", self.downUpdatesChBox.isChecked())
@@ -21,14 +21,17 @@ All GUI components from main dialog initialized here.
 """
 
 from . import icons_rc
+import bisect
 import logging
 import os
+import time
 
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 
 from components.translator import tr
+from components.playlist import PlaylistStore
 
 logger = logging.getLogger(__name__)
 
@@ -125,7 +128,370 @@ class VolumePopup(QWidget):
         self.volumeValue.setText(str(value) + "%")
 
 
-class PlaylistTable(QTableWidget):
+class PlaylistModel(QAbstractTableModel):
+    """
+    Model of playlist table built on top of PlaylistStore shared with media player.
+    Displayed texts (title, folder name, formatted duration, tooltips) are computed on demand in data(),
+    so only rows visible in the view are ever touched.
+    Rows appended to store are not inserted to views one batch by one, they are committed together
+    at most every INSERT_INTERVAL ms, so adding thousands of small folders doesn't flood views with layout work.
+    """
+
+    TITLE_COLUMN = 0
+    FOLDER_COLUMN = 1
+    DURATION_COLUMN = 2
+    PATH_COLUMN = 3
+    UNKNOWN_DURATION = "--:--:--"
+    INSERT_INTERVAL = 50                # ms
+
+    def __init__(self, parent=None):
+        super(PlaylistModel, self).__init__(parent)
+        self._store = None
+        self._row_count = 0                     # rows committed to views, following rows are pending
+        self._last_commit = 0.0
+        self._insert_timer = QTimer(self)
+        self._insert_timer.setSingleShot(True)
+        self._insert_timer.timeout.connect(self.flushInserts)
+        self._folder_names = {}                 # directory: displayed folder name
+        self._playing_id = -1                   # track id of media with play icon
+        self._play_icon = QIcon(QPixmap(":/icons/media-play.png"))
+        self._headers = [tr['PLAYLIST_TITLE'], tr['PLAYLIST_FNAME'], tr['PLAYLIST_DURATION'], tr['PLAYLIST_PATH']]
+        self.setStore(PlaylistStore(self))
+
+    def store(self):
+        """
+        @rtype: PlaylistStore
+        """
+        return self._store
+
+    def setStore(self, store):
+        """
+        Sets playlist store displayed by this model (usually the one owned by media player).
+        @type store: PlaylistStore
+        """
+        self.beginResetModel()
+        if self._store is not None:
+            for signal, slot in self._storeConnections(self._store):
+                signal.disconnect(slot)
+        self._store = store
+        self._row_count = len(store)
+        self._insert_timer.stop()
+        self._folder_names = {}
+        self._playing_id = -1
+        for signal, slot in self._storeConnections(store):
+            signal.connect(slot)
+        self.endResetModel()
+
+    def _storeConnections(self, store):
+        return ((store.insertedSignal, self._storeInserted),
+                (store.aboutToRemoveSignal, self._storeAboutToRemove),
+                (store.removedSignal, self.endRemoveRows),
+                (store.aboutToResetSignal, self.beginResetModel),
+                (store.resetSignal, self._storeReset),
+                (store.changedSignal, self._storeChanged))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self._headers[section]
+        return super(PlaylistModel, self).headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        column = index.column()
+        if role == Qt.DisplayRole or role == Qt.ToolTipRole:
+            return self.text(row, column)
+        elif role == Qt.DecorationRole:
+            if column == self.TITLE_COLUMN and self._store.trackId(row) == self._playing_id:
+                return self._play_icon
+        elif role == Qt.FontRole:
+            if self._store.isMissing(row):
+                font = QFont()
+                font.setItalic(True)
+                return font
+        elif role == Qt.ForegroundRole:
+            if self._store.isMissing(row):
+                return QBrush(Qt.gray)
+        return None
+
+    def text(self, row, column):
+        """
+        Returns text displayed in given cell.
+        @rtype: unicode
+        """
+        if column == self.TITLE_COLUMN:
+            return self._store.name(row)
+        elif column == self.FOLDER_COLUMN:
+            folder = self._store.directory(row)
+            fname = self._folder_names.get(folder)
+            if fname is None:
+                fname = os.path.basename(folder)
+                if fname.strip().lower().startswith(("cd", "dvd")):
+                    parent_fname = os.path.basename(os.path.dirname(folder))
+                    fname = parent_fname + "/" + fname
+                self._folder_names[folder] = fname
+            return fname
+        elif column == self.DURATION_COLUMN:
+            duration = self._store.duration(row)
+            if duration < 0:
+                return self.UNKNOWN_DURATION           # will be updated when media is parsed
+            return QTime(0, 0, 0, 0).addMSecs(duration).toString("hh:mm:ss")
+        return self._store.path(row)
+
+    def path(self, row):
+        return self._store.path(row)
+
+    def duration(self, row):
+        return self._store.duration(row)
+
+    def setPlayingRow(self, row):
+        """
+        Moves play icon to given row.
+        """
+        changed_rows = [r for r in (self._store.rowOf(self._playing_id), row) if 0 <= r < self._row_count]
+        self._playing_id = self._store.trackId(row) if 0 <= row < len(self._store) else -1
+        for r in changed_rows:
+            index = self.index(r, self.TITLE_COLUMN)
+            self.dataChanged.emit(index, index)
+
+    @pyqtSlot()
+    def flushInserts(self):
+        """
+        Commits all rows appended to store since last commit to views at once.
+        Must be called before rows just added to store are accessed through model indexes.
+        """
+        self._insert_timer.stop()
+        if self._row_count >= len(self._store):
+            return
+
+        self.beginInsertRows(QModelIndex(), self._row_count, len(self._store) - 1)
+        self._row_count = len(self._store)
+        self.endInsertRows()
+        self._last_commit = time.perf_counter()
+
+    @pyqtSlot()
+    def _storeInserted(self):
+        if not self._insert_timer.isActive():
+            elapsed = (time.perf_counter() - self._last_commit) * 1000
+            self._insert_timer.start(max(0, int(self.INSERT_INTERVAL - elapsed)))
+
+    @pyqtSlot(int, int)
+    def _storeAboutToRemove(self, first, last):
+        self.flushInserts()                     # store is still consistent with pending rows here
+        self.beginRemoveRows(QModelIndex(), first, last)
+        self._row_count -= last - first + 1
+
+    @pyqtSlot()
+    def _storeReset(self):
+        self._row_count = len(self._store)
+        self._insert_timer.stop()
+        self._folder_names = {}
+        if not len(self._store):
+            self._playing_id = -1           # track ids are reused when playlist is cleared
+        self.endResetModel()
+
+    @pyqtSlot(int, int)
+    def _storeChanged(self, first, last):
+        last = min(last, self._row_count - 1)           # pending rows are read from store when committed
+        if first <= last:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, self.columnCount() - 1))
+
+
+class PlaylistFilterModel(QAbstractProxyModel):
+    """
+    Proxy model showing only playlist rows matching filter text.
+    Matching rows are found by PlaylistFilterIndex and kept as sorted list of source rows,
+    so mapping rows both ways is cheap (direct lookup or bisect) and no rows are hidden in view.
+    With empty filter the proxy is identity and all changes of source model are forwarded as they are.
+    With filter set, inserted source rows are matched and appended, removed and changed rows are
+    translated to proxy ranges, so selection and scroll position survive changes of playlist.
+    """
+
+    def __init__(self, parent=None):
+        super(PlaylistFilterModel, self).__init__(parent)
+        self._index = None
+        self._text = ""
+        self._rows = None                       # sorted source rows matching filter, None when not filtered
+        self._removing = None                   # (first proxy row, last proxy row + 1, removed count)
+
+    def setSourceModel(self, model):
+        """
+        @type model: PlaylistModel
+        """
+        self.beginResetModel()
+        source = self.sourceModel()
+        if source is not None:
+            for signal, slot in self._sourceConnections(source):
+                signal.disconnect(slot)
+        super(PlaylistFilterModel, self).setSourceModel(model)
+        for signal, slot in self._sourceConnections(model):
+            signal.connect(slot)
+        self._refilter()
+        self.endResetModel()
+
+    def _sourceConnections(self, model):
+        return ((model.rowsAboutToBeInserted, self._sourceAboutToInsert),
+                (model.rowsInserted, self._sourceInserted),
+                (model.rowsAboutToBeRemoved, self._sourceAboutToRemove),
+                (model.rowsRemoved, self._sourceRemoved),
+                (model.modelAboutToBeReset, self.beginResetModel),
+                (model.modelReset, self._sourceReset),
+                (model.dataChanged, self._sourceDataChanged))
+
+    def setFilterIndex(self, index):
+        """
+        Sets index used for searching, filter text is applied again.
+        @type index: components.playlist.PlaylistFilterIndex
+        """
+        self.beginResetModel()
+        self._index = index
+        self._refilter()
+        self.endResetModel()
+
+    def filterText(self):
+        return self._text
+
+    @pyqtSlot(str)
+    def setFilterText(self, text):
+        """
+        Shows only rows matching given text, empty text shows all rows.
+        @type text: unicode
+        """
+        if text.strip() == self._text:
+            return
+        self.beginResetModel()
+        self._text = text.strip()
+        self._refilter()
+        self.endResetModel()
+
+    def _refilter(self):
+        if not self._text or self._index is None or self.sourceModel() is None:
+            self._rows = None
+            return
+
+        start_time = time.perf_counter()
+        rows = self._index.search(self._text)
+        row_count = self.sourceModel().rowCount()
+        if rows and rows[-1] >= row_count:
+            del rows[bisect.bisect_left(rows, row_count):]         # pending rows come with their insertion
+        self._rows = rows
+        logger.debug("Playlist filtered by '%s', %s rows matched in %.1f ms",
+                     self._text, len(rows), (time.perf_counter() - start_time) * 1000)
+
+    def isFiltered(self):
+        return self._rows is not None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().rowCount() if self._rows is None else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().columnCount()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < self.rowCount() and 0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        if index is None:
+            return super(PlaylistFilterModel, self).parent()
+        return QModelIndex()
+
+    def mapToSource(self, proxyIndex):
+        if not proxyIndex.isValid():
+            return QModelIndex()
+        row = proxyIndex.row() if self._rows is None else self._rows[proxyIndex.row()]
+        return self.sourceModel().index(row, proxyIndex.column())
+
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        row = sourceIndex.row()
+        if self._rows is not None:
+            position = bisect.bisect_left(self._rows, row)
+            if position == len(self._rows) or self._rows[position] != row:
+                return QModelIndex()
+            row = position
+        return self.createIndex(row, sourceIndex.column())
+
+    def sourceRow(self, row):
+        """
+        @return: row of source model (== playlist row) shown in given proxy row
+        @rtype: int
+        """
+        return row if self._rows is None else self._rows[row]
+
+    @pyqtSlot(QModelIndex, int, int)
+    def _sourceAboutToInsert(self, parent, first, last):
+        if self._rows is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    @pyqtSlot(QModelIndex, int, int)
+    def _sourceInserted(self, parent, first, last):
+        if self._rows is None:
+            self.endInsertRows()
+            return
+
+        rows = self._index.matchRows(self._text, first, last)          # rows are always appended
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+            self._rows.extend(rows)
+            self.endInsertRows()
+
+    @pyqtSlot(QModelIndex, int, int)
+    def _sourceAboutToRemove(self, parent, first, last):
+        if self._rows is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            return
+
+        first_row = bisect.bisect_left(self._rows, first)
+        last_row = bisect.bisect_right(self._rows, last)
+        self._removing = (first_row, last_row, last - first + 1)
+        if first_row < last_row:
+            self.beginRemoveRows(QModelIndex(), first_row, last_row - 1)
+
+    @pyqtSlot(QModelIndex, int, int)
+    def _sourceRemoved(self, parent, first, last):
+        if self._rows is None:
+            self.endRemoveRows()
+            return
+
+        first_row, last_row, count = self._removing
+        self._removing = None
+        following = self._rows[last_row:]
+        del self._rows[first_row:]
+        self._rows.extend(row - count for row in following)
+        if first_row < last_row:
+            self.endRemoveRows()
+
+    @pyqtSlot()
+    def _sourceReset(self):
+        self._refilter()
+        self.endResetModel()
+
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def _sourceDataChanged(self, topLeft, bottomRight):
+        first, last = topLeft.row(), bottomRight.row()
+        if self._rows is not None:
+            first = bisect.bisect_left(self._rows, first)
+            last = bisect.bisect_right(self._rows, last) - 1
+        if first <= last:
+            self.dataChanged.emit(self.index(first, topLeft.column()), self.index(last, bottomRight.column()))
+
+
+class PlaylistTable(QTableView):
 
     def __init__(self, parent):
         super(PlaylistTable, self).__init__(parent)
@@ -138,12 +504,12 @@ class PlaylistTable(QTableWidget):
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setGridStyle(Qt.DotLine)
-        self.setColumnCount(4)
-        self.setRowCount(0)
-        self.setHorizontalHeaderItem(0, QTableWidgetItem())
-        self.setHorizontalHeaderItem(1, QTableWidgetItem())
-        self.setHorizontalHeaderItem(2, QTableWidgetItem())
-        self.setHorizontalHeaderItem(3, QTableWidgetItem())
+        self.playlistModel = PlaylistModel(self)
+        self.filterModel = PlaylistFilterModel(self)
+        self.filterModel.setSourceModel(self.playlistModel)
+        self.setModel(self.filterModel)
+        self.model().rowsAboutToBeInserted.connect(self._suspendUpdates)
+        self.model().rowsInserted.connect(self._resumeUpdates)
         vheader = self.verticalHeader()
         vheader.setDefaultSectionSize(vheader.minimumSectionSize())
         vheader.setSectionResizeMode(QHeaderView.Fixed)
@@ -152,7 +518,7 @@ class PlaylistTable(QTableWidget):
         hheader.setSectionResizeMode(1, QHeaderView.Stretch)
         hheader.setSectionResizeMode(2, QHeaderView.ResizeToContents)
         hheader.setDefaultSectionSize(300)
-        self.setColumnHidden(self.columnCount() - 1, True)
+        self.setColumnHidden(PlaylistModel.PATH_COLUMN, True)
         self.setColumnWidth(1, 100)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
 
@@ -163,6 +529,35 @@ class PlaylistTable(QTableWidget):
         self.delShortcut.setAutoRepeat(False)
         self.shiftDelShortcut.setAutoRepeat(False)
 
+    def sourceRow(self, index):
+        """
+        @return: playlist row shown in given index of this view, -1 for invalid index
+        @rtype: int
+        """
+        return self.filterModel.sourceRow(index.row()) if index.isValid() else -1
+
+    def sourceIndex(self, row):
+        """
+        @return: index of this view showing given playlist row, invalid index when row is filtered out
+        @rtype: QModelIndex
+        """
+        return self.filterModel.mapFromSource(self.playlistModel.index(row, 0))
+
+    def selectedSourceRows(self):
+        """
+        @return: playlist rows of selected rows in this view
+        @rtype: list of int
+        """
+        return [self.sourceRow(index) for index in self.selectionModel().selectedRows()]
+
+    @pyqtSlot()
+    def _suspendUpdates(self):
+        self.setUpdatesEnabled(False)           # whole commit of inserted rows is painted at once
+
+    @pyqtSlot()
+    def _resumeUpdates(self):
+        self.setUpdatesEnabled(True)
+
 
 class MainTreeBrowserTreeView(QTreeView):
 
@@ -326,7 +721,12 @@ class MainForm(object):
         self.mainRightVLayout.setSpacing(0)
         self.mainRightVLayout.setContentsMargins(0, 0, 0, 0)
         # PLAYLIST
+        self.playlistFilterEdit = QLineEdit(self.layoutWidget1)
+        self.playlistFilterEdit.setClearButtonEnabled(True)
+        self.mainRightVLayout.addWidget(self.playlistFilterEdit)
         self.playlistTable = PlaylistTable(self.layoutWidget1)
+        self.playlistModel = self.playlistTable.playlistModel
+        self.playlistFilterModel = self.playlistTable.filterModel
         self.mainRightVLayout.addWidget(self.playlistTable)
         # CONTROLS
         self.controlsFrame = QFrame(self.layoutWidget1)
@@ -522,10 +922,7 @@ class MainForm(object):
     def retranslateUi(self, MainWindow):
         self.folderLbl.setText(tr['SOURCE_FOLDER_TITLE'])
         self.libraryBtn.setToolTip(tr['MEDIA_LIBRARY_TOOLTIP'])
-        self.playlistTable.horizontalHeaderItem(0).setText(tr['PLAYLIST_TITLE'])
-        self.playlistTable.horizontalHeaderItem(1).setText(tr['PLAYLIST_FNAME'])
-        self.playlistTable.horizontalHeaderItem(2).setText(tr['PLAYLIST_DURATION'])
-        self.playlistTable.horizontalHeaderItem(3).setText(tr['PLAYLIST_PATH'])
+        self.playlistFilterEdit.setPlaceholderText(tr['PLAYLIST_FILTER'])
         self.timeLbl.setText("00:00:00")
         # self.playPauseBtn.setShortcut("Ctrl+Alt+P")
         self.menuMedia.setTitle(tr['MEDIA'])
@@ -27,7 +27,7 @@ from components.translator import tr
 class Ui_settingsDialog(object):
     def setupUi(self, settingsDialog):
         settingsDialog.setObjectName("settingsDialog")
-        settingsDialog.resize(351, 251)
+        settingsDialog.resize(351, 337)
         settingsDialog.setModal(True)
         self.verticalLayout_2 = QVBoxLayout(settingsDialog)
         self.verticalLayout_2.setObjectName("verticalLayout_2")
@@ -48,6 +48,37 @@ class Ui_settingsDialog(object):
         self.followSymChBox.setChecked(True)
         self.followSymChBox.setObjectName("followSymChBox")
         self.verticalLayout.addWidget(self.followSymChBox)
+        self.parallelScanChBox = QCheckBox(self.frame)
+        self.parallelScanChBox.setChecked(False)
+        self.parallelScanChBox.setObjectName("parallelScanChBox")
+        self.verticalLayout.addWidget(self.parallelScanChBox)
+        self.lazyParsingChBox = QCheckBox(self.frame)
+        self.lazyParsingChBox.setChecked(False)
+        self.lazyParsingChBox.setObjectName("lazyParsingChBox")
+        self.verticalLayout.addWidget(self.lazyParsingChBox)
+        self.playbackLbl = QLabel(self.frame)
+        font = QFont()
+        font.setBold(True)
+        font.setWeight(75)
+        self.playbackLbl.setFont(font)
+        self.playbackLbl.setObjectName("playbackLbl")
+        self.verticalLayout.addWidget(self.playbackLbl)
+        self.gaplessChBox = QCheckBox(self.frame)
+        self.gaplessChBox.setChecked(False)
+        self.gaplessChBox.setObjectName("gaplessChBox")
+        self.playbackLayout = QHBoxLayout()
+        self.playbackLayout.setObjectName("playbackLayout")
+        self.playbackLayout.addWidget(self.gaplessChBox)
+        spacerItem = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
+        self.playbackLayout.addItem(spacerItem)
+        self.crossfadeLbl = QLabel(self.frame)
+        self.crossfadeLbl.setObjectName("crossfadeLbl")
+        self.playbackLayout.addWidget(self.crossfadeLbl)
+        self.crossfadeSpinBox = QSpinBox(self.frame)
+        self.crossfadeSpinBox.setRange(0, 12)
+        self.crossfadeSpinBox.setObjectName("crossfadeSpinBox")
+        self.playbackLayout.addWidget(self.crossfadeSpinBox)
+        self.verticalLayout.addLayout(self.playbackLayout)
         self.sessionLbl = QLabel(self.frame)
         font = QFont()
         font.setBold(True)
@@ -126,6 +157,17 @@ class Ui_settingsDialog(object):
         settingsDialog.setWindowTitle(tr['SETTINGS_TITLE'])
         self.fileBrowserLbl.setText(tr['SETTINGS_FILE_BROWSER'])
         self.followSymChBox.setText(tr['SETTINGS_FOLLOW_SYMLINKS'])
+        self.parallelScanChBox.setText(tr['SETTINGS_PARALLEL_SCAN'])
+        self.parallelScanChBox.setToolTip(tr['SETTINGS_PARALLEL_SCAN_TOOLTIP'])
+        self.lazyParsingChBox.setText(tr['SETTINGS_LAZY_PARSING'])
+        self.lazyParsingChBox.setToolTip(tr['SETTINGS_LAZY_PARSING_TOOLTIP'])
+        self.playbackLbl.setText(tr['SETTINGS_PLAYBACK'])
+        self.gaplessChBox.setText(tr['SETTINGS_GAPLESS'])
+        self.gaplessChBox.setToolTip(tr['SETTINGS_GAPLESS_TOOLTIP'])
+        self.crossfadeLbl.setText(tr['SETTINGS_CROSSFADE'])
+        self.crossfadeSpinBox.setSuffix(" s")
+        self.crossfadeSpinBox.setSpecialValueText(tr['SETTINGS_CROSSFADE_OFF'])
+        self.crossfadeSpinBox.setToolTip(tr['SETTINGS_CROSSFADE_TOOLTIP'])
         self.sessionLbl.setText(tr['SETTINGS_SESSION'])
         self.saveRestoreSessionChBox.setText(tr['SETTINGS_SAVE_RESTORE_SESSION'])
         # self.clearSessionBtn.setText(tr['SETTINGS_CLEAR_SESSION'])